@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react'
+import { useState, useEffect, useRef } from 'react'
 import { useNavigate } from 'react-router-dom'
 import { io } from 'socket.io-client'
 import Makers from '../components/Makers.jsx'
@@ -15,7 +15,10 @@ export default function Dashboard() {
     const [stations, setStations] = useState([])
     const [violations, setViolations] = useState([])
     const [socket, setSocket] = useState(null)
+    const [degraded, setDegraded] = useState(false)
     const isLoggedIn = localStorage.getItem('isLoggedIn')
+    // Makers and stations by id, at the server's roster version (events only carry ids)
+    const rosterRef = useRef({ version: -1, makers: {}, stations: {} })
 
     // If not logged in, redirect to login page
     if (!isLoggedIn) {
@@ -47,12 +50,67 @@ export default function Dashboard() {
         return highSeverity.includes(violationType) ? 'bg-red-600' : 'bg-neutral-600'
     }
 
+    // Replace (the full roster) or merge (a roster_updated) the cached roster,
+    // and refresh the names already on screen
+    const applyRoster = (data, replace) => {
+        const roster = replace ? { makers: {}, stations: {} } : rosterRef.current
+        const makersById = { ...roster.makers }
+        const stationsById = { ...roster.stations }
+        data.makers.forEach(m => { makersById[m.id] = m })
+        data.stations.forEach(s => { stationsById[s.id] = s })
+        rosterRef.current = { version: data.version, makers: makersById, stations: stationsById }
+
+        setMakers((prevMakers) => prevMakers.map(m => makersById[m.id]
+            ? {
+                ...m,
+                name: makersById[m.id].display_name,
+                initials: getInitials(makersById[m.id].display_name),
+                external_label: makersById[m.id].external_label,
+                stationName: stationsById[m.stationId]?.name || m.stationName,
+              }
+            : m
+        ))
+        setStations((prevStations) => prevStations.map(s => stationsById[s.id]
+            ? { ...s, name: stationsById[s.id].name, assignedMakerName: makersById[s.assignedMakerId]?.display_name || s.assignedMakerName }
+            : s
+        ))
+    }
+
+    const fetchRoster = async () => {
+        try {
+            const response = await fetch('http://localhost:8080/roster')
+            applyRoster(await response.json(), true)
+        } catch (error) {
+            console.error('Failed to fetch roster:', error)
+        }
+    }
+
+    // An event about someone we don't know yet - refetch the roster. (Event
+    // roster_versions are per server process, so they aren't compared here;
+    // missed changes show up as a gap in roster_updated.)
+    const checkRoster = (data) => {
+        const roster = rosterRef.current
+        if (
+            (data.maker_id && !roster.makers[data.maker_id])
+            || (data.station_id && !roster.stations[data.station_id])
+        ) {
+            fetchRoster()
+        }
+    }
+
+    // The station status MapLayout draws: 'violation', 'in_use' or 'idle'
+    const stationStatus = (inUse, makerStatus) => {
+        if (!inUse) return 'idle'
+        return makerStatus === 'violation' ? 'violation' : 'in_use'
+    }
+
 // Fetch initial state from server
     const fetchInitialState = async () => {
         try {
             const response = await fetch('http://localhost:8080/state')
             const data = await response.json()
             console.log('Initial state loaded:', data)
+            setDegraded(!!data.degraded)
             
             // Set makers
             if (data.makers && data.makers.length > 0) {
@@ -73,6 +131,7 @@ export default function Dashboard() {
                     id: s.id,
                     name: s.name,
                     inUse: s.in_use,  // Changed from 'status' to 'inUse' (camelCase for JS)
+                    status: stationStatus(s.in_use, data.makers?.find(m => m.id === s.active_maker_id)?.status),
                     assignedMakerId: s.active_maker_id,
                     assignedMakerName: null, // Will be filled from makers
                 })))
@@ -95,6 +154,7 @@ export default function Dashboard() {
                     }),
                     description: `${v.violation_type.replace(/_/g, ' ').toLowerCase()} violation detected`,
                     image: v.image_url,
+                    thumbnail: v.thumbnail_url,
                     createdAt: v.created_at,
                     makerId: v.maker_id,
                     stationId: v.station_id,
@@ -121,28 +181,44 @@ export default function Dashboard() {
             console.log('Disconnected from WebSocket server')
         })
 
+        // Roster (names, labels) - events only carry ids, see server/roster.py
+        newSocket.on('roster', (data) => {
+            applyRoster(data, true)
+        })
+
+        newSocket.on('roster_updated', (update) => {
+            const roster = rosterRef.current
+            if (update.reload || update.version !== roster.version + 1) {
+                // Missed an update (or the server reloaded) - fetch the whole roster
+                fetchRoster()
+                return
+            }
+            applyRoster(update, false)
+        })
+
         // Listen for maker check-in events
-        newSocket.on('maker_checked_in', (makerData) => {
-            console.log('Maker checked in:', makerData)
-            
+        newSocket.on('maker_checked_in', (data) => {
+            console.log('Maker checked in:', data)
+            checkRoster(data)
+            const maker = rosterRef.current.makers[data.maker_id] || {}
+
             setMakers((prevMakers) => {
-                const existingIndex = prevMakers.findIndex(m => m.id === makerData.id)
+                const existingIndex = prevMakers.findIndex(m => m.id === data.maker_id)
                 
                 if (existingIndex !== -1) {
                     const updatedMakers = [...prevMakers]
                     updatedMakers[existingIndex] = {
                         ...updatedMakers[existingIndex],
-                        status: makerData.status,
-                        name: makerData.display_name,
+                        status: data.status,
                     }
                     return updatedMakers
                 } else {
                     return [...prevMakers, {
-                        id: makerData.id,
-                        name: makerData.display_name,
-                        initials: getInitials(makerData.display_name),
-                        status: makerData.status,
-                        external_label: makerData.external_label,
+                        id: data.maker_id,
+                        name: maker.display_name,
+                        initials: getInitials(maker.display_name),
+                        status: data.status,
+                        external_label: maker.external_label,
                         stationId: null,
                         stationName: null,
                     }]
@@ -153,77 +229,74 @@ export default function Dashboard() {
         // Listen for station_entered events
         newSocket.on('station_entered', (data) => {
             console.log('Station entered:', data)
-            
-            const { maker, station } = data
+            checkRoster(data)
+            const maker = rosterRef.current.makers[data.maker_id] || {}
+            const station = rosterRef.current.stations[data.station_id] || {}
 
-            if (maker) {
-                setMakers((prevMakers) => {
-                    const existingIndex = prevMakers.findIndex(m => m.id === maker.id)
-                    
-                    if (existingIndex !== -1) {
-                        const updatedMakers = [...prevMakers]
-                        updatedMakers[existingIndex] = {
-                            ...updatedMakers[existingIndex],
-                            status: maker.status,
-                            stationId: station?.id || null,
-                            stationName: station?.name || null,
-                        }
-                        return updatedMakers
-                    } else {
-                        return [...prevMakers, {
-                            id: maker.id,
-                            name: maker.display_name,
-                            initials: getInitials(maker.display_name),
-                            status: maker.status,
-                            external_label: maker.external_label,
-                            stationId: station?.id || null,
-                            stationName: station?.name || null,
-                        }]
+            setMakers((prevMakers) => {
+                const existingIndex = prevMakers.findIndex(m => m.id === data.maker_id)
+                
+                if (existingIndex !== -1) {
+                    const updatedMakers = [...prevMakers]
+                    updatedMakers[existingIndex] = {
+                        ...updatedMakers[existingIndex],
+                        status: data.status,
+                        stationId: data.station_id,
+                        stationName: station.name || null,
                     }
-                })
-            }
+                    return updatedMakers
+                } else {
+                    return [...prevMakers, {
+                        id: data.maker_id,
+                        name: maker.display_name,
+                        initials: getInitials(maker.display_name),
+                        status: data.status,
+                        external_label: maker.external_label,
+                        stationId: data.station_id,
+                        stationName: station.name || null,
+                    }]
+                }
+            })
 
-            if (station) {
-                setStations((prevStations) => {
-                    const existingIndex = prevStations.findIndex(s => s.id === station.id)
-                    
-                    if (existingIndex !== -1) {
-                        const updatedStations = [...prevStations]
-                        updatedStations[existingIndex] = {
-                            ...updatedStations[existingIndex],
-                            name: station.name,
-                            status: station.status,
-                            assignedMakerId: maker?.id || null,
-                            assignedMakerName: maker?.display_name || null,
-                        }
-                        return updatedStations
-                    } else {
-                        return [...prevStations, {
-                            id: station.id,
-                            name: station.name,
-                            status: station.status,
-                            assignedMakerId: maker?.id || null,
-                            assignedMakerName: maker?.display_name || null,
-                        }]
+            setStations((prevStations) => {
+                const existingIndex = prevStations.findIndex(s => s.id === data.station_id)
+                
+                if (existingIndex !== -1) {
+                    const updatedStations = [...prevStations]
+                    updatedStations[existingIndex] = {
+                        ...updatedStations[existingIndex],
+                        inUse: data.in_use,
+                        status: stationStatus(data.in_use, data.status),
+                        assignedMakerId: data.maker_id,
+                        assignedMakerName: maker.display_name || null,
                     }
-                })
-            }
+                    return updatedStations
+                } else {
+                    return [...prevStations, {
+                        id: data.station_id,
+                        name: station.name,
+                        inUse: data.in_use,
+                        status: stationStatus(data.in_use, data.status),
+                        assignedMakerId: data.maker_id,
+                        assignedMakerName: maker.display_name || null,
+                    }]
+                }
+            })
         })
 
         // Listen for station_left events
         newSocket.on('station_left', (data) => {
             console.log('Station left:', data)
-            
-            const { maker, station } = data
+            checkRoster(data)
 
             // Update maker - clear station assignment and set status to idle
-            if (maker) {
+            if (data.maker_id) {
                 setMakers((prevMakers) => {
                     return prevMakers.map(m => 
-                        m.id === maker.id 
+                        m.id === data.maker_id 
                             ? { 
                                 ...m, 
-                                status: maker.status,
+                                status: data.status,
                                 stationId: null,
                                 stationName: null,
                               }
@@ -233,60 +306,58 @@ export default function Dashboard() {
             }
 
             // Update station - clear assignment and set status to idle/available
-            if (station) {
-                setStations((prevStations) => {
-                    return prevStations.map(s => 
-                        s.id === station.id 
-                            ? { 
-                                ...s, 
-                                status: station.status,
-                                assignedMakerId: null,
-                                assignedMakerName: null,
-                              }
-                            : s
-                    )
-                })
-            }
+            setStations((prevStations) => {
+                return prevStations.map(s => 
+                    s.id === data.station_id 
+                        ? { 
+                            ...s, 
+                            inUse: data.in_use,
+                            status: stationStatus(data.in_use),
+                            assignedMakerId: null,
+                            assignedMakerName: null,
+                          }
+                        : s
+                )
+            })
         })
 
         // Listen for violation_detected events
         newSocket.on('violation_detected', (data) => {
             console.log('Violation detected:', data)
+            checkRoster(data)
             
-            const { maker, station, violation } = data
+            const { violation } = data
+            const maker = rosterRef.current.makers[data.maker_id] || {}
+            const station = rosterRef.current.stations[data.station_id] || {}
 
             // Update maker status to violation
-            if (maker) {
-                setMakers((prevMakers) => {
-                    return prevMakers.map(m => 
-                        m.id === maker.id 
-                            ? { ...m, status: maker.status }
-                            : m
-                    )
-                })
-            }
+            setMakers((prevMakers) => {
+                return prevMakers.map(m => 
+                    m.id === data.maker_id 
+                        ? { ...m, status: data.status }
+                        : m
+                )
+            })
 
-            // Update station status to violation
-            if (station) {
-                setStations((prevStations) => {
-                    return prevStations.map(s => 
-                        s.id === station.id 
-                            ? { ...s, status: station.status }
-                            : s
-                    )
-                })
-            }
+            // Show the violation on the map
+            setStations((prevStations) => {
+                return prevStations.map(s =>
+                    s.id === data.station_id
+                        ? { ...s, inUse: data.in_use, status: stationStatus(data.in_use, data.status) }
+                        : s
+                )
+            })
 
             // Add new violation to the list
             if (violation) {
                 const newViolation = {
                     id: violation.id,
-                    name: maker?.display_name || 'Unknown',
+                    name: maker.display_name || 'Unknown',
                     violation: formatViolationType(violation.violation_type),
                     violationType: violation.violation_type,
                     severity: violation.violation_type.includes('GOGGLES') || violation.violation_type.includes('PPE') ? 'high' : 'medium',
                     severityColor: getSeverityColor(violation.violation_type),
-                    location: station?.name || 'Unknown',
+                    location: station.name || 'Unknown',
                     time: new Date(violation.created_at).toLocaleTimeString('en-US', { 
                         hour: 'numeric', 
                         minute: '2-digit',
@@ -295,14 +366,52 @@ export default function Dashboard() {
                     description: `${violation.violation_type.replace(/_/g, ' ').toLowerCase()} violation detected`,
                     image: violation.image_url,
                     createdAt: violation.created_at,
-                    makerId: maker?.id,
-                    stationId: station?.id,
+                    makerId: data.maker_id,
+                    stationId: data.station_id,
                 }
 
                 setViolations((prevViolations) => {
                     return [newViolation, ...prevViolations]
                 })
             }
+
+            // Log the end-to-end latency breakdown once the alert has rendered
+            if (data.trace) {
+                requestAnimationFrame(() => {
+                    const { trace } = data
+                    const renderedAt = Date.now() / 1000
+                    console.log(`Trace ${trace.trace_id}:`, {
+                        inference_ms: trace.inference_ms,
+                        edge_ms: trace.edge_ms,
+                        server_ms: trace.server_ms,
+                        spans: trace.spans,
+                        delivery_render_ms: Math.round((renderedAt - trace.emitted_at) * 1000),
+                        total_ms: trace.captured_at ? Math.round((renderedAt - trace.captured_at) * 1000) : null,
+                    })
+                })
+            }
+        })
+
+        // Snapshot finished uploading - attach it to the violation
+        newSocket.on('violation_image_ready', (data) => {
+            setViolations((prevViolations) => {
+                return prevViolations.map(v =>
+                    v.id === data.violation_id
+                        ? { ...v, image: data.image_url, thumbnail: data.thumbnail_url }
+                        : v
+                )
+            })
+        })
+
+        // Violations resolved (one, or a whole batch) - drop them from the list
+        newSocket.on('violations_resolved', (data) => {
+            console.log('Violations resolved:', data)
+            if (data.reload) {
+                fetchInitialState()
+                return
+            }
+            const resolved = new Set(data.violation_ids)
+            setViolations((prevViolations) => prevViolations.filter(v => !resolved.has(v.id)))
         })
 
         // Listen for maker status updates
@@ -311,11 +420,20 @@ export default function Dashboard() {
             
             setMakers((prevMakers) => {
                 return prevMakers.map(maker => 
-                    maker.id === data.id 
+                    maker.id === data.maker_id 
                         ? { ...maker, status: data.status }
                         : maker
                 )
             })
+
+            // The station they're at shows their status
+            setStations((prevStations) => {
+                return prevStations.map(station =>
+                    station.assignedMakerId === data.maker_id
+                        ? { ...station, status: stationStatus(station.inUse, data.status) }
+                        : station
+                )
+            })
         })
 
         // Listen for maker checkout
@@ -323,18 +441,24 @@ export default function Dashboard() {
             console.log('Maker checked out:', data)
             
             setMakers((prevMakers) => {
-                return prevMakers.filter(maker => maker.id !== data.id)
+                return prevMakers.filter(maker => maker.id !== data.maker_id)
             })
 
             setStations((prevStations) => {
                 return prevStations.map(station => 
-                    station.assignedMakerId === data.id
-                        ? { ...station, status: 'available', assignedMakerId: null, assignedMakerName: null }
+                    station.assignedMakerId === data.maker_id
+                        ? { ...station, inUse: false, status: 'idle', assignedMakerId: null, assignedMakerName: null }
                         : station
                 )
             })
         })
 
+        // Database outage: the server keeps running from memory and queues writes
+        newSocket.on('system_status', (data) => {
+            console.log('System status:', data)
+            setDegraded(!!data.degraded)
+        })
+
         setSocket(newSocket)
 
         return () => {
@@ -382,6 +506,11 @@ export default function Dashboard() {
             {/* Navbar */}
             <Nav handleReset={handleReset} handleLogout={handleLogout} />
             <div className="fixed top-[60px] left-0 right-0 z-50">
+                {degraded && (
+                    <div className="bg-amber-500 px-4 py-1 text-center text-sm text-white">
+                        Database unavailable - showing live data, history will catch up when it's back.
+                    </div>
+                )}
                 <StickyBanner className="bg-gradient-to-r from-[#A100FF] to-[#8B00E6]">
                     <p className="text-white">
                         Makerspace will be closed on January 19th in observance of Martin Luther King Jr. Day.
@@ -0,0 +1,163 @@
+"""
+Admission control for the camera-facing routes.
+
+A runaway camera loop shouldn't be able to monopolize the database. Each
+request takes a token from its station's bucket and from its client IP's
+bucket; buckets refill at a steady rate up to a burst size. When either is
+empty the request is over the limit:
+
+- if the route can answer it without doing any work (e.g. an enter for the
+  maker who is already at that station), it is coalesced - answered from the
+  in-memory live state with "coalesced": true
+- otherwise it is rejected with 429 and a Retry-After header
+
+A bucket is two floats (tokens, last refill), so state is O(1) per station
+or IP. Buckets that have refilled completely are indistinguishable from new
+ones and are pruned. Counters per station are exposed at GET /admission.
+"""
+import math
+import sys
+import os
+import time
+from functools import wraps
+from threading import Lock
+
+from flask import request, jsonify
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import ADMISSION_STATION_RATE, ADMISSION_STATION_BURST, ADMISSION_IP_RATE, ADMISSION_IP_BURST
+from live_state import live_state
+
+# Prune full buckets once there are more than this many
+PRUNE_THRESHOLD = 10000
+
+# Counter key for requests without a known station
+OTHER = 'other'
+
+
+class TokenBuckets:
+    """Token buckets keyed by string; a missing key is a full bucket."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.enabled = rate > 0
+        self._buckets = {}   # key -> [tokens, updated_at]
+
+    def _level(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return self.burst
+        return min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+
+    def wait_time(self, key, now):
+        """Seconds until a token is available (0 if there is one now)."""
+        if not self.enabled:
+            return 0.0
+        level = self._level(key, now)
+        return 0.0 if level >= 1 else (1 - level) / self.rate
+
+    def take(self, key, now):
+        if not self.enabled:
+            return
+        self._buckets[key] = [self._level(key, now) - 1, now]
+        if len(self._buckets) > PRUNE_THRESHOLD:
+            self._prune(now)
+
+    def level(self, key, now):
+        return round(self._level(key, now), 2) if self.enabled else None
+
+    def _prune(self, now):
+        full = [key for key in self._buckets if self._level(key, now) >= self.burst]
+        for key in full:
+            del self._buckets[key]
+
+
+class AdmissionController:
+    def __init__(self):
+        self._lock = Lock()
+        self.stations = TokenBuckets(ADMISSION_STATION_RATE, ADMISSION_STATION_BURST)
+        self.ips = TokenBuckets(ADMISSION_IP_RATE, ADMISSION_IP_BURST)
+        # station_id -> [admitted, coalesced, rejected]; station-less routes and
+        # ids not in the roster share one entry so this stays bounded
+        self.counters = {}
+
+    def try_admit(self, station_id, ip):
+        """Take a token from both buckets, or neither. Returns 0 if admitted, else the Retry-After in seconds."""
+        now = time.monotonic()
+        with self._lock:
+            wait = max(
+                self.stations.wait_time(station_id, now) if station_id else 0.0,
+                self.ips.wait_time(ip, now)
+            )
+            if wait == 0:
+                if station_id:
+                    self.stations.take(station_id, now)
+                self.ips.take(ip, now)
+            return wait
+
+    def count(self, key, outcome):
+        with self._lock:
+            counters = self.counters.setdefault(key, [0, 0, 0])
+            counters[('admitted', 'coalesced', 'rejected').index(outcome)] += 1
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            per_key = {}
+            for key, (admitted, coalesced, rejected) in self.counters.items():
+                entry = {"admitted": admitted, "coalesced": coalesced, "rejected": rejected}
+                if key != OTHER:
+                    entry["tokens"] = self.stations.level(key, now)
+                per_key[key] = entry
+            return {
+                "station_limit": {"rate": self.stations.rate, "burst": self.stations.burst},
+                "ip_limit": {"rate": self.ips.rate, "burst": self.ips.burst},
+                "stations": per_key
+            }
+
+
+admission = AdmissionController()
+
+
+def _station_id():
+    data = request.get_json(silent=True) if request.is_json else request.form
+    return data.get('station_id') if data else None
+
+
+def admit(coalesce=None):
+    """
+    Rate-limit a view per station and client IP. coalesce(data) may return a
+    response for an over-limit request that can be answered without doing
+    anything (or None if it can't).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            station_id = _station_id()
+            ip = request.remote_addr or 'unknown'
+            counter_key = station_id if station_id and live_state.station(station_id) else OTHER
+
+            wait = admission.try_admit(station_id, ip)
+            if wait == 0:
+                admission.count(counter_key, 'admitted')
+                return view(*args, **kwargs)
+
+            if coalesce:
+                data = request.get_json(silent=True) if request.is_json else request.form.to_dict()
+                coalesced = coalesce(data or {})
+                if coalesced is not None:
+                    admission.count(counter_key, 'coalesced')
+                    return coalesced
+
+            admission.count(counter_key, 'rejected')
+            retry_after = max(1, math.ceil(wait))
+            response = jsonify({
+                "error": "Too many requests, slow down",
+                "retry_after": retry_after
+            })
+            response.status_code = 429
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,269 @@
+"""
+Station utilization and violation rollups.
+
+Aggregates are kept up to date as events happen instead of being computed
+from the violations table on request, so /analytics costs the same no matter
+how much history there is:
+
+- occupancy seconds per station
+- session seconds (and session count) per maker
+- violation counts per violation type
+
+each as a running total and bucketed per hour (last ANALYTICS_HOURS) and per
+day (last ANALYTICS_DAYS), in UTC. Occupancy and sessions are fed by the live
+state changes (see LiveState.add_listener): a station is occupied from the
+change that puts a maker on it until the one that frees it, and a maker's
+session runs from their maker_status row appearing until it's removed.
+Intervals still open are counted up to the time of the read. Violations are
+counted by the violation route.
+
+The rollups are in memory and per process: they start when the server does
+(stations already in use at startup count from then), and with several
+workers (run_workers.py) each worker reports its own traffic.
+"""
+import sys
+import os
+import time
+from datetime import datetime, timezone
+from threading import Lock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import ANALYTICS_HOURS, ANALYTICS_DAYS
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+class Buckets:
+    """Per-bucket {key: amount} tallies for the most recent `keep` buckets of `width` seconds."""
+
+    def __init__(self, width, keep):
+        self.width = width
+        self.keep = keep
+        self._buckets = {}   # bucket start (epoch seconds) -> {key: amount}, oldest first
+
+    def _prune(self, newest):
+        oldest_kept = newest - (self.keep - 1) * self.width
+        while self._buckets:
+            first = next(iter(self._buckets))
+            if first >= oldest_kept:
+                break
+            del self._buckets[first]
+
+    def add(self, ts, key, amount):
+        start = int(ts // self.width) * self.width
+        bucket = self._buckets.get(start)
+        if bucket is None:
+            if self._buckets and start < next(reversed(self._buckets)):
+                # Late arrival for a bucket that was never opened - keep the order
+                self._buckets = dict(sorted({**self._buckets, start: {}}.items()))
+            else:
+                self._buckets[start] = {}
+            self._prune(max(self._buckets))
+            bucket = self._buckets.get(start)
+            if bucket is None:
+                return   # older than the retention window
+        bucket[key] = bucket.get(key, 0) + amount
+
+    def add_interval(self, start, end, key):
+        """Spread the seconds of [start, end) over the buckets they fall in."""
+        while start < end:
+            boundary = min(end, (int(start // self.width) + 1) * self.width)
+            self.add(start, key, boundary - start)
+            start = boundary
+
+    def copy(self):
+        copy = Buckets(self.width, self.keep)
+        copy._buckets = {start: dict(tallies) for start, tallies in self._buckets.items()}
+        return copy
+
+    def to_dict(self, label):
+        return {label(start): tallies for start, tallies in self._buckets.items()}
+
+
+def _hour_label(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%dT%H:00Z')
+
+
+def _day_label(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%d')
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+class Rollups:
+    """Running totals and hourly/daily buckets for occupancy, sessions and violations."""
+
+    def __init__(self, hours, days):
+        self._lock = Lock()
+        self._state = None
+        self.since = time.time()
+        self._occupied = {}       # station_id -> (maker_id, since) for stations in use now
+        self._sessions = {}       # maker_id -> since, for makers checked in now
+        self.occupancy = {}       # station_id -> seconds, closed intervals
+        self.session_time = {}    # maker_id -> seconds, closed sessions
+        self.session_count = {}   # maker_id -> sessions started
+        self.violations = {}      # violation_type -> count
+        self._interval_listeners = []
+        self.series = {
+            name: (Buckets(HOUR, hours), Buckets(DAY, days))
+            for name in ('occupancy', 'sessions', 'violations')
+        }
+
+    # ------------------------------------------------------------
+    # Updates
+    # ------------------------------------------------------------
+    def attach(self, state):
+        """Start following a LiveState; whatever is in use right now counts from now."""
+        self._state = state
+        state.add_listener(self._on_change)
+        self._sync()
+
+    def on_interval(self, listener):
+        """Call listener(kind, station_id, maker_id, started, ended) for every finished
+        occupancy ('station') or session ('maker') interval. Runs under the lock; keep it short."""
+        self._interval_listeners.append(listener)
+
+    def _on_change(self, change):
+        now = time.time()
+        kind = change[0]
+        with self._lock:
+            if kind == 'set' and change[1] == 'station_status':
+                row = change[2]
+                self._station_changed(row['station_id'], row.get('active_maker_id') if row.get('in_use') else None, now)
+            elif kind == 'set' and change[1] == 'maker_status':
+                self._session_changed(change[2]['maker_id'], True, now)
+            elif kind == 'del' and change[1] == 'maker_status':
+                self._session_changed(change[2], False, now)
+            elif kind == 'del' and change[1] == 'station_status':
+                self._station_changed(change[2], None, now)
+            elif kind == 'clear':
+                for station_id in list(self._occupied):
+                    self._station_changed(station_id, None, now)
+                for maker_id in list(self._sessions):
+                    self._session_changed(maker_id, False, now)
+        if kind == 'reload':
+            self._sync()
+
+    def _sync(self):
+        """Line the open intervals up with the live state (after a startup or reload)."""
+        if self._state is None:
+            return
+        maker_status, station_status = self._state.status_rows()
+        now = time.time()
+        with self._lock:
+            in_use = {ss['station_id']: ss.get('active_maker_id') for ss in station_status if ss.get('in_use')}
+            for station_id in set(self._occupied) | set(in_use):
+                self._station_changed(station_id, in_use.get(station_id), now)
+            present = {ms['maker_id'] for ms in maker_status}
+            for maker_id in set(self._sessions) | present:
+                self._session_changed(maker_id, maker_id in present, now)
+
+    def _station_changed(self, station_id, maker_id, now):
+        current = self._occupied.get(station_id)
+        if current and current[0] == maker_id:
+            return
+        if current:
+            self._close_occupancy(station_id, current[0], current[1], now)
+            del self._occupied[station_id]
+        if maker_id:
+            self._occupied[station_id] = (maker_id, now)
+
+    def _session_changed(self, maker_id, present, now):
+        started = self._sessions.get(maker_id)
+        if present and started is None:
+            self._sessions[maker_id] = now
+            self.session_count[maker_id] = self.session_count.get(maker_id, 0) + 1
+        elif not present and started is not None:
+            del self._sessions[maker_id]
+            self.session_time[maker_id] = self.session_time.get(maker_id, 0) + (now - started)
+            for buckets in self.series['sessions']:
+                buckets.add_interval(started, now, maker_id)
+            for listener in self._interval_listeners:
+                listener('maker', None, maker_id, started, now)
+
+    def _close_occupancy(self, station_id, maker_id, started, now):
+        self.occupancy[station_id] = self.occupancy.get(station_id, 0) + (now - started)
+        for buckets in self.series['occupancy']:
+            buckets.add_interval(started, now, station_id)
+        for listener in self._interval_listeners:
+            listener('station', station_id, maker_id, started, now)
+
+    def record_violation(self, violation_type, ts=None):
+        ts = ts or time.time()
+        with self._lock:
+            self.violations[violation_type] = self.violations.get(violation_type, 0) + 1
+            for buckets in self.series['violations']:
+                buckets.add(ts, violation_type, 1)
+
+    # ------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------
+    def report(self):
+        """
+        Everything as of now. Open intervals are added to copies of the
+        totals and buckets, so the cost depends on the number of stations,
+        makers and buckets - not on how many events there have been.
+        """
+        now = time.time()
+        with self._lock:
+            occupancy = dict(self.occupancy)
+            session_time = dict(self.session_time)
+            session_count = dict(self.session_count)
+            violations = dict(self.violations)
+            series = {name: tuple(b.copy() for b in pair) for name, pair in self.series.items()}
+            occupied = dict(self._occupied)
+            sessions = dict(self._sessions)
+            since = self.since
+
+        for station_id, (_, started) in occupied.items():
+            occupancy[station_id] = occupancy.get(station_id, 0) + (now - started)
+            for buckets in series['occupancy']:
+                buckets.add_interval(started, now, station_id)
+        for maker_id, started in sessions.items():
+            session_time[maker_id] = session_time.get(maker_id, 0) + (now - started)
+            for buckets in series['sessions']:
+                buckets.add_interval(started, now, maker_id)
+
+        state = self._state
+        stations = []
+        for station_id in set(occupancy) | set(occupied):
+            station = (state.station(station_id) if state else None) or {}
+            stations.append({
+                "id": station_id,
+                "name": station.get('name'),
+                "in_use": station_id in occupied,
+                "active_maker_id": occupied[station_id][0] if station_id in occupied else None,
+                "occupied_seconds": round(occupancy.get(station_id, 0), 1)
+            })
+        makers = []
+        for maker_id in set(session_time) | set(session_count):
+            maker = (state.maker(maker_id) if state else None) or {}
+            makers.append({
+                "id": maker_id,
+                "display_name": maker.get('display_name'),
+                "present": maker_id in sessions,
+                "sessions": session_count.get(maker_id, 0),
+                "session_seconds": round(session_time.get(maker_id, 0), 1)
+            })
+
+        def rounded(buckets, label):
+            return {
+                bucket: {key: round(value, 1) for key, value in tallies.items()}
+                for bucket, tallies in buckets.to_dict(label).items()
+            }
+
+        return {
+            "since": _iso(since),
+            "generated_at": _iso(now),
+            "stations": sorted(stations, key=lambda s: -s['occupied_seconds']),
+            "makers": sorted(makers, key=lambda m: -m['session_seconds']),
+            "violations": violations,
+            "hourly": {name: rounded(pair[0], _hour_label) for name, pair in series.items()},
+            "daily": {name: rounded(pair[1], _day_label) for name, pair in series.items()}
+        }
+
+
+analytics = Rollups(ANALYTICS_HOURS, ANALYTICS_DAYS)
@@ -0,0 +1,316 @@
+"""
+Columnar archive of violation and session history.
+
+Keeps the live violations table small: resolved violations, and any older
+than ARCHIVE_AFTER_DAYS, are moved into Parquet files under ARCHIVE_DIR and
+deleted from the table. A reset (POST /logout) archives every violation
+before clearing them instead of destroying the history. Finished station
+occupancy and maker sessions (see analytics.on_interval) are archived too.
+
+    ARCHIVE_DIR/violations/day=2026-10-19/part-<time>-<id>.parquet
+    ARCHIVE_DIR/sessions/day=2026-10-19/part-<time>-<id>.parquet
+
+Files are zstd-compressed, partitioned by the UTC day of created_at
+(violations) or started_at (sessions), and sorted by that time, so
+query_archive() skips whole days by directory name and row groups by their
+min/max statistics before reading anything. Served from /violations/archive.
+
+A background job runs every ARCHIVE_INTERVAL seconds. Rows are written
+before they're deleted; a crash in between can archive a violation twice,
+which query_archive() hides by id. Sessions are buffered in memory between
+runs. Needs pyarrow (optional); without it nothing is archived or deleted.
+
+    python archive.py run                     # archive now
+    python archive.py query violations --since 2026-10-01 --station-id <uuid>
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from threading import Lock, Thread
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    print("pyarrow not installed - violation and session history won't be archived")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import (
+    supabase,
+    ARCHIVE_DIR,
+    ARCHIVE_INTERVAL,
+    ARCHIVE_AFTER_DAYS,
+    ARCHIVE_VIOLATIONS,
+    ARCHIVE_BATCH_SIZE,
+)
+from read_cache import read_cache
+
+ARCHIVE_COLUMNS = 'id,maker_id,station_id,violation_type,image_url,thumbnail_url,trace_id,created_at,resolved_at'
+
+# Ids per delete request (they go in the URL)
+DELETE_CHUNK_SIZE = 100
+
+# Time column each archived table is partitioned and sorted by
+TIME_COLUMNS = {
+    'violations': 'created_at',
+    'sessions': 'started_at',
+}
+
+if pa:
+    TIMESTAMP = pa.timestamp('us', tz='UTC')
+    SCHEMAS = {
+        'violations': pa.schema([
+            ('id', pa.string()),
+            ('maker_id', pa.string()),
+            ('station_id', pa.string()),
+            ('violation_type', pa.string()),
+            ('image_url', pa.string()),
+            ('thumbnail_url', pa.string()),
+            ('trace_id', pa.string()),
+            ('created_at', TIMESTAMP),
+            ('resolved_at', TIMESTAMP),
+            ('archived_at', TIMESTAMP),
+        ]),
+        'sessions': pa.schema([
+            ('kind', pa.string()),          # 'station' (occupancy) or 'maker' (checked in)
+            ('station_id', pa.string()),
+            ('maker_id', pa.string()),
+            ('started_at', TIMESTAMP),
+            ('ended_at', TIMESTAMP),
+            ('seconds', pa.float64()),
+        ]),
+    }
+    PARTITIONING = ds.partitioning(pa.schema([('day', pa.string())]), flavor='hive')
+
+
+def _timestamp(value):
+    """ISO string (or datetime) -> aware datetime, None stays None."""
+    if value is None:
+        return None
+    value = value if isinstance(value, datetime) else datetime.fromisoformat(value)
+    return value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _write_partitions(table, rows):
+    """Write rows to one new file per day partition. Returns the files written."""
+    time_column = TIME_COLUMNS[table]
+    by_day = {}
+    for row in rows:
+        by_day.setdefault(row[time_column].strftime('%Y-%m-%d'), []).append(row)
+
+    written = []
+    for day, day_rows in by_day.items():
+        day_rows.sort(key=lambda r: r[time_column])
+        directory = os.path.join(ARCHIVE_DIR, table, f"day={day}")
+        os.makedirs(directory, exist_ok=True)
+        name = f"part-{int(time.time())}-{uuid.uuid4().hex[:8]}.parquet"
+        # Written under a dot name first: readers ignore it until it's complete
+        tmp = os.path.join(directory, '.' + name)
+        pq.write_table(pa.Table.from_pylist(day_rows, schema=SCHEMAS[table]), tmp, compression='zstd')
+        os.replace(tmp, os.path.join(directory, name))
+        written.append(os.path.join(directory, name))
+    return written
+
+
+# ============================================================
+# Violations
+# ============================================================
+
+_archive_lock = Lock()
+
+
+def _archive_batches(build_query):
+    """Archive and delete the rows a query matches, ARCHIVE_BATCH_SIZE at a time."""
+    archived = 0
+    while True:
+        rows = build_query().order('created_at').limit(ARCHIVE_BATCH_SIZE).execute().data or []
+        if not rows:
+            return archived
+        archived_at = datetime.now(timezone.utc)
+        _write_partitions('violations', [
+            {
+                **row,
+                'created_at': _timestamp(row['created_at']),
+                'resolved_at': _timestamp(row.get('resolved_at')),
+                'archived_at': archived_at,
+            }
+            for row in rows
+        ])
+        read_cache.bump('archive')
+        ids = [row['id'] for row in rows]
+        for i in range(0, len(ids), DELETE_CHUNK_SIZE):
+            supabase.table('violations').delete().in_('id', ids[i:i + DELETE_CHUNK_SIZE]).execute()
+        archived += len(rows)
+        if len(rows) < ARCHIVE_BATCH_SIZE:
+            return archived
+
+
+def archive_violations(everything=False):
+    """
+    Move resolved violations and those older than ARCHIVE_AFTER_DAYS (or, with
+    everything=True, all of them) from the database into the archive.
+    Returns the number of rows archived.
+    """
+    if pa is None:
+        return 0
+    with _archive_lock:
+        table = lambda: supabase.table('violations').select(ARCHIVE_COLUMNS)
+        if everything:
+            return _archive_batches(table)
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat()
+        archived = _archive_batches(lambda: table().not_.is_('resolved_at', 'null'))
+        archived += _archive_batches(lambda: table().lt('created_at', cutoff))
+        return archived
+
+
+# ============================================================
+# Sessions
+# ============================================================
+
+class SessionLog:
+    """Finished occupancy/session intervals waiting to be written."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._pending = []
+
+    def record(self, kind, station_id, maker_id, started, ended):
+        if pa is None:
+            return
+        with self._lock:
+            self._pending.append({
+                'kind': kind,
+                'station_id': station_id,
+                'maker_id': maker_id,
+                'started_at': datetime.fromtimestamp(started, timezone.utc),
+                'ended_at': datetime.fromtimestamp(ended, timezone.utc),
+                'seconds': ended - started,
+            })
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if pending:
+            _write_partitions('sessions', pending)
+        return len(pending)
+
+
+sessions = SessionLog()
+
+
+# ============================================================
+# Background job
+# ============================================================
+
+def run_archive_job():
+    """One pass: write buffered sessions, then archive old and resolved violations."""
+    written = sessions.flush()
+    archived = archive_violations() if ARCHIVE_VIOLATIONS and supabase else 0
+    if written or archived:
+        print(f"Archive: {archived} violations, {written} sessions archived")
+    return archived, written
+
+
+def start_archive_job():
+    if pa is None or ARCHIVE_INTERVAL <= 0:
+        return
+
+    def run():
+        while True:
+            time.sleep(ARCHIVE_INTERVAL)
+            try:
+                run_archive_job()
+            except Exception as e:
+                print(f"Archive: job failed: {str(e)}")
+
+    Thread(target=run, name='archive-job', daemon=True).start()
+    print(f"Archive: moving history to {ARCHIVE_DIR} every {ARCHIVE_INTERVAL}s")
+
+
+# ============================================================
+# Queries
+# ============================================================
+
+def query_archive(table, since=None, until=None, columns=None, limit=None, **equals):
+    """
+    Archived rows of 'violations' or 'sessions', oldest first.
+
+    since/until (datetimes or ISO strings) bound the table's time column
+    (since <= t < until); the other keyword arguments are exact matches, e.g.
+    station_id=..., violation_type=.... Day partitions outside the range are
+    never opened, and the filter is pushed down into the Parquet reader.
+    """
+    path = os.path.join(ARCHIVE_DIR, table)
+    if pa is None or not os.path.isdir(path):
+        return []
+
+    time_column = TIME_COLUMNS[table]
+    since, until = _timestamp(since), _timestamp(until)
+    expr = None
+
+    def both(a, b):
+        return b if a is None else a & b
+
+    if since:
+        expr = both(expr, ds.field('day') >= since.strftime('%Y-%m-%d'))
+        expr = both(expr, ds.field(time_column) >= pa.scalar(since, TIMESTAMP))
+    if until:
+        expr = both(expr, ds.field('day') <= until.strftime('%Y-%m-%d'))
+        expr = both(expr, ds.field(time_column) < pa.scalar(until, TIMESTAMP))
+    for column, value in equals.items():
+        if value is not None:
+            expr = both(expr, ds.field(column) == value)
+
+    dataset = ds.dataset(path, format='parquet', partitioning=PARTITIONING)
+    wanted = columns or SCHEMAS[table].names
+    if table == 'violations' and 'id' not in wanted:
+        wanted = ['id'] + list(wanted)
+    result = dataset.to_table(columns=list(wanted), filter=expr)
+    if time_column in wanted:
+        result = result.sort_by(time_column)
+
+    rows = result.to_pylist()
+    if table == 'violations':
+        # A crash between writing and deleting can archive a row twice
+        seen = set()
+        rows = [r for r in rows if not (r['id'] in seen or seen.add(r['id']))]
+    return rows[:limit] if limit else rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MakerSafe history archive")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help="archive resolved and old violations now")
+    run.add_argument('--everything', action='store_true', help="archive every violation")
+    query = commands.add_parser('query', help="print archived rows as JSON lines")
+    query.add_argument('table', choices=sorted(TIME_COLUMNS))
+    query.add_argument('--since')
+    query.add_argument('--until')
+    query.add_argument('--station-id')
+    query.add_argument('--maker-id')
+    query.add_argument('--violation-type')
+    query.add_argument('--limit', type=int)
+    args = parser.parse_args()
+
+    if pa is None:
+        return 1
+    if args.command == 'run':
+        print(f"Archived {archive_violations(everything=args.everything)} violations")
+        return 0
+
+    equals = {'station_id': args.station_id, 'maker_id': args.maker_id}
+    if args.table == 'violations':
+        equals['violation_type'] = args.violation_type
+    for row in query_archive(args.table, since=args.since, until=args.until, limit=args.limit, **equals):
+        print(json.dumps(row, default=str))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
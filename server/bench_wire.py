@@ -0,0 +1,124 @@
+"""
+Benchmark the wire formats (see wire.py): bytes per event and encode/decode
+time for JSON, MessagePack with the JSON field names, and MessagePack with
+the schema's integer field keys and station indexes.
+
+    python bench_wire.py
+    python bench_wire.py --iterations 50000
+
+Edge events are the bodies the Pi sends; dashboard frames are the
+Socket.IO payloads the server emits, as ids only (see roster.py) and, for
+comparison, with the full maker and station objects they used to embed.
+Numbers are per event, on this machine.
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from wire import msgpack, FIELDS, VERSION_KEY, STATIONS_TOKEN_KEY, WIRE_SCHEMA_VERSION
+
+STATION_ID = str(uuid.uuid4())
+MAKER_ID = str(uuid.uuid4())
+TRACE_ID = uuid.uuid4().hex
+FRAME = os.urandom(24 * 1024)   # a typical JPEG frame from the Pi camera
+
+
+def edge_events():
+    trace = {"trace_id": TRACE_ID, "captured_at": 1718000000.123456, "inference_ms": 41.372}
+    return {
+        "enter": {"external_label": "67", "station_id": STATION_ID, **trace},
+        "heartbeat": {"station_id": STATION_ID, "external_label": "67"},
+        "violation (hash)": {"station_id": STATION_ID, "violation_type": "GOGGLES_NOT_WORN",
+                             "image_hash": "f0e1d2c3b4a59687", **trace},
+        "violation (frame)": {"station_id": STATION_ID, "violation_type": "GOGGLES_NOT_WORN",
+                              "image_base64": base64.b64encode(FRAME).decode('ascii'), **trace},
+    }
+
+
+def dashboard_frames():
+    maker = {"id": MAKER_ID, "display_name": "Ada Lovelace", "external_label": "67", "status": "violation"}
+    station = {"id": STATION_ID, "name": "Laser Cutter", "in_use": True}
+    trace = {"trace_id": TRACE_ID, "event": "violation_create", "edge_ms": 52.1,
+             "server_ms": 3.4, "spans": {"db_lookup": 0.8, "db_write": 1.9, "emit": 0.2}}
+    violation = {"id": str(uuid.uuid4()), "violation_type": "GOGGLES_NOT_WORN", "image_url": None,
+                 "thumbnail_url": None, "image_pending": True,
+                 "created_at": "2026-10-19T18:34:27.340319+00:00", "trace_id": TRACE_ID}
+    ids = {"maker_id": MAKER_ID, "station_id": STATION_ID, "roster_version": 12}
+    at = "2026-10-19T18:34:27.340319+00:00"
+    return {
+        "station_entered (full)": {"maker": {**maker, "status": "active"}, "station": station, "trace": trace},
+        "station_entered": {**ids, "status": "active", "in_use": True, "at": at, "trace": trace},
+        "violation_det. (full)": {"violation": violation, "maker": maker, "station": station, "trace": trace},
+        "violation_detected": {**ids, "violation": violation, "status": "violation", "in_use": True,
+                               "trace": trace},
+        "maker_status (full)": {"id": MAKER_ID, "status": "active", "display_name": "Ada Lovelace",
+                                "trace_id": TRACE_ID},
+        "maker_status_updated": {"maker_id": MAKER_ID, "status": "active", "at": at,
+                                 "roster_version": 12, "trace_id": TRACE_ID},
+    }
+
+
+def interned(event):
+    """An edge event as the schema encodes it: integer keys, station index, raw image bytes."""
+    keys = {name: index for index, name in enumerate(FIELDS)}
+    out = {VERSION_KEY: WIRE_SCHEMA_VERSION, STATIONS_TOKEN_KEY: '9f2c61d0'}
+    for name, value in event.items():
+        if name == 'station_id':
+            value = 3
+        elif name == 'image_base64':
+            name, value = 'image', base64.b64decode(value)
+        out[keys[name]] = value
+    return out
+
+
+def timed(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def measure(name, payload, iterations, labels=('json', 'msgpack')):
+    formats = {'json': (lambda p: json.dumps(p).encode('utf-8'), json.loads)}
+    if msgpack:
+        formats['msgpack'] = (msgpack.packb, lambda b: msgpack.unpackb(b, strict_map_key=False))
+    rows = []
+    for label in labels:
+        if label not in formats:
+            continue
+        encode, decode = formats[label]
+        encoded = encode(payload)
+        rows.append((name, label, len(encoded),
+                     timed(lambda: encode(payload), iterations), timed(lambda: decode(encoded), iterations)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare JSON and MessagePack wire formats")
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    if msgpack is None:
+        print("msgpack not installed - showing JSON only")
+
+    print(f"{'payload':<22} {'format':<16} {'bytes':>8} {'encode us':>10} {'decode us':>10}")
+    for section, payloads in (("edge -> server", edge_events()), ("server -> dashboard", dashboard_frames())):
+        print(f"-- {section}")
+        for name, payload in payloads.items():
+            # Frames with a snapshot are large; fewer rounds keep the run short
+            iterations = args.iterations // 50 if len(json.dumps(payload)) > 4096 else args.iterations
+            rows = measure(name, payload, iterations)
+            if msgpack and section == "edge -> server":
+                rows += [(name, 'msgpack+schema', size, enc, dec)
+                         for _, _, size, enc, dec in measure(name, interned(payload), iterations, ('msgpack',))]
+            for row_name, label, size, enc, dec in rows:
+                print(f"{row_name:<22} {label:<16} {size:>8} {enc:>10.2f} {dec:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Traffic capture for the capture/replay harness.
+
+With CAPTURE_FILE set, every inbound event request (the camera routes and
+the reset) is appended to that JSONL file as it is answered:
+
+    {"type": "request", "ts": 1718000000.12, "method": "POST", "path": "/station/enter",
+     "headers": {"Idempotency-Key": "..."}, "body": {...}, "status": 200, "latency_ms": 3.1}
+
+The first line written by a process is a "start" record holding the live
+state (roster and live status) as soon as it is known - at startup if the
+journal restored it, otherwise once the background database load finishes
+(see warmup.py) - so replay_capture.py can seed a local database stand-in
+with exactly what the server had. Images are
+left out unless CAPTURE_IMAGES is on (then multipart uploads are kept as
+image_base64).
+"""
+import base64
+import json
+import os
+import sys
+import time
+from threading import Lock
+
+from flask import request, g
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import CAPTURE_FILE, CAPTURE_IMAGES
+
+CAPTURED_PATHS = (
+    '/login/toggle',
+    '/station/enter',
+    '/station/leave',
+    '/station/heartbeat',
+    '/violation/create',
+    '/logout',
+)
+
+# Request headers worth replaying
+CAPTURED_HEADERS = ('Idempotency-Key', 'X-Trace-Id')
+
+
+class TrafficCapture:
+    """Appends request records to a JSONL file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+        self._file = open(path, 'a')
+        self.recorded = 0
+
+    def write(self, record):
+        line = json.dumps(record, separators=(',', ':'), default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def start(self, state):
+        """Write the start record now if the live state is loaded, else on its first load."""
+        self._state = state
+        self._started = False
+        if state.loaded:
+            self._write_start()
+        state.add_listener(self._on_change)
+
+    def _on_change(self, change):
+        if change[0] == 'reload' and not self._started:
+            self._write_start()
+
+    def _write_start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.write({'type': 'start', 'ts': time.time(), 'state': self._state.export()})
+
+    def record(self, record):
+        self.write({'type': 'request', **record})
+        self.recorded += 1
+
+
+def _request_body():
+    # Read the raw body first so the routes (and @idempotent) still see it
+    request.get_data()
+    if request.files:
+        body = request.form.to_dict()
+        image = request.files.get('image')
+        if CAPTURE_IMAGES and image:
+            body['image_base64'] = base64.b64encode(image.read()).decode('ascii')
+            image.stream.seek(0)
+        return body
+    body = request.get_json(silent=True)
+    if isinstance(body, dict) and not CAPTURE_IMAGES:
+        body = {k: v for k, v in body.items() if k != 'image_base64'}
+    return body
+
+
+def init_capture(app, state):
+    """Start capturing the event routes of `app` if CAPTURE_FILE is set."""
+    if not CAPTURE_FILE:
+        return None
+
+    capture = TrafficCapture(CAPTURE_FILE)
+    capture.start(state)
+    print(f"Capturing event traffic to {CAPTURE_FILE}")
+
+    @app.before_request
+    def capture_begin():
+        if request.method == 'POST' and request.path in CAPTURED_PATHS:
+            g.capture = {
+                'ts': time.time(),
+                'started': time.perf_counter(),
+                'body': _request_body(),
+            }
+
+    @app.after_request
+    def capture_end(response):
+        pending = g.pop('capture', None)
+        if pending:
+            capture.record({
+                'ts': pending['ts'],
+                'method': request.method,
+                'path': request.path,
+                'headers': {h: request.headers[h] for h in CAPTURED_HEADERS if h in request.headers},
+                'body': pending['body'],
+                'status': response.status_code,
+                'latency_ms': round((time.perf_counter() - pending['started']) * 1000, 3),
+            })
+        return response
+
+    return capture
+
+
+def read_capture(path):
+    """(start record or None, list of request records) from a capture file."""
+    start = None
+    requests = []
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('type') == 'start':
+                # A restart appends a new start record; the first one seeds the replay
+                start = start or record
+            elif record.get('type') == 'request':
+                requests.append(record)
+    return start, requests
@@ -2,25 +2,182 @@ import os
 from typing import Optional
 from flask import Flask
 from flask_cors import CORS
-from supabase import create_client, Client
 from dotenv import load_dotenv
+from database import Database, CircuitBreaker
 
 load_dotenv()
 
 supabase_url: Optional[str] = os.getenv('SUPABASE_URL')
 supabase_key: Optional[str] = os.getenv('SUPABASE_KEY')
 
-try:
+# Use the in-process database stand-in (local_db.py) instead of Supabase:
+# a seed JSON file (table -> rows) or 'memory' for an empty database
+LOCAL_DB: Optional[str] = os.getenv('LOCAL_DB')
+
+# Traffic capture: when set, every inbound event request is appended to this
+# JSONL file with its timing and response status (see capture.py)
+CAPTURE_FILE: Optional[str] = os.getenv('CAPTURE_FILE')
+CAPTURE_IMAGES: bool = os.getenv('CAPTURE_IMAGES', 'False').lower() == 'true'
+
+# Write-behind mode: camera events update the in-memory live state and are
+# broadcast immediately; database writes go through a background queue.
+WRITE_BEHIND: bool = os.getenv('WRITE_BEHIND', 'False').lower() == 'true'
+WRITE_BEHIND_WORKERS: int = int(os.getenv('WRITE_BEHIND_WORKERS', 2))
+WRITE_BEHIND_QUEUE_SIZE: int = int(os.getenv('WRITE_BEHIND_QUEUE_SIZE', 5000))
+WRITE_BEHIND_BATCH_SIZE: int = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', 50))
+WRITE_BEHIND_MAX_RETRIES: int = int(os.getenv('WRITE_BEHIND_MAX_RETRIES', 5))
+
+# Circuit breaker around Supabase calls (see database.py). Calls give up after
+# DB_TIMEOUT seconds; DB_FAILURE_THRESHOLD failures in a row (calls slower than
+# DB_SLOW_CALL count as failures) open the breaker for DB_RESET_TIMEOUT seconds,
+# during which routes run from memory and writes are queued.
+DB_TIMEOUT: float = float(os.getenv('DB_TIMEOUT', 5.0))
+DB_SLOW_CALL: float = float(os.getenv('DB_SLOW_CALL', 2.0))
+DB_FAILURE_THRESHOLD: int = int(os.getenv('DB_FAILURE_THRESHOLD', 5))
+DB_RESET_TIMEOUT: float = float(os.getenv('DB_RESET_TIMEOUT', 10.0))
+
+# Multi-worker Socket.IO: emits are relayed through this queue so every
+# dashboard sees every event. redis://, amqp://, kafka:// or tcp:// (fanout.py)
+SOCKETIO_MESSAGE_QUEUE: Optional[str] = os.getenv('SOCKETIO_MESSAGE_QUEUE')
+SOCKETIO_CHANNEL: str = os.getenv('SOCKETIO_CHANNEL', 'makersafe')
+
+# State transitions lock the maker/station they touch. Keys hash onto a fixed
+# set of lock stripes; waits longer than LOCK_TIMEOUT fail the request (503).
+LOCK_STRIPES: int = int(os.getenv('LOCK_STRIPES', 64))
+LOCK_TIMEOUT: float = float(os.getenv('LOCK_TIMEOUT', 5.0))
+LOCK_WAIT_WARN_MS: float = float(os.getenv('LOCK_WAIT_WARN_MS', 100))
+
+# Live status rows carry a version; writes are compare-and-swap. A route whose
+# write loses a race re-runs (re-reading the rows) up to this many times.
+CAS_MAX_RETRIES: int = int(os.getenv('CAS_MAX_RETRIES', 3))
+
+# Stations the edge hasn't heard from (heartbeat, enter or violation) for
+# PRESENCE_TIMEOUT seconds are released as if it had sent a leave. 0 disables.
+PRESENCE_TIMEOUT: float = float(os.getenv('PRESENCE_TIMEOUT', 30))
+PRESENCE_TICK: float = float(os.getenv('PRESENCE_TICK', 1.0))
+
+# Login/leave cooldowns: 'memory' (single process), 'sqlite' or 'redis' (shared by all workers)
+COOLDOWN_BACKEND: str = os.getenv('COOLDOWN_BACKEND', 'memory').lower()
+COOLDOWN_SQLITE_PATH: str = os.getenv('COOLDOWN_SQLITE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cooldowns.db'))
+COOLDOWN_REDIS_URL: str = os.getenv('COOLDOWN_REDIS_URL', 'redis://localhost:6379/0')
+
+# Admission control for the camera routes: a token bucket per station and per
+# client IP (RATE tokens/second, up to BURST saved up). 0 rate disables a limit.
+ADMISSION_STATION_RATE: float = float(os.getenv('ADMISSION_STATION_RATE', 10))
+ADMISSION_STATION_BURST: int = int(os.getenv('ADMISSION_STATION_BURST', 30))
+ADMISSION_IP_RATE: float = float(os.getenv('ADMISSION_IP_RATE', 50))
+ADMISSION_IP_BURST: int = int(os.getenv('ADMISSION_IP_BURST', 100))
+
+# Idempotency keys on the mutating event routes: recent keys and their
+# responses are kept in a bounded in-memory LRU, backed by a SQLite file
+# ('sqlite', survives restarts and is shared by workers) or not ('memory').
+IDEMPOTENCY_BACKEND: str = os.getenv('IDEMPOTENCY_BACKEND', 'sqlite').lower()
+IDEMPOTENCY_SQLITE_PATH: str = os.getenv('IDEMPOTENCY_SQLITE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'idempotency.db'))
+IDEMPOTENCY_TTL: int = int(os.getenv('IDEMPOTENCY_TTL', 24 * 3600))
+IDEMPOTENCY_MAX_KEYS: int = int(os.getenv('IDEMPOTENCY_MAX_KEYS', 10000))
+
+# Local event journal (see journal.py): accepted events and the live state
+# changes they made, in segments under JOURNAL_DIR, with a snapshot of the
+# live state every JOURNAL_SNAPSHOT_EVERY entries. Restarts rebuild from it.
+JOURNAL_ENABLED: bool = os.getenv('JOURNAL_ENABLED', 'True').lower() == 'true'
+JOURNAL_DIR: str = os.getenv('JOURNAL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'journal'))
+JOURNAL_SEGMENT_BYTES: int = int(os.getenv('JOURNAL_SEGMENT_BYTES', 4 * 1024 * 1024))
+JOURNAL_SNAPSHOT_EVERY: int = int(os.getenv('JOURNAL_SNAPSHOT_EVERY', 1000))
+JOURNAL_FSYNC: bool = os.getenv('JOURNAL_FSYNC', 'False').lower() == 'true'
+
+# Analytics rollups (see analytics.py): station occupancy, maker session time
+# and violation counts, kept per hour for ANALYTICS_HOURS and per day for
+# ANALYTICS_DAYS. Totals cover everything since the process started.
+ANALYTICS_HOURS: int = int(os.getenv('ANALYTICS_HOURS', 48))
+ANALYTICS_DAYS: int = int(os.getenv('ANALYTICS_DAYS', 31))
+
+# Sparkline history (see timeseries.py): site and per-station samples every
+# TIMESERIES_RESOLUTION seconds for the last TIMESERIES_WINDOW seconds, pushed
+# to dashboards every TIMESERIES_EMIT_INTERVAL seconds (0 = no push).
+TIMESERIES_RESOLUTION: float = float(os.getenv('TIMESERIES_RESOLUTION', 1.0))
+TIMESERIES_WINDOW: int = int(os.getenv('TIMESERIES_WINDOW', 3600))
+TIMESERIES_EMIT_INTERVAL: float = float(os.getenv('TIMESERIES_EMIT_INTERVAL', 5))
+
+# History archive (see archive.py, needs pyarrow): resolved violations and
+# those older than ARCHIVE_AFTER_DAYS are moved to Parquet files under
+# ARCHIVE_DIR every ARCHIVE_INTERVAL seconds (0 = only on a reset), along with
+# finished station/maker sessions. With several workers only one should
+# archive violations (run_workers.py turns ARCHIVE_VIOLATIONS off for the rest).
+ARCHIVE_DIR: str = os.getenv('ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive'))
+ARCHIVE_INTERVAL: int = int(os.getenv('ARCHIVE_INTERVAL', 3600))
+ARCHIVE_AFTER_DAYS: int = int(os.getenv('ARCHIVE_AFTER_DAYS', 30))
+ARCHIVE_VIOLATIONS: bool = os.getenv('ARCHIVE_VIOLATIONS', 'True').lower() == 'true'
+ARCHIVE_BATCH_SIZE: int = int(os.getenv('ARCHIVE_BATCH_SIZE', 500))
+
+# Read endpoints (/state, /violations): ETags from per-scope change versions,
+# a cached serialized body per version, gzip for bodies of COMPRESS_MIN_BYTES
+# or more (see read_cache.py). Versions only track this process's changes -
+# turn READ_CACHE off when other processes write (ETags then hash the body).
+READ_CACHE: bool = os.getenv('READ_CACHE', 'True').lower() == 'true'
+READ_CACHE_MAX_ENTRIES: int = int(os.getenv('READ_CACHE_MAX_ENTRIES', 256))
+COMPRESS_MIN_BYTES: int = int(os.getenv('COMPRESS_MIN_BYTES', 1024))
+
+# Binary wire format (see wire.py, needs msgpack): edge events are accepted as
+# MessagePack regardless; WIRE_FORMAT=msgpack also switches the Socket.IO
+# frames to MessagePack (every dashboard must then use the msgpack parser).
+WIRE_FORMAT: str = os.getenv('WIRE_FORMAT', 'json').lower()
+
+# Bulk maker enrollment (POST /makers/enroll): rows per upsert request, and
+# the most rows one upload may contain.
+ENROLL_BATCH_SIZE: int = int(os.getenv('ENROLL_BATCH_SIZE', 500))
+ENROLL_MAX_ROWS: int = int(os.getenv('ENROLL_MAX_ROWS', 20000))
+
+# Station indicator feed (see indicators.py): long-poll requests wait at most
+# INDICATOR_MAX_WAIT seconds; SSE streams send a keepalive every
+# INDICATOR_KEEPALIVE seconds; at most INDICATOR_MAX_WAITERS requests wait at
+# once (each holds a server thread), the rest get 503.
+INDICATOR_MAX_WAIT: float = float(os.getenv('INDICATOR_MAX_WAIT', 30))
+INDICATOR_KEEPALIVE: int = int(os.getenv('INDICATOR_KEEPALIVE', 15))
+INDICATOR_MAX_WAITERS: int = int(os.getenv('INDICATOR_MAX_WAITERS', 500))
+
+# Violation snapshots: raw frames sent with a violation are re-encoded and
+# uploaded in the background. SNAPSHOT_STORAGE is 'supabase' (Storage bucket)
+# or 'local' (files under SNAPSHOT_DIR, served from /snapshots).
+SNAPSHOT_STORAGE: str = os.getenv('SNAPSHOT_STORAGE', 'supabase').lower()
+SNAPSHOT_BUCKET: str = os.getenv('SNAPSHOT_BUCKET', 'violations')
+SNAPSHOT_DIR: str = os.getenv('SNAPSHOT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots'))
+SNAPSHOT_FORMAT: str = os.getenv('SNAPSHOT_FORMAT', 'webp').lower()   # 'webp' or 'jpeg'
+SNAPSHOT_QUALITY: int = int(os.getenv('SNAPSHOT_QUALITY', 75))
+SNAPSHOT_MAX_SIZE: int = int(os.getenv('SNAPSHOT_MAX_SIZE', 1280))    # longest edge, px
+SNAPSHOT_THUMB_SIZE: int = int(os.getenv('SNAPSHOT_THUMB_SIZE', 240))
+SNAPSHOT_WORKERS: int = int(os.getenv('SNAPSHOT_WORKERS', 2))
+# Near-duplicate snapshots (same station + maker) reuse the stored image
+SNAPSHOT_DEDUP_DISTANCE: int = int(os.getenv('SNAPSHOT_DEDUP_DISTANCE', 6))  # max differing bits of 64
+SNAPSHOT_DEDUP_TTL: int = int(os.getenv('SNAPSHOT_DEDUP_TTL', 3600))          # seconds
+SNAPSHOT_DEDUP_MAX_KEYS: int = int(os.getenv('SNAPSHOT_DEDUP_MAX_KEYS', 512)) # station+maker pairs
+SNAPSHOT_DEDUP_PER_KEY: int = int(os.getenv('SNAPSHOT_DEDUP_PER_KEY', 8))
+
+# Boot warm-up (see warmup.py): a failed step is retried with exponential
+# backoff, waiting at most this many seconds between attempts
+WARMUP_RETRY_MAX: float = float(os.getenv('WARMUP_RETRY_MAX', 30))
+
+def _connect_supabase():
+    if LOCAL_DB:
+        from local_db import connect
+        return connect(LOCAL_DB)
     if not supabase_url or not supabase_key:
         raise ValueError("Supabase URL/Key not found. Check .env file.")
-    supabase: Client = create_client(supabase_url, supabase_key)
-    print("Supabase client initialized successfully.")
-except ValueError as e:
-    print(f"Error initializing Supabase: {e}")
-    supabase = None
-except Exception as e:
-    print(f"An unexpected error occurred during Supabase initialization: {e}")
-    supabase = None
+    # Imported here so importing the server stays fast; the boot warm-up
+    # (warmup.py) connects in the background
+    from supabase import create_client, ClientOptions
+    return create_client(supabase_url, supabase_key,
+                         options=ClientOptions(postgrest_client_timeout=DB_TIMEOUT))
+
+# Created lazily on first use (and re-created after a connection failure)
+supabase: Database = Database(
+    _connect_supabase,
+    enabled=bool(LOCAL_DB or (supabase_url and supabase_key)),
+    breaker=CircuitBreaker(DB_FAILURE_THRESHOLD, DB_RESET_TIMEOUT),
+    slow_call=DB_SLOW_CALL,
+)
+if not supabase:
+    print("Error initializing Supabase: Supabase URL/Key not found. Check .env file.")
+
 def create_app():
     """Flask application factory."""
     app = Flask(__name__)
@@ -0,0 +1,186 @@
+"""
+Cooldown store for the login/leave toggle.
+
+Each cooldown is a key with an expiry time. Expired keys are ignored on read
+and removed by periodic compaction, so memory stays flat no matter how many
+makers toggle over the days. The backend is chosen with COOLDOWN_BACKEND:
+
+- 'memory'  (default) in-process; only correct with a single server process
+- 'sqlite'  a SQLite file shared by every worker on the host - the local
+            stand-in for Redis: same set/remaining/clear behaviour, no server
+            to run
+- 'redis'   any Redis-protocol server (Redis, Valkey, KeyDB running locally);
+            needs the optional `redis` package (pip install redis). Without
+            the package, or when the server can't be reached at startup, the
+            SQLite store is used instead.
+"""
+import heapq
+import sqlite3
+import sys
+import os
+import time
+from threading import Lock, local
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import COOLDOWN_BACKEND, COOLDOWN_SQLITE_PATH, COOLDOWN_REDIS_URL
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Drop expired keys at most this often (seconds)
+COMPACT_INTERVAL = 60
+
+
+class MemoryCooldownStore:
+    """
+    A dict for O(1) checks plus a min-heap of expiry times, so compaction only
+    touches keys that have actually expired.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._expires = {}      # key -> expires_at
+        self._heap = []         # (expires_at, key); stale entries skipped on pop
+        self._last_compact = time.time()
+
+    def set(self, key, ttl):
+        with self._lock:
+            expires_at = time.time() + ttl
+            self._expires[key] = expires_at
+            heapq.heappush(self._heap, (expires_at, key))
+            self._maybe_compact()
+
+    def remaining(self, key):
+        """Seconds left on the cooldown, or 0 if there is none."""
+        with self._lock:
+            expires_at = self._expires.get(key)
+            if expires_at is None:
+                return 0
+            left = expires_at - time.time()
+            if left <= 0:
+                del self._expires[key]
+                return 0
+            return left
+
+    def clear(self, key):
+        with self._lock:
+            self._expires.pop(key, None)
+
+    def compact(self):
+        with self._lock:
+            self._compact()
+
+    def __len__(self):
+        return len(self._expires)
+
+    def _maybe_compact(self):
+        if time.time() - self._last_compact >= COMPACT_INTERVAL:
+            self._compact()
+
+    def _compact(self):
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self._heap)
+            # Only drop the key if it wasn't re-set (or cleared) since this entry
+            if self._expires.get(key) == expires_at:
+                del self._expires[key]
+        self._last_compact = now
+
+
+class SQLiteCooldownStore:
+    """Cooldowns in a SQLite file, so every worker process sees the same state."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = local()
+        self._last_compact = time.time()
+        self._conn().execute(
+            "create table if not exists cooldowns (key text primary key, expires_at real not null)"
+        )
+        self._conn().execute(
+            "create index if not exists idx_cooldowns_expires_at on cooldowns (expires_at)"
+        )
+
+    def _conn(self):
+        # sqlite3 connections can't be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("pragma journal_mode=wal")
+            conn.execute("pragma synchronous=normal")
+            self._local.conn = conn
+        return conn
+
+    def set(self, key, ttl):
+        self._conn().execute(
+            "insert into cooldowns (key, expires_at) values (?, ?) "
+            "on conflict(key) do update set expires_at = excluded.expires_at",
+            (key, time.time() + ttl)
+        )
+        if time.time() - self._last_compact >= COMPACT_INTERVAL:
+            self.compact()
+
+    def remaining(self, key):
+        row = self._conn().execute("select expires_at from cooldowns where key = ?", (key,)).fetchone()
+        if not row:
+            return 0
+        return max(0, row[0] - time.time())
+
+    def clear(self, key):
+        self._conn().execute("delete from cooldowns where key = ?", (key,))
+
+    def compact(self):
+        self._conn().execute("delete from cooldowns where expires_at <= ?", (time.time(),))
+        self._last_compact = time.time()
+
+    def __len__(self):
+        return self._conn().execute("select count(*) from cooldowns").fetchone()[0]
+
+
+class RedisCooldownStore:
+    """Cooldowns as Redis keys with a native TTL - the server expires them itself."""
+
+    def __init__(self, url, prefix='makersafe:cooldown:'):
+        self._redis = redis.Redis.from_url(url)
+        self._redis.ping()   # fail at startup, not on the first login
+        self._prefix = prefix
+
+    def set(self, key, ttl):
+        self._redis.set(self._prefix + key, 1, px=int(ttl * 1000))
+
+    def remaining(self, key):
+        ttl_ms = self._redis.pttl(self._prefix + key)
+        return ttl_ms / 1000 if ttl_ms and ttl_ms > 0 else 0
+
+    def clear(self, key):
+        self._redis.delete(self._prefix + key)
+
+    def compact(self):
+        pass
+
+    def __len__(self):
+        return sum(1 for _ in self._redis.scan_iter(self._prefix + '*'))
+
+
+def create_cooldown_store(backend=COOLDOWN_BACKEND):
+    if backend == 'sqlite':
+        return SQLiteCooldownStore(COOLDOWN_SQLITE_PATH)
+    if backend == 'redis':
+        if redis is None:
+            print("COOLDOWN_BACKEND=redis needs the redis package (pip install redis) - "
+                  "using the SQLite cooldown store instead")
+            return SQLiteCooldownStore(COOLDOWN_SQLITE_PATH)
+        try:
+            return RedisCooldownStore(COOLDOWN_REDIS_URL)
+        except Exception as e:
+            print(f"Redis cooldown store unavailable at {COOLDOWN_REDIS_URL} ({str(e)}) - "
+                  "using the SQLite cooldown store instead")
+            return SQLiteCooldownStore(COOLDOWN_SQLITE_PATH)
+    if backend != 'memory':
+        print(f"Unknown COOLDOWN_BACKEND '{backend}', using in-process cooldowns")
+    return MemoryCooldownStore()
+
+
+cooldowns = create_cooldown_store()
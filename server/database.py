@@ -0,0 +1,285 @@
+"""
+Supabase access behind a circuit breaker.
+
+config.supabase is a Database rather than the raw client. It has the same
+query interface (`supabase.table(...).select(...).eq(...).execute()`), but:
+
+- the client is created on first use, and again after a failure, so a bad
+  start (network down, Supabase restarting) doesn't leave the process
+  without a database for good
+- every `.execute()` goes through a CircuitBreaker. After
+  DB_FAILURE_THRESHOLD consecutive failures (errors, timeouts, or calls
+  slower than DB_SLOW_CALL) the breaker opens and calls fail immediately
+  with DatabaseUnavailable instead of tying a worker up for DB_TIMEOUT.
+  After DB_RESET_TIMEOUT one trial call is let through; if it works the
+  breaker closes again
+- errors the database refused the query with (constraint violations, bad
+  filters - a 4xx, PGRST1xx-3xx or SQLSTATE code, see _refused) are passed
+  through untouched and don't count against the breaker. Server-side codes
+  (HTTP 5xx, PGRST0xx "can't reach Postgres", SQLSTATE 08/53/57/58/XX) are
+  failures like any other
+
+While the breaker is open the server runs degraded: reads come from the
+in-memory live state, writes are queued until the database is back (see
+write_behind.py), and /status reports it.
+"""
+import time
+from threading import Lock
+
+
+class DatabaseUnavailable(Exception):
+    """The database couldn't be reached, or the circuit breaker is open."""
+
+
+# SQLSTATE classes that mean the database is in trouble, not the query:
+# connection exception, insufficient resources, operator intervention
+# (shutdown, query canceled), system error, internal error
+_SERVER_SQLSTATE_CLASSES = ('08', '53', '57', '58', 'XX')
+
+
+def _refused(e):
+    """True if e is the database turning the query down (it's up); False for server-side errors."""
+    code = str(getattr(e, 'code', None) or '')
+    if not code:
+        return False
+    if code.isdigit() and len(code) == 3:
+        # An HTTP status (postgrest-py uses it when the body isn't a PostgREST error)
+        return 400 <= int(code) < 500
+    if code.startswith('PGRST'):
+        # PGRST0xx: PostgREST can't reach or use Postgres
+        return not code[5:].startswith('0')
+    return code[:2] not in _SERVER_SQLSTATE_CLASSES
+
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open trial -> closed (or open again)."""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = Lock()
+        self._state = self.CLOSED
+        self._failures = 0           # consecutive
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._listeners = []
+        self.last_error = None
+        self.opened_count = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == self.OPEN and time.time() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    def retry_in(self):
+        """Seconds until the breaker lets a trial call through (0 if it would now)."""
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.time() - self._opened_at))
+
+    def on_change(self, listener):
+        """Call listener(old_state, new_state) whenever the breaker opens or closes."""
+        self._listeners.append(listener)
+
+    def allow(self):
+        """May a call go ahead? In half-open state only one trial call is allowed at a time."""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            old = self._state
+            self._failures = 0
+            self._trial_in_flight = False
+            self._state = self.CLOSED
+        if old != self.CLOSED:
+            print("Database reachable again, circuit breaker closed")
+            self._notify(old, self.CLOSED)
+
+    def record_failure(self, error):
+        with self._lock:
+            old = self._state
+            self._failures += 1
+            self._trial_in_flight = False
+            self.last_error = str(error)
+            if old == self.OPEN or self._failures >= self.failure_threshold:
+                # A failed trial starts a fresh cooldown
+                self._state = self.OPEN
+                self._opened_at = time.time()
+                if old != self.OPEN:
+                    self.opened_count += 1
+        if old != self.OPEN and self._state == self.OPEN:
+            print(f"Database unavailable ({error}), circuit breaker open for {self.reset_timeout:.0f}s")
+            self._notify(old, self.OPEN)
+
+    def _notify(self, old, new):
+        for listener in self._listeners:
+            try:
+                listener(old, new)
+            except Exception as e:
+                print(f"Circuit breaker listener failed: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            state = self._current_state()
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout": self.reset_timeout,
+                "retry_in": round(max(0.0, self.reset_timeout - (time.time() - self._opened_at)), 1)
+                            if state == self.OPEN else 0.0,
+                "times_opened": self.opened_count,
+                "rejected_calls": self.rejected,
+                "last_error": self.last_error,
+            }
+
+
+class Database:
+    """
+    Lazily connected Supabase client. `connect` is a function returning a new
+    client; it is called on first use and after a connection-level failure.
+    """
+
+    def __init__(self, connect, enabled, breaker, slow_call=None):
+        self._connect = connect
+        self._enabled = enabled
+        self._client = None
+        self._connected_before = False
+        self._connect_lock = Lock()
+        self.breaker = breaker
+        self.slow_call = slow_call
+        self._write_listeners = []
+
+    def __bool__(self):
+        # False only when no database is configured at all (no URL/key)
+        return self._enabled
+
+    @property
+    def degraded(self):
+        """True while the breaker is open - callers should use memory and queue writes."""
+        return self._enabled and self.breaker.state == CircuitBreaker.OPEN
+
+    def table(self, name):
+        return _GuardedQuery(self, name)
+
+    def on_write(self, listener):
+        """Call listener(table) after every insert/upsert/update/delete, even one that failed
+        (a timed-out write may still have landed)."""
+        self._write_listeners.append(listener)
+
+    def _written(self, table):
+        for listener in self._write_listeners:
+            try:
+                listener(table)
+            except Exception as e:
+                print(f"Database write listener failed: {str(e)}")
+
+    @property
+    def storage(self):
+        """Supabase Storage (used by background snapshot uploads; not behind the breaker)."""
+        return self.client().storage
+
+    def client(self):
+        with self._connect_lock:
+            if self._client is None:
+                try:
+                    self._client = self._connect()
+                    if not self._connected_before:
+                        print("Supabase client initialized successfully.")
+                    self._connected_before = True
+                except Exception as e:
+                    raise DatabaseUnavailable(f"could not create Supabase client: {str(e)}") from e
+            return self._client
+
+    def execute(self, build, written_table=None):
+        """Run build(client).execute() through the breaker. written_table: the table a write changes."""
+        if written_table:
+            try:
+                return self._execute(build)
+            finally:
+                self._written(written_table)
+        return self._execute(build)
+
+    def _execute(self, build):
+        if not self._enabled:
+            raise DatabaseUnavailable("database not configured")
+        if not self.breaker.allow():
+            raise DatabaseUnavailable(f"circuit breaker open ({self.breaker.last_error})")
+
+        start = time.time()
+        try:
+            response = build(self.client()).execute()
+        except Exception as e:
+            if _refused(e):
+                # The database answered - it's up, the query was just refused
+                self.breaker.record_success()
+                raise
+            self.breaker.record_failure(e)
+            self._client = None  # reconnect next time
+            if isinstance(e, DatabaseUnavailable):
+                raise
+            raise DatabaseUnavailable(str(e)) from e
+
+        elapsed = time.time() - start
+        if self.slow_call and elapsed > self.slow_call:
+            self.breaker.record_failure(f"slow call ({elapsed:.1f}s)")
+        else:
+            self.breaker.record_success()
+        return response
+
+
+class _GuardedQuery:
+    """
+    Records a query's builder calls and replays them on the real client at
+    execute(), so building a query never touches the network or the breaker.
+    """
+
+    # Builder attributes that are properties rather than methods
+    _PROPERTIES = ('not_',)
+
+    _WRITES = ('insert', 'upsert', 'update', 'delete')
+
+    def __init__(self, db, table, steps=()):
+        self._db = db
+        self._table = table
+        self._steps = steps
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in self._PROPERTIES:
+            return _GuardedQuery(self._db, self._table, self._steps + ((name, None, None),))
+
+        def step(*args, **kwargs):
+            return _GuardedQuery(self._db, self._table, self._steps + ((name, args, kwargs),))
+        return step
+
+    def execute(self):
+        writes = any(name in self._WRITES for name, _, _ in self._steps)
+        return self._db.execute(self._build, written_table=self._table if writes else None)
+
+    def _build(self, client):
+        query = client.table(self._table)
+        for name, args, kwargs in self._steps:
+            attr = getattr(query, name)
+            query = attr if args is None else attr(*args, **kwargs)
+        return query
@@ -0,0 +1,220 @@
+"""
+Cross-worker Socket.IO fan-out.
+
+With more than one server process, an emit only reaches the dashboards
+connected to the process that made it. Flask-SocketIO fixes this by relaying
+emits through a message queue (SOCKETIO_MESSAGE_QUEUE):
+
+- redis://... / amqp://... / kafka://...  handled by Flask-SocketIO itself
+- tcp://host:port                         the small broker in this file
+
+The tcp:// broker needs nothing beyond the standard library, so it doubles as
+the local stand-in for tests and for single-host deployments:
+
+    python fanout.py --port 5680
+
+Every frame a worker publishes is forwarded to every subscribed worker
+(including the sender, which ignores its own messages by host_id).
+"""
+import argparse
+import socket
+import socketserver
+import struct
+import time
+from queue import Queue, Full
+from threading import Lock, Thread
+
+import socketio
+
+# Frames are a 4-byte big-endian length followed by a UTF-8 JSON payload
+_HEADER = struct.Struct('>I')
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+
+# Role byte sent by a client right after connecting
+ROLE_PUBLISH = b'P'
+ROLE_SUBSCRIBE = b'S'
+
+# Frames buffered per subscriber before the broker gives up on it
+SUBSCRIBER_QUEUE_SIZE = 10000
+
+RECONNECT_DELAY = 1.0
+
+
+def parse_tcp_url(url):
+    """'tcp://host:port' -> (host, port)"""
+    host, _, port = url[len('tcp://'):].rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def send_frame(sock, payload):
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def _recv_exact(sock, size):
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def recv_frame(sock):
+    (size,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    if size > MAX_FRAME_BYTES:
+        raise ConnectionError(f"frame too large ({size} bytes)")
+    return _recv_exact(sock, size)
+
+
+# ============================================================
+# Client side - plugged into Flask-SocketIO as its client_manager
+# ============================================================
+
+class TcpPubSubManager(socketio.PubSubManager):
+    """Socket.IO client manager that relays emits through the tcp:// broker."""
+
+    name = 'tcp'
+
+    def __init__(self, url, channel='flask-socketio', write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.address = parse_tcp_url(url)
+        self._publisher = None
+        self._publish_lock = Lock()
+
+    def _publish(self, data):
+        payload = self.json.dumps({'channel': self.channel, 'data': data}).encode('utf-8')
+        with self._publish_lock:
+            # One reconnect attempt - the broker may have restarted
+            for attempt in range(2):
+                try:
+                    if self._publisher is None:
+                        self._publisher = socket.create_connection(self.address, timeout=5)
+                        self._publisher.sendall(ROLE_PUBLISH)
+                    send_frame(self._publisher, payload)
+                    return
+                except OSError as e:
+                    if self._publisher is not None:
+                        self._publisher.close()
+                        self._publisher = None
+                    if attempt == 1:
+                        self._get_logger().error(f"Fan-out publish failed: {e}")
+
+    def _listen(self):
+        while True:
+            try:
+                sock = socket.create_connection(self.address)
+                sock.sendall(ROLE_SUBSCRIBE)
+                self._get_logger().info(f"Fan-out subscribed to {self.address[0]}:{self.address[1]}")
+                while True:
+                    message = self.json.loads(recv_frame(sock))
+                    if message.get('channel') == self.channel:
+                        yield message['data']
+            except (OSError, ValueError) as e:
+                self._get_logger().error(f"Fan-out connection lost ({e}), reconnecting...")
+                time.sleep(RECONNECT_DELAY)
+
+
+def create_client_manager(url, channel):
+    """Client manager for a tcp:// queue URL (other schemes are left to Flask-SocketIO)."""
+    return TcpPubSubManager(url, channel=channel)
+
+
+# ============================================================
+# Broker
+# ============================================================
+
+class _Subscriber:
+    def __init__(self, sock):
+        self.sock = sock
+        self.queue = Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.alive = True
+
+    def run(self):
+        try:
+            while self.alive:
+                payload = self.queue.get()
+                if payload is None:
+                    break
+                send_frame(self.sock, payload)
+        except OSError:
+            pass
+        finally:
+            self.alive = False
+
+
+class FanoutBroker(socketserver.ThreadingTCPServer):
+    """Forwards every published frame to every subscriber."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, _BrokerHandler)
+        self.subscribers = set()
+        self.lock = Lock()
+
+    def broadcast(self, payload):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for sub in subscribers:
+            try:
+                sub.queue.put_nowait(payload)
+            except Full:
+                # A stuck worker must not stall the rest; drop it and let it reconnect
+                print("Fan-out broker: subscriber queue full, disconnecting it")
+                self.remove(sub)
+
+    def remove(self, sub):
+        with self.lock:
+            self.subscribers.discard(sub)
+        sub.alive = False
+        try:
+            sub.queue.put_nowait(None)  # wake the writer so its thread exits
+        except Full:
+            pass
+        try:
+            sub.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class _BrokerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        role = self.request.recv(1)
+        if role == ROLE_PUBLISH:
+            try:
+                while True:
+                    self.server.broadcast(recv_frame(self.request))
+            except (OSError, ConnectionError):
+                return
+        elif role == ROLE_SUBSCRIBE:
+            sub = _Subscriber(self.request)
+            with self.server.lock:
+                self.server.subscribers.add(sub)
+            try:
+                sub.run()
+            finally:
+                self.server.remove(sub)
+
+
+def start_broker(host='127.0.0.1', port=5680):
+    """Start a broker on a background thread (used by run_workers.py and tests)."""
+    broker = FanoutBroker((host, port))
+    Thread(target=broker.serve_forever, name='fanout-broker', daemon=True).start()
+    print(f"Fan-out broker listening on tcp://{host}:{broker.server_address[1]}")
+    return broker
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Socket.IO fan-out broker for multi-worker deployments")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5680)
+    args = parser.parse_args()
+
+    broker = FanoutBroker((args.host, args.port))
+    print(f"Fan-out broker listening on tcp://{args.host}:{args.port}")
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        pass
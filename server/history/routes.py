@@ -0,0 +1,210 @@
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+import sys
+import os
+import json
+import base64
+import binascii
+import uuid
+from datetime import datetime
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import supabase
+from database import DatabaseUnavailable
+from live_state import live_state
+from archive import query_archive, pa
+from read_cache import conditional
+
+history_bp = Blueprint('history', __name__, url_prefix='/violations')
+
+# Only the columns the history view needs - no embedded makers/stations join;
+# names come from the in-memory roster instead
+HISTORY_COLUMNS = 'id,maker_id,station_id,violation_type,image_url,thumbnail_url,created_at,resolved_at'
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+# Rows fetched from the database per round trip while streaming a page
+FETCH_CHUNK_SIZE = 200
+
+
+def encode_cursor(row):
+    """Opaque keyset cursor for the (created_at, id) of the last row on a page."""
+    raw = json.dumps([row['created_at'], row['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    (created_at, id) from a cursor, or None if it isn't one. Both go into a
+    PostgREST or= filter, so they must be a real timestamp and a real UUID -
+    anything else (quotes, commas) could add conditions of its own.
+    """
+    try:
+        created_at, violation_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        datetime.fromisoformat(str(created_at).replace('Z', '+00:00'))
+        return str(created_at), str(uuid.UUID(str(violation_id)))
+    except (binascii.Error, ValueError, TypeError, AttributeError):
+        return None
+
+
+def _history_query(filters, after, limit):
+    """
+    One keyset page, newest first, ordered by (created_at, id) so rows with the
+    same timestamp are never skipped or repeated. The created_at range and
+    ordering are served by idx_violations_created_at.
+    """
+    query = supabase.table('violations').select(HISTORY_COLUMNS)
+
+    for column in ('station_id', 'maker_id', 'violation_type'):
+        if filters.get(column):
+            query = query.eq(column, filters[column])
+    if filters.get('since'):
+        query = query.gte('created_at', filters['since'])
+    if filters.get('until'):
+        query = query.lt('created_at', filters['until'])
+    if filters.get('resolved') == 'true':
+        query = query.not_.is_('resolved_at', 'null')
+    elif filters.get('resolved') == 'false':
+        query = query.is_('resolved_at', 'null')
+
+    if after:
+        created_at, violation_id = after
+        query = query.or_(
+            f'created_at.lt."{created_at}",'
+            f'and(created_at.eq."{created_at}",id.lt."{violation_id}")'
+        )
+
+    return query.order('created_at', desc=True).order('id', desc=True).limit(limit).execute().data or []
+
+
+def _with_names(row):
+    maker = live_state.maker(row['maker_id']) or {}
+    station = live_state.station(row['station_id']) or {}
+    return {
+        **row,
+        "maker_name": maker.get('display_name'),
+        "station_name": station.get('name')
+    }
+
+
+@history_bp.route('', methods=['GET'])
+@conditional('violations')
+def list_violations():
+    """
+    Violation history, newest first, with keyset pagination.
+    
+    Query params (all optional):
+        station_id, maker_id, violation_type  - exact-match filters
+        since, until                          - ISO timestamps (since <= created_at < until)
+        resolved                              - 'true' or 'false'
+        limit                                 - page size (default 50, max 1000)
+        cursor                                - next_cursor from the previous page
+    
+    Returns:
+    {
+        "violations": [...],
+        "next_cursor": "..." | null   # null on the last page
+    }
+    
+    The page is streamed as it is read from the database, so large pages
+    don't have to be buffered in memory.
+    """
+    if not supabase:
+        return jsonify({"error": "Database connection not available"}), 500
+    
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    if limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
+    limit = min(limit, MAX_PAGE_SIZE)
+    
+    after = None
+    if request.args.get('cursor'):
+        after = decode_cursor(request.args['cursor'])
+        if not after:
+            return jsonify({"error": "Invalid cursor"}), 400
+    
+    filters = {
+        key: request.args.get(key)
+        for key in ('station_id', 'maker_id', 'violation_type', 'since', 'until', 'resolved')
+    }
+    
+    try:
+        # Fetch the first chunk up front so database errors still get a proper 500
+        first_chunk = _history_query(filters, after, min(limit, FETCH_CHUNK_SIZE))
+    except DatabaseUnavailable as e:
+        # History lives only in the database - fail fast while it is down
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    def generate():
+        yield '{"violations":['
+        chunk = first_chunk
+        sent = 0
+        last = None
+        more = False
+        while chunk:
+            for row in chunk:
+                yield (',' if sent else '') + json.dumps(_with_names(row))
+                sent += 1
+                last = row
+            if sent >= limit:
+                more = True
+                break
+            if len(chunk) < FETCH_CHUNK_SIZE:
+                break
+            try:
+                chunk = _history_query(filters, (last['created_at'], last['id']), min(limit - sent, FETCH_CHUNK_SIZE))
+            except Exception as e:
+                # Headers are already sent; end the page early and let the client resume from the cursor
+                print(f"Error streaming violation history: {str(e)}")
+                more = True
+                break
+        
+        next_cursor = encode_cursor(last) if last and more else None
+        yield '],"next_cursor":' + json.dumps(next_cursor) + '}'
+    
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+@history_bp.route('/archive', methods=['GET'])
+@conditional('archive')
+def list_archived_violations():
+    """
+    Archived violations (moved out of the database by archive.py), oldest first.
+    
+    Query params (all optional):
+        station_id, maker_id, violation_type  - exact-match filters
+        since, until                          - ISO timestamps (since <= created_at < until)
+        limit                                 - max rows (default 1000)
+    
+    Read from the local Parquet archive; no database access.
+    """
+    if pa is None:
+        return jsonify({"error": "Archive not available (pyarrow not installed)"}), 501
+    
+    limit = request.args.get('limit', MAX_PAGE_SIZE, type=int)
+    if limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
+    
+    try:
+        rows = query_archive(
+            'violations',
+            since=request.args.get('since'),
+            until=request.args.get('until'),
+            limit=limit,
+            station_id=request.args.get('station_id'),
+            maker_id=request.args.get('maker_id'),
+            violation_type=request.args.get('violation_type')
+        )
+    except ValueError as e:
+        return jsonify({"error": f"Invalid timestamp: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    violations = []
+    for row in rows:
+        for column in ('created_at', 'resolved_at', 'archived_at'):
+            if row.get(column):
+                row[column] = row[column].isoformat()
+        violations.append(_with_names(row))
+    return jsonify({"violations": violations}), 200
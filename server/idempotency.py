@@ -0,0 +1,240 @@
+"""
+Idempotency keys for the mutating event routes.
+
+The edge sends an `Idempotency-Key` header (or an "idempotency_key" body
+field) with each event; a retry or duplicate of that event reuses the key.
+The first request runs normally and its response is stored. Any replay with
+the same key gets that stored response back (with `Idempotent-Replayed:
+true`) without running the view again - no database access, no duplicate
+violation rows, no repeated WebSocket events.
+
+- Keys are scoped to the route, so one key can be used for e.g. the enter
+  and the violation sent for the same frame.
+- A replay whose body differs from the original is rejected (422).
+- A replay that arrives while the original is still running waits for it.
+- Only final answers are stored: successes and client errors, but not
+  409/429/503 (worth retrying) or 5xx.
+
+Responses are cached in a bounded LRU in memory and, with
+IDEMPOTENCY_BACKEND=sqlite, in a SQLite file so they survive a restart and
+are shared by every worker on the host. Entries expire after IDEMPOTENCY_TTL.
+"""
+import hashlib
+import sqlite3
+import sys
+import os
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Event, Lock, local
+
+from flask import request, make_response, jsonify, Response
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import IDEMPOTENCY_BACKEND, IDEMPOTENCY_SQLITE_PATH, IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_KEYS
+
+MAX_KEY_LENGTH = 200
+
+# How long a replay waits for the original request to finish
+INFLIGHT_WAIT_SECONDS = 10
+
+# Drop expired SQLite rows at most this often (seconds)
+COMPACT_INTERVAL = 300
+
+# Statuses that are worth retrying, so never pinned to a key
+_TRANSIENT_STATUSES = {409, 429, 503}
+
+
+class StoredResponse:
+    __slots__ = ('fingerprint', 'status', 'body', 'mimetype', 'stored_at')
+
+    def __init__(self, fingerprint, status, body, mimetype, stored_at):
+        self.fingerprint = fingerprint
+        self.status = status
+        self.body = body
+        self.mimetype = mimetype
+        self.stored_at = stored_at
+
+
+class SQLiteResponseStore:
+    """Stored responses in a SQLite file (one connection per thread, WAL mode)."""
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._local = local()
+        self._last_compact = time.time()
+        self._conn().execute(
+            "create table if not exists idempotency ("
+            "key text primary key, fingerprint text not null, status integer not null, "
+            "body blob not null, mimetype text, stored_at real not null)"
+        )
+        self._conn().execute(
+            "create index if not exists idx_idempotency_stored_at on idempotency (stored_at)"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("pragma journal_mode=wal")
+            conn.execute("pragma synchronous=normal")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "select fingerprint, status, body, mimetype, stored_at from idempotency where key = ? and stored_at > ?",
+            (key, time.time() - self.ttl)
+        ).fetchone()
+        return StoredResponse(*row) if row else None
+
+    def put(self, key, stored):
+        self._conn().execute(
+            "insert or replace into idempotency (key, fingerprint, status, body, mimetype, stored_at) "
+            "values (?, ?, ?, ?, ?, ?)",
+            (key, stored.fingerprint, stored.status, stored.body, stored.mimetype, stored.stored_at)
+        )
+        if time.time() - self._last_compact >= COMPACT_INTERVAL:
+            self._conn().execute("delete from idempotency where stored_at <= ?", (time.time() - self.ttl,))
+            self._last_compact = time.time()
+
+
+class IdempotencyCache:
+    """Bounded LRU of recent responses in front of an optional persistent store."""
+
+    def __init__(self, max_keys, ttl, store=None):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self.store = store
+        self._lock = Lock()
+        self._entries = OrderedDict()   # key -> StoredResponse
+        self._inflight = {}             # key -> Event set when the original finishes
+        self.replays = 0
+
+    def get(self, key):
+        with self._lock:
+            stored = self._entries.get(key)
+            if stored and stored.stored_at > time.time() - self.ttl:
+                self._entries.move_to_end(key)
+                return stored
+            self._entries.pop(key, None)
+
+        if self.store:
+            try:
+                stored = self.store.get(key)
+            except sqlite3.Error as e:
+                print(f"Idempotency store read failed: {str(e)}")
+                stored = None
+            if stored:
+                self._remember(key, stored)
+            return stored
+        return None
+
+    def put(self, key, stored):
+        self._remember(key, stored)
+        if self.store:
+            try:
+                self.store.put(key, stored)
+            except sqlite3.Error as e:
+                print(f"Idempotency store write failed: {str(e)}")
+
+    def _remember(self, key, stored):
+        with self._lock:
+            self._entries[key] = stored
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+
+    def begin(self, key):
+        """
+        Claim a key for processing. Returns None if this request owns it,
+        otherwise the Event of the request already processing it.
+        """
+        with self._lock:
+            event = self._inflight.get(key)
+            if event:
+                return event
+            self._inflight[key] = Event()
+            return None
+
+    def end(self, key):
+        with self._lock:
+            event = self._inflight.pop(key, None)
+        if event:
+            event.set()
+
+
+def create_idempotency_cache(backend=IDEMPOTENCY_BACKEND):
+    store = None
+    if backend == 'sqlite':
+        try:
+            store = SQLiteResponseStore(IDEMPOTENCY_SQLITE_PATH, IDEMPOTENCY_TTL)
+        except sqlite3.Error as e:
+            print(f"Idempotency store unavailable ({str(e)}), keeping keys in memory only")
+    elif backend != 'memory':
+        print(f"Unknown IDEMPOTENCY_BACKEND '{backend}', keeping keys in memory only")
+    return IdempotencyCache(IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_TTL, store)
+
+
+idempotency_cache = create_idempotency_cache()
+
+
+def _request_key():
+    key = request.headers.get('Idempotency-Key')
+    if not key:
+        data = request.get_json(silent=True) if request.is_json else request.form
+        key = data.get('idempotency_key') if data else None
+    return str(key)[:MAX_KEY_LENGTH] if key else None
+
+
+def _replay(stored):
+    idempotency_cache.replays += 1
+    response = Response(stored.body, status=stored.status, mimetype=stored.mimetype)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """
+    Make a view replay-safe. Requests without a key run as before; with a
+    key, a repeat returns the first response instead of running again.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # Read (and cache) the raw body before anything parses it as a form
+        body = request.get_data()
+        key = _request_key()
+        if not key:
+            return view(*args, **kwargs)
+
+        cache_key = f"{request.path}:{key}"
+        fingerprint = hashlib.sha256(body).hexdigest()
+
+        while True:
+            stored = idempotency_cache.get(cache_key)
+            if stored:
+                if stored.fingerprint != fingerprint:
+                    return jsonify({"error": "Idempotency-Key was already used with a different request body"}), 422
+                return _replay(stored)
+
+            inflight = idempotency_cache.begin(cache_key)
+            if inflight is None:
+                break
+            # Same event still being handled - wait for its answer rather than running it twice
+            if not inflight.wait(INFLIGHT_WAIT_SECONDS):
+                return jsonify({"error": "A request with this Idempotency-Key is still in progress"}), 409
+            # Loop: replay its response, or take over if it wasn't stored
+
+        try:
+            response = make_response(view(*args, **kwargs))
+            status = response.status_code
+            if 200 <= status < 500 and status not in _TRANSIENT_STATUSES:
+                idempotency_cache.put(cache_key, StoredResponse(
+                    fingerprint, status, response.get_data(), response.mimetype, time.time()
+                ))
+            return response
+        finally:
+            idempotency_cache.end(cache_key)
+
+    return wrapper
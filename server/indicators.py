@@ -0,0 +1,165 @@
+"""
+Station state codes for the indicator displays (SenseCAP) at each station.
+
+Every station has one code, worked out from the live state:
+
+- 'idle'       nobody at the station
+- 'in_use'     a maker is at it
+- 'violation'  the maker at it has an open violation (until their status resets)
+
+and a version that goes up each time the code changes. Codes are kept up to
+date from the live state change stream (see LiveState.add_listener), so the
+indicator routes read memory only - never the database - and a display
+waiting for a change costs a sleeping thread, not a query:
+
+    GET /station/<id>/indicator?since=<v>&wait=30    long-poll: answers when
+        the version differs from `since` (at once if it's missing), or after
+        `wait` seconds with the same version. Body: {"s": "in_use", "v": 7}
+    GET /station/<id>/indicator/stream               Server-Sent Events: the
+        code now and on every change ("id: 7" / "data: in_use"), with a
+        keepalive comment every INDICATOR_KEEPALIVE seconds
+
+At most INDICATOR_MAX_WAITERS requests wait at once (each holds a server
+thread); past that, requests get 503 and retry. Like the presence wheel, the
+codes follow this process's live state, so with several workers route each
+station's displays to the worker that gets its camera events.
+"""
+import sys
+import os
+import time
+from threading import Condition, Lock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import INDICATOR_KEEPALIVE, INDICATOR_MAX_WAITERS
+
+IDLE = 'idle'
+IN_USE = 'in_use'
+VIOLATION = 'violation'
+
+
+class TooManyWaiters(Exception):
+    """INDICATOR_MAX_WAITERS requests are already waiting."""
+
+
+class StationIndicators:
+    """Current code and version per station, and a condition to wait on per station."""
+
+    def __init__(self, max_waiters):
+        self.max_waiters = max_waiters
+        self._lock = Lock()
+        self._codes = {}        # station_id -> (code, version)
+        self._changed = {}      # station_id -> Condition on self._lock
+        self._waiters = 0
+        self._state = None
+
+    def attach(self, state):
+        self._state = state
+        state.add_listener(self._on_change)
+        self._refresh_all()
+
+    # ------------------------------------------------------------
+    # Codes (from the live state)
+    # ------------------------------------------------------------
+    def _on_change(self, change):
+        kind = change[0]
+        if kind in ('reload', 'clear'):
+            self._refresh_all()
+        elif kind == 'roster' and change[1] == 'stations':
+            self._refresh(change[2]['id'])
+        elif change[1:2] == ['station_status']:
+            self._refresh(change[2]['station_id'] if kind == 'set' else change[2])
+        elif change[1:2] == ['maker_status']:
+            # A maker's status shows on the station they're active at
+            maker_id = change[2]['maker_id'] if kind == 'set' else change[2]
+            _, station_status = self._state.status_rows()
+            for ss in station_status:
+                if ss.get('active_maker_id') == maker_id:
+                    self._refresh(ss['station_id'])
+
+    def _code(self, station_id):
+        station_status = self._state.get_station_status(station_id)
+        if not station_status or not station_status.get('in_use'):
+            return IDLE
+        maker_id = station_status.get('active_maker_id')
+        maker_status = self._state.get_maker_status(maker_id) if maker_id else None
+        if maker_status and maker_status.get('status') == 'violation':
+            return VIOLATION
+        return IN_USE
+
+    def _refresh(self, station_id):
+        # Worked out under the lock, so a slower refresh can't overwrite a newer code
+        with self._lock:
+            code = self._code(station_id)
+            current = self._codes.get(station_id)
+            if current and current[0] == code:
+                return
+            self._codes[station_id] = (code, current[1] + 1 if current else 1)
+            changed = self._changed.get(station_id)
+            if changed:
+                changed.notify_all()
+
+    def _refresh_all(self):
+        for station_id in self._state.station_ids():
+            self._refresh(station_id)
+
+    # ------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------
+    def get(self, station_id):
+        """(code, version), or None for a station the live state doesn't know."""
+        with self._lock:
+            return self._codes.get(station_id)
+
+    def wait(self, station_id, since, timeout):
+        """
+        (code, version) once the version differs from `since`, or after
+        `timeout` seconds. Raises TooManyWaiters when the limit is reached.
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            current = self._codes.get(station_id)
+            if current is None or current[1] != since or timeout <= 0:
+                return current
+            if self._waiters >= self.max_waiters:
+                raise TooManyWaiters(f"{self._waiters} indicator requests are already waiting")
+            changed = self._changed.get(station_id)
+            if changed is None:
+                changed = self._changed[station_id] = Condition(self._lock)
+            self._waiters += 1
+            try:
+                while self._codes[station_id][1] == since:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    changed.wait(remaining)
+                return self._codes[station_id]
+            finally:
+                self._waiters -= 1
+
+    def stream(self, station_id, last_version=None):
+        """Server-Sent Events for one station: its code now, then on each change."""
+        yield f"retry: {INDICATOR_KEEPALIVE * 1000}\n\n"
+        version = last_version
+        while True:
+            try:
+                current = self.wait(station_id, version, INDICATOR_KEEPALIVE)
+            except TooManyWaiters:
+                return   # the display reconnects after `retry`
+            if current is None:
+                return
+            if current[1] == version:
+                # Nothing new - keep proxies and the display from timing out
+                yield ": keepalive\n\n"
+                continue
+            code, version = current
+            yield f"id: {version}\ndata: {code}\n\n"
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for code, _ in self._codes.values():
+                counts[code] = counts.get(code, 0) + 1
+            return {"stations": counts, "waiting": self._waiters, "max_waiters": self.max_waiters}
+
+
+indicators = StationIndicators(INDICATOR_MAX_WAITERS)
@@ -0,0 +1,330 @@
+"""
+Append-only local journal of accepted events.
+
+Every event a route accepts (toggle, enter, leave, violation, reset) is
+appended as one JSON line, together with the live state changes it made
+(see LiveState.add_listener). Changes made off the request path - a violation
+status clearing, a station released by the presence sweeper, a row reloaded
+after a write conflict - are journaled as their own entries.
+
+    {"seq": 42, "ts": 1718000000.1, "event": "enter", "path": "/station/enter",
+     "body": {...}, "status": 200, "changes": [["set", "station_status", {...}], ...]}
+
+Files in JOURNAL_DIR:
+- journal-<first seq>.log   segments, a new one every JOURNAL_SEGMENT_BYTES
+- snapshot-<seq>.json       the whole live state as of that seq, written
+                            every JOURNAL_SNAPSHOT_EVERY entries (and after
+                            a full load from the database)
+
+On startup the live state is rebuilt from the newest snapshot plus the
+entries after it, so the server can serve before the database answers. The
+database is still loaded afterwards and stays the source of truth. Segments
+covered by a snapshot are deleted. replay_journal.py sends a recorded
+journal back through the routes.
+"""
+import glob
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock, Thread, local
+
+from flask import request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import (
+    JOURNAL_ENABLED,
+    JOURNAL_DIR,
+    JOURNAL_SEGMENT_BYTES,
+    JOURNAL_SNAPSHOT_EVERY,
+    JOURNAL_FSYNC,
+)
+
+# Request fields not worth keeping (replays run without the image)
+OMITTED_FIELDS = ('image_base64', 'idempotency_key')
+
+# Snapshots kept on disk (the newest is used; older ones are a fallback)
+KEEP_SNAPSHOTS = 2
+
+
+def _segment_path(directory, first_seq):
+    return os.path.join(directory, f"journal-{first_seq:012d}.log")
+
+
+def _snapshot_path(directory, seq):
+    return os.path.join(directory, f"snapshot-{seq:012d}.json")
+
+
+def _seq_from_name(path):
+    return int(os.path.basename(path).split('-')[1].split('.')[0])
+
+
+def list_segments(directory):
+    """Segment files, oldest first."""
+    return sorted(glob.glob(os.path.join(directory, 'journal-*.log')), key=_seq_from_name)
+
+
+def list_snapshots(directory):
+    """Snapshot files, newest first."""
+    return sorted(glob.glob(os.path.join(directory, 'snapshot-*.json')), key=_seq_from_name, reverse=True)
+
+
+def read_entries(directory, since=0):
+    """Yield journal entries with seq > since, in order. A torn last line is skipped."""
+    segments = list_segments(directory)
+    for index, path in enumerate(segments):
+        # Skip whole segments that end before `since`
+        if index + 1 < len(segments) and _seq_from_name(segments[index + 1]) <= since + 1:
+            continue
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry['seq'] > since:
+                    yield entry
+
+
+class Journal:
+    """Segmented append-only event log plus periodic live state snapshots."""
+
+    def __init__(self, directory, segment_bytes, snapshot_every, fsync=False, enabled=True):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.enabled = enabled
+        self._lock = Lock()
+        self._local = local()
+        self._file = None
+        self._seq = 0
+        self._since_snapshot = 0
+        self._snapshotting = False
+        self._state = None
+        self.appended = 0
+        self.snapshots = 0
+
+    # ------------------------------------------------------------
+    # Files
+    # ------------------------------------------------------------
+    def _open(self):
+        """Find the last seq on disk and reopen the newest segment for appending."""
+        os.makedirs(self.directory, exist_ok=True)
+        segments = list_segments(self.directory)
+        snapshots = list_snapshots(self.directory)
+        self._seq = _seq_from_name(snapshots[0]) if snapshots else 0
+
+        if segments:
+            path = segments[-1]
+            with open(path, 'rb+') as f:
+                data = f.read()
+                # Drop a line torn by a crash mid-write so the next append starts clean
+                end = data.rfind(b'\n') + 1
+                if end < len(data):
+                    f.truncate(end)
+                for line in data[:end].splitlines():
+                    try:
+                        self._seq = max(self._seq, json.loads(line)['seq'])
+                    except ValueError:
+                        continue
+            self._file = open(path, 'ab')
+        else:
+            self._file = open(_segment_path(self.directory, self._seq + 1), 'ab')
+
+    def _rotate(self):
+        self._file.close()
+        self._file = open(_segment_path(self.directory, self._seq + 1), 'ab')
+
+    def _append(self, entry):
+        with self._lock:
+            self._seq += 1
+            entry['seq'] = self._seq
+            self._file.write(json.dumps(entry, separators=(',', ':'), default=str).encode('utf-8') + b'\n')
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            if self._file.tell() >= self.segment_bytes:
+                self._rotate()
+            self.appended += 1
+            self._since_snapshot += 1
+            due = self._since_snapshot >= self.snapshot_every
+        if due:
+            self.snapshot_async()
+
+    # ------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------
+    def attach(self, state):
+        """Open the journal for appending and start recording the changes made to a LiveState."""
+        if not self.enabled:
+            return
+        self._open()
+        self._state = state
+        state.add_listener(self._on_change)
+
+    def _on_change(self, change):
+        if change[0] == 'reload':
+            # A full load from the database - start a fresh base to replay from
+            self.snapshot_async()
+            return
+        collected = getattr(self._local, 'changes', None)
+        if collected is not None:
+            collected.append(change)
+        else:
+            self._append({'ts': time.time(), 'event': 'sync', 'changes': [change]})
+
+    @contextmanager
+    def event(self, name, path=None, body=None):
+        """
+        Collect the changes made inside the block into one entry. Yields a
+        dict; set its 'status' to record the response status. Entries without
+        changes are only kept for accepted requests (path given, status below
+        400), so replays see every event the server took.
+        """
+        if self._state is None or getattr(self._local, 'changes', None) is not None:
+            # Not recording, or nested inside another event (which collects the changes)
+            yield {}
+            return
+
+        entry = {'ts': time.time(), 'event': name}
+        if path:
+            entry['path'] = path
+            entry['body'] = body
+        self._local.changes = []
+        try:
+            yield entry
+        finally:
+            entry['changes'] = self._local.changes
+            self._local.changes = None
+            if entry['changes'] or (path and entry.get('status', 500) < 400):
+                self._append(entry)
+
+    # ------------------------------------------------------------
+    # Snapshots and restore
+    # ------------------------------------------------------------
+    def snapshot_async(self):
+        with self._lock:
+            if self._snapshotting or self._state is None:
+                return
+            self._snapshotting = True
+        Thread(target=self.snapshot, name='journal-snapshot', daemon=True).start()
+
+    def snapshot(self):
+        """Write the current live state and drop the segments it covers."""
+        try:
+            with self._lock:
+                seq = self._seq
+                self._since_snapshot = 0
+            # Changes applied after `seq` may already be in the export; replaying
+            # them again is harmless since every change sets an absolute value
+            data = {'seq': seq, 'ts': time.time(), 'state': self._state.export()}
+            path = _snapshot_path(self.directory, seq)
+            tmp = path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(data, f, separators=(',', ':'), default=str)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+            self.snapshots += 1
+            self._prune(seq)
+        except Exception as e:
+            print(f"Journal: snapshot failed: {str(e)}")
+        finally:
+            self._snapshotting = False
+
+    def _prune(self, snapshot_seq):
+        for old in list_snapshots(self.directory)[KEEP_SNAPSHOTS:]:
+            os.remove(old)
+        # Keep everything after the oldest snapshot still on disk
+        oldest = _seq_from_name(list_snapshots(self.directory)[-1])
+        with self._lock:
+            current = self._file.name
+        segments = list_segments(self.directory)
+        for index, path in enumerate(segments[:-1]):
+            last_seq = _seq_from_name(segments[index + 1]) - 1
+            if last_seq <= oldest and path != current:
+                os.remove(path)
+
+    def restore(self, state):
+        """
+        Rebuild a LiveState from the newest snapshot and the entries after it.
+        Returns False if there was nothing to restore from.
+        """
+        if not self.enabled:
+            return False
+        start = time.time()
+
+        snapshot_seq = 0
+        for path in list_snapshots(self.directory):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                state.restore(data['state'])
+                snapshot_seq = data['seq']
+                break
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Journal: skipping unreadable snapshot {os.path.basename(path)}: {str(e)}")
+
+        replayed = 0
+        for entry in read_entries(self.directory, since=snapshot_seq):
+            for change in entry.get('changes', ()):
+                state.apply(change)
+            replayed += 1
+
+        if not snapshot_seq and not replayed:
+            return False
+        state.loaded = True
+        print(f"Journal: live state restored from snapshot {snapshot_seq} + {replayed} entries "
+              f"in {(time.time() - start) * 1000:.1f}ms")
+        return True
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "directory": self.directory,
+                "seq": self._seq,
+                "appended": self.appended,
+                "since_snapshot": self._since_snapshot,
+                "snapshots_written": self.snapshots,
+                "segments": len(list_segments(self.directory)) if self._state else 0,
+            }
+
+
+journal = Journal(JOURNAL_DIR, JOURNAL_SEGMENT_BYTES, JOURNAL_SNAPSHOT_EVERY,
+                  fsync=JOURNAL_FSYNC, enabled=JOURNAL_ENABLED)
+
+
+def _request_body():
+    if request.files:
+        body = request.form.to_dict()
+    else:
+        body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return body
+    return {k: v for k, v in body.items() if k not in OMITTED_FIELDS}
+
+
+def journaled(name):
+    """Record the request and the live state changes it made as one journal entry."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with journal.event(name, request.path, _request_body()) as entry:
+                rv = view(*args, **kwargs)
+                if isinstance(rv, tuple):
+                    entry['status'] = rv[1]
+                else:
+                    entry['status'] = getattr(rv, 'status_code', 200)
+                return rv
+        return wrapper
+    return decorator
@@ -0,0 +1,390 @@
+"""
+In-memory mirror of the makerspace's live state.
+
+Holds the roster (makers, stations) and the live status rows (maker_status,
+station_status). Every route applies its transitions here as well as to the
+database. When write-behind mode is on (see config.WRITE_BEHIND) this copy is
+authoritative for reads, so camera-facing routes never wait on Supabase. The
+same goes while the database is unavailable (degraded mode, see database.py).
+
+Every change is reported to the listeners (journal.py, analytics.py) as a small list:
+['set', table, row], ['del', table, key], ['clear'], ['roster', table, row]
+(['roster', 'makers', [rows]] for a bulk enrollment), or ['reload'] after a
+full load. apply() plays such a change back.
+
+roster_version counts changes to the roster; dashboards cache the roster and
+WebSocket events refer to it by id (see roster.py).
+"""
+import sys
+import os
+from datetime import datetime, timezone
+from threading import RLock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import supabase
+from database import DatabaseUnavailable
+from write_behind import memory_is_authoritative
+
+
+class LiveState:
+    """Roster and live status rows, keyed by id. All access goes through the lock."""
+
+    def __init__(self):
+        self._lock = RLock()
+        self.makers = {}              # maker_id -> makers row
+        self.maker_ids_by_label = {}  # external_label -> maker_id
+        self.stations = {}            # station_id -> stations row
+        self.maker_status = {}        # maker_id -> maker_status row
+        self.station_status = {}      # station_id -> station_status row
+        self.roster_version = 0       # goes up whenever a maker or station row changes
+        self.loaded = False
+        self._listeners = []          # called with each change, outside the lock
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _changed(self, *change):
+        for listener in self._listeners:
+            listener(list(change))
+
+    def load(self, client):
+        """Populate the roster and live status from the database."""
+        makers = client.table('makers').select('*').execute().data or []
+        stations = client.table('stations').select('*').execute().data or []
+        maker_status = client.table('maker_status').select('*').execute().data or []
+        station_status = client.table('station_status').select('*').execute().data or []
+
+        with self._lock:
+            self.makers = {}
+            self.maker_ids_by_label = {}
+            for maker in makers:
+                self._index_maker(maker)
+            self.stations = {s['id']: s for s in stations}
+            self.maker_status = {ms['maker_id']: ms for ms in maker_status}
+            self.station_status = {ss['station_id']: ss for ss in station_status}
+            self.roster_version += 1
+            self.loaded = True
+
+        print(f"Live state loaded: {len(makers)} makers, {len(stations)} stations, "
+              f"{len(maker_status)} present")
+        self._changed('reload')
+
+    def export(self):
+        """Everything needed to rebuild this state (a journal snapshot)."""
+        with self._lock:
+            return {
+                'makers': list(self.makers.values()),
+                'stations': list(self.stations.values()),
+                'maker_status': list(self.maker_status.values()),
+                'station_status': list(self.station_status.values()),
+            }
+
+    def restore(self, data):
+        """Replace the whole state with an export()."""
+        with self._lock:
+            self.makers = {}
+            self.maker_ids_by_label = {}
+            for maker in data['makers']:
+                self._index_maker(maker)
+            self.stations = {s['id']: s for s in data['stations']}
+            self.maker_status = {ms['maker_id']: ms for ms in data['maker_status']}
+            self.station_status = {ss['station_id']: ss for ss in data['station_status']}
+            self.roster_version += 1
+            self.loaded = True
+
+    def apply(self, change):
+        """Play back one change reported to the listeners (without reporting it again)."""
+        with self._lock:
+            kind = change[0]
+            if kind == 'set':
+                rows, key_column = self._status_table(change[1])
+                rows[change[2][key_column]] = change[2]
+            elif kind == 'del':
+                rows, _ = self._status_table(change[1])
+                rows.pop(change[2], None)
+            elif kind == 'clear':
+                self.maker_status.clear()
+                self.station_status.clear()
+            elif kind == 'roster':
+                if change[1] == 'makers':
+                    for maker in (change[2] if isinstance(change[2], list) else [change[2]]):
+                        self._index_maker(maker)
+                else:
+                    self.stations[change[2]['id']] = change[2]
+                self.roster_version += 1
+
+    # ------------------------------------------------------------
+    # Roster
+    # ------------------------------------------------------------
+    def _index_maker(self, maker):
+        previous = self.makers.get(maker['id'])
+        if previous and previous['external_label'] != maker['external_label']:
+            self.maker_ids_by_label.pop(previous['external_label'], None)
+        self.makers[maker['id']] = maker
+        self.maker_ids_by_label[maker['external_label']] = maker['id']
+
+    def add_maker(self, maker):
+        with self._lock:
+            if self.makers.get(maker['id']) == maker:
+                return
+            self._index_maker(maker)
+            self.roster_version += 1
+        self._changed('roster', 'makers', maker)
+
+    def add_makers(self, makers):
+        """Add or update many makers as one roster change (one version bump, one event)."""
+        with self._lock:
+            makers = [m for m in makers if self.makers.get(m['id']) != m]
+            if not makers:
+                return
+            for maker in makers:
+                self._index_maker(maker)
+            self.roster_version += 1
+        self._changed('roster', 'makers', makers)
+
+    def add_station(self, station):
+        with self._lock:
+            if self.stations.get(station['id']) == station:
+                return
+            self.stations[station['id']] = station
+            self.roster_version += 1
+        self._changed('roster', 'stations', station)
+
+    def roster(self):
+        """Every maker and station (names and labels only) at the current roster version."""
+        with self._lock:
+            return {
+                "version": self.roster_version,
+                "makers": [roster_entry('makers', m) for m in self.makers.values()],
+                "stations": [roster_entry('stations', s) for s in self.stations.values()],
+            }
+
+    def maker_by_label(self, external_label):
+        with self._lock:
+            maker_id = self.maker_ids_by_label.get(external_label)
+            return self.makers.get(maker_id) if maker_id else None
+
+    def maker(self, maker_id):
+        with self._lock:
+            return self.makers.get(maker_id)
+
+    def station(self, station_id):
+        with self._lock:
+            return self.stations.get(station_id)
+
+    def station_ids(self):
+        with self._lock:
+            return list(self.stations)
+
+    # ------------------------------------------------------------
+    # Live status
+    # ------------------------------------------------------------
+    def get_maker_status(self, maker_id):
+        with self._lock:
+            row = self.maker_status.get(maker_id)
+            return dict(row) if row else None
+
+    def get_station_status(self, station_id):
+        with self._lock:
+            row = self.station_status.get(station_id)
+            return dict(row) if row else None
+
+    def status_rows(self):
+        """Copies of every (maker_status, station_status) row, for /state in degraded mode."""
+        with self._lock:
+            return ([dict(r) for r in self.maker_status.values()],
+                    [dict(r) for r in self.station_status.values()])
+
+    def stations_in_use(self):
+        with self._lock:
+            return [sid for sid, row in self.station_status.items() if row.get('in_use')]
+
+    def set_maker_status(self, row):
+        with self._lock:
+            self.maker_status[row['maker_id']] = dict(row)
+        self._changed('set', 'maker_status', dict(row))
+
+    def remove_maker_status(self, maker_id):
+        with self._lock:
+            self.maker_status.pop(maker_id, None)
+        self._changed('del', 'maker_status', maker_id)
+
+    def set_station_status(self, row):
+        with self._lock:
+            self.station_status[row['station_id']] = dict(row)
+        self._changed('set', 'station_status', dict(row))
+
+    def set_status(self, table, row):
+        if table == 'maker_status':
+            self.set_maker_status(row)
+        else:
+            self.set_station_status(row)
+
+    def compare_and_set(self, table, row, expected_version):
+        """
+        Store a status row only if the current copy is at expected_version
+        (None = no row yet). Returns False on a version mismatch.
+        """
+        rows, key_column = self._status_table(table)
+        with self._lock:
+            key = row[key_column] if row else None
+            stored = self._compare_and_set(rows, key, row, expected_version)
+        if stored:
+            self._changed('set', table, dict(row))
+        return stored
+
+    def compare_and_remove(self, table, key, expected_version):
+        rows, _ = self._status_table(table)
+        with self._lock:
+            removed = self._compare_and_set(rows, key, None, expected_version)
+        if removed:
+            self._changed('del', table, key)
+        return removed
+
+    def replace_status(self, table, match, row):
+        """Overwrite (or drop, when row is None) a status row with the database's copy."""
+        rows, key_column = self._status_table(table)
+        with self._lock:
+            if row:
+                rows[row[key_column]] = dict(row)
+            else:
+                rows.pop(match.get(key_column), None)
+        if row:
+            self._changed('set', table, dict(row))
+        else:
+            self._changed('del', table, match.get(key_column))
+
+    def _status_table(self, table):
+        if table == 'maker_status':
+            return self.maker_status, 'maker_id'
+        return self.station_status, 'station_id'
+
+    @staticmethod
+    def _compare_and_set(rows, key, row, expected_version):
+        current = rows.get(key)
+        current_version = (current.get('version') or 0) if current else None
+        if current_version != expected_version:
+            return False
+        if row is None:
+            rows.pop(key, None)
+        else:
+            rows[key] = dict(row)
+        return True
+
+    def clear_status(self):
+        """Drop all live status rows (system reset). The roster is kept."""
+        with self._lock:
+            self.maker_status.clear()
+            self.station_status.clear()
+        self._changed('clear')
+
+
+live_state = LiveState()
+
+
+# Fields of a roster row that dashboards cache (see roster.py)
+ROSTER_FIELDS = {
+    'makers': ('id', 'display_name', 'external_label'),
+    'stations': ('id', 'name'),
+}
+
+
+def roster_entry(table, row):
+    return {field: row.get(field) for field in ROSTER_FIELDS[table]}
+
+
+def now_iso():
+    """Timestamp for updated_at/created_at, taken when the event happens (not when it's written)."""
+    return datetime.now(timezone.utc).isoformat()
+
+
+# ============================================================
+# Lookups used by the routes
+#
+# When memory is authoritative (write-behind mode, or the database is
+# unavailable or still catching up on queued writes), answers come from
+# memory; the roster falls back to the database on a miss, e.g. a maker
+# enrolled after startup. Otherwise they go straight to Supabase, as
+# before - and to memory if that call fails.
+# ============================================================
+
+def _first(response):
+    return response.data[0] if response.data else None
+
+
+def find_maker_by_label(external_label):
+    if memory_is_authoritative():
+        maker = live_state.maker_by_label(external_label)
+        if maker:
+            return maker
+
+    try:
+        maker = _first(supabase.table('makers').select('*').eq('external_label', external_label).execute())
+    except DatabaseUnavailable:
+        return live_state.maker_by_label(external_label)
+    if maker:
+        live_state.add_maker(maker)
+    return maker
+
+
+def find_maker(maker_id):
+    if memory_is_authoritative():
+        maker = live_state.maker(maker_id)
+        if maker:
+            return maker
+
+    try:
+        maker = _first(supabase.table('makers').select('*').eq('id', maker_id).execute())
+    except DatabaseUnavailable:
+        return live_state.maker(maker_id)
+    if maker:
+        live_state.add_maker(maker)
+    return maker
+
+
+def find_station(station_id):
+    if memory_is_authoritative():
+        station = live_state.station(station_id)
+        if station:
+            return station
+
+    try:
+        station = _first(supabase.table('stations').select('*').eq('id', station_id).execute())
+    except DatabaseUnavailable:
+        return live_state.station(station_id)
+    if station:
+        live_state.add_station(station)
+    return station
+
+
+# Roster rows only change through enrollment, so these read memory first and
+# go to the database only for an id or label this process hasn't seen yet.
+
+def roster_maker_by_label(external_label):
+    return live_state.maker_by_label(external_label) or find_maker_by_label(external_label)
+
+
+def roster_maker(maker_id):
+    return live_state.maker(maker_id) or find_maker(maker_id)
+
+
+def roster_station(station_id):
+    return live_state.station(station_id) or find_station(station_id)
+
+
+def find_maker_status(maker_id):
+    if memory_is_authoritative():
+        return live_state.get_maker_status(maker_id)
+    try:
+        return _first(supabase.table('maker_status').select('*').eq('maker_id', maker_id).execute())
+    except DatabaseUnavailable:
+        return live_state.get_maker_status(maker_id)
+
+
+def find_station_status(station_id):
+    if memory_is_authoritative():
+        return live_state.get_station_status(station_id)
+    try:
+        return _first(supabase.table('station_status').select('*').eq('station_id', station_id).execute())
+    except DatabaseUnavailable:
+        return live_state.get_station_status(station_id)
@@ -0,0 +1,355 @@
+"""
+In-process stand-in for the Supabase database.
+
+Implements the part of the supabase-py query builder this server uses
+(select with embedded makers(*)/stations(*), insert, upsert, update, delete,
+the eq/neq/lt/lte/gt/gte/in_/is_/not_/or_ filters, order, limit, range) on
+plain Python lists, with the primary keys and unique constraints from
+specs/dbschema.md. A unique violation raises LocalAPIError with the
+Postgres code '23505', like the real client.
+
+Set LOCAL_DB to a seed file (JSON: table name -> list of rows) or to
+'memory' for an empty database, and config.py connects to this instead of
+Supabase. Used by the capture/replay harness (replay_capture.py); handy for
+running the server without network access too.
+"""
+import json
+import re
+import uuid
+from datetime import datetime, timezone
+from threading import Lock
+
+# table -> (primary key column, other unique columns)
+KEYS = {
+    'makers': ('id', ('external_label',)),
+    'stations': ('id', ()),
+    'cameras': ('id', ('camera_key',)),
+    'maker_status': ('maker_id', ()),
+    'station_status': ('station_id', ()),
+    'violations': ('id', ()),
+}
+
+# Columns filled in on insert when missing
+DEFAULTS = {
+    'makers': ('id', 'created_at'),
+    'stations': ('id', 'created_at'),
+    'cameras': ('id', 'created_at'),
+    'maker_status': ('updated_at', 'version'),
+    'station_status': ('updated_at', 'version'),
+    'violations': ('id', 'created_at'),
+}
+
+# Embedded resources: name(*) in a select -> foreign key columns that point at it
+EMBEDS = {
+    'makers': ('maker_id', 'active_maker_id'),
+    'stations': ('station_id',),
+}
+
+UNIQUE_VIOLATION = '23505'
+
+
+class LocalAPIError(Exception):
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+
+class LocalResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _default(column):
+    if column == 'id':
+        return str(uuid.uuid4())
+    if column == 'version':
+        return 0
+    return _now()
+
+
+def _text(value):
+    # PostgREST compares filter values as text; booleans are lowercase there
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return None if value is None else str(value)
+
+
+def _compare(op, left, right):
+    if op == 'is':
+        return left is None if right == 'null' else _text(left) == str(right)
+    if left is None:
+        return False
+    if op == 'eq':
+        return _text(left) == _text(right)
+    if op == 'neq':
+        return _text(left) != _text(right)
+    if op == 'in':
+        return _text(left) in {_text(v) for v in right}
+    left, right = _text(left), _text(right)
+    return {
+        'lt': left < right,
+        'lte': left <= right,
+        'gt': left > right,
+        'gte': left >= right,
+    }[op]
+
+
+def _split_top_level(expr):
+    """Split 'a,and(b,c),d' on commas outside parentheses."""
+    parts, depth, current = [], 0, ''
+    for ch in expr:
+        if ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        if ch == ',' and depth == 0:
+            parts.append(current)
+            current = ''
+        else:
+            current += ch
+    parts.append(current)
+    return parts
+
+
+def _parse_or(expr):
+    """PostgREST or=(...) syntax -> predicate. Supports nested and(...)."""
+    def term(text):
+        nested = re.match(r'(and|or)\((.*)\)$', text)
+        if nested:
+            preds = [term(part) for part in _split_top_level(nested.group(2))]
+            if nested.group(1) == 'and':
+                return lambda row: all(p(row) for p in preds)
+            return lambda row: any(p(row) for p in preds)
+        column, op, value = text.split('.', 2)
+        value = value[1:-1] if value.startswith('"') and value.endswith('"') else value
+        return lambda row: _compare(op, row.get(column), value)
+
+    preds = [term(part) for part in _split_top_level(expr)]
+    return lambda row: any(p(row) for p in preds)
+
+
+class LocalQuery:
+    def __init__(self, db, table):
+        self._db = db
+        self._table = table
+        self._action = 'select'
+        self._columns = '*'
+        self._count = None
+        self._payload = None
+        self._on_conflict = None
+        self._filters = []
+        self._negate = False
+        self._order = []
+        self._limit = None
+        self._range = None
+
+    # Actions
+    def select(self, columns='*', count=None):
+        self._columns, self._count = columns, count
+        return self
+
+    def insert(self, rows):
+        self._action, self._payload = 'insert', rows
+        return self
+
+    def upsert(self, rows, on_conflict=None):
+        self._action, self._payload, self._on_conflict = 'upsert', rows, on_conflict
+        return self
+
+    def update(self, row):
+        self._action, self._payload = 'update', row
+        return self
+
+    def delete(self):
+        self._action = 'delete'
+        return self
+
+    # Filters
+    def _filter(self, op, column, value):
+        negate, self._negate = self._negate, False
+        self._filters.append(lambda row: _compare(op, row.get(column), value) != negate)
+        return self
+
+    def eq(self, column, value):
+        return self._filter('eq', column, value)
+
+    def neq(self, column, value):
+        return self._filter('neq', column, value)
+
+    def lt(self, column, value):
+        return self._filter('lt', column, value)
+
+    def lte(self, column, value):
+        return self._filter('lte', column, value)
+
+    def gt(self, column, value):
+        return self._filter('gt', column, value)
+
+    def gte(self, column, value):
+        return self._filter('gte', column, value)
+
+    def in_(self, column, values):
+        return self._filter('in', column, list(values))
+
+    def is_(self, column, value):
+        return self._filter('is', column, value)
+
+    @property
+    def not_(self):
+        self._negate = True
+        return self
+
+    def or_(self, expr):
+        self._filters.append(_parse_or(expr))
+        return self
+
+    # Modifiers
+    def order(self, column, desc=False):
+        self._order.append((column, desc))
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def range(self, start, end):
+        self._range = (start, end)
+        return self
+
+    def execute(self):
+        with self._db.lock:
+            return getattr(self, f'_execute_{self._action}')(self._db.tables.setdefault(self._table, []))
+
+    # ------------------------------------------------------------
+    def _matches(self, rows):
+        return [row for row in rows if all(f(row) for f in self._filters)]
+
+    def _execute_select(self, rows):
+        matched = self._matches(rows)
+        for column, desc in reversed(self._order):
+            matched = sorted(matched, key=lambda r: (r.get(column) is None, _text(r.get(column)) or ''), reverse=desc)
+        count = len(matched)
+        if self._range:
+            matched = matched[self._range[0]:self._range[1] + 1]
+        if self._limit is not None:
+            matched = matched[:self._limit]
+        return LocalResponse([self._project(row) for row in matched], count if self._count else None)
+
+    def _project(self, row):
+        parts = [p.strip() for p in _split_top_level(self._columns)]
+        out = dict(row) if '*' in parts else {p: row.get(p) for p in parts if '(' not in p}
+        for part in parts:
+            embed = re.match(r'(\w+)\((.*)\)$', part)
+            if embed and embed.group(1) in EMBEDS:
+                name = embed.group(1)
+                key = next((k for k in EMBEDS[name] if k in row), None)
+                target = self._db.find(name, 'id', row.get(key)) if key else None
+                out[name] = dict(target) if target else None
+        return out
+
+    def _payload_rows(self):
+        rows = self._payload if isinstance(self._payload, list) else [self._payload]
+        return [dict(r) for r in rows]
+
+    def _check_unique(self, rows, row, ignore=None):
+        primary, unique = KEYS.get(self._table, ('id', ()))
+        for column in (primary,) + unique:
+            if row.get(column) is None:
+                continue
+            for other in rows:
+                if other is not ignore and _text(other.get(column)) == _text(row[column]):
+                    raise LocalAPIError(
+                        f'duplicate key value violates unique constraint "{self._table}_{column}_key"',
+                        UNIQUE_VIOLATION,
+                    )
+
+    def _with_defaults(self, row):
+        for column in DEFAULTS.get(self._table, ()):
+            if row.get(column) is None:
+                row[column] = _default(column)
+        return row
+
+    def _execute_insert(self, rows):
+        inserted = []
+        for row in self._payload_rows():
+            row = self._with_defaults(row)
+            self._check_unique(rows + inserted, row)
+            inserted.append(row)
+        rows.extend(inserted)
+        return LocalResponse([dict(r) for r in inserted])
+
+    def _execute_upsert(self, rows):
+        key = self._on_conflict or KEYS.get(self._table, ('id', ()))[0]
+        written = []
+        for row in self._payload_rows():
+            existing = next((r for r in rows if key in row and _text(r.get(key)) == _text(row[key])), None)
+            if existing is not None:
+                existing.update(row)
+                written.append(dict(existing))
+            else:
+                row = self._with_defaults(row)
+                self._check_unique(rows, row)
+                rows.append(row)
+                written.append(dict(row))
+        return LocalResponse(written)
+
+    def _execute_update(self, rows):
+        updated = []
+        for row in self._matches(rows):
+            candidate = {**row, **self._payload}
+            self._check_unique(rows, candidate, ignore=row)
+            row.update(self._payload)
+            updated.append(dict(row))
+        return LocalResponse(updated)
+
+    def _execute_delete(self, rows):
+        deleted = self._matches(rows)
+        for row in deleted:
+            rows.remove(row)
+        return LocalResponse([dict(r) for r in deleted])
+
+
+class LocalDatabase:
+    """A Supabase-client-shaped in-memory database."""
+
+    def __init__(self, tables=None):
+        self.lock = Lock()
+        self.tables = {name: [dict(r) for r in rows] for name, rows in (tables or {}).items()}
+
+    @classmethod
+    def from_seed(cls, path):
+        """'memory' for an empty database, otherwise a JSON file of table -> rows."""
+        if path == 'memory':
+            return cls()
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def table(self, name):
+        return LocalQuery(self, name)
+
+    def find(self, table, column, value):
+        return next((r for r in self.tables.get(table, []) if _text(r.get(column)) == _text(value)), None)
+
+    def dump(self):
+        """Copy of every table (table -> rows)."""
+        with self.lock:
+            return {name: [dict(r) for r in rows] for name, rows in self.tables.items()}
+
+
+_instances = {}
+_instances_lock = Lock()
+
+
+def connect(seed):
+    """The database for a seed, shared per process so a reconnect doesn't start it over."""
+    with _instances_lock:
+        if seed not in _instances:
+            _instances[seed] = LocalDatabase.from_seed(seed)
+            print(f"Using the local database stand-in ({seed})")
+        return _instances[seed]
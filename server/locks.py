@@ -0,0 +1,196 @@
+"""
+Striped locks for maker/station state transitions.
+
+Every route that reads a status row, decides, and writes it back holds the
+lock for the maker and/or station it touches for that whole sequence, so two
+events for the same maker (or station) are applied one after the other.
+Events for unrelated makers and stations run in parallel.
+
+Keys ('maker:<id>', 'station:<id>') hash onto a fixed array of LOCK_STRIPES
+locks, so memory doesn't grow with the roster. Two keys can share a stripe;
+that only costs a little extra waiting. When a route needs several keys the
+stripes are always taken in index order, so routes can't deadlock each other.
+
+These locks coordinate threads within one server process. Across worker
+processes (run_workers.py) the database is the only shared state.
+"""
+import sys
+import os
+import time
+import zlib
+from contextlib import contextmanager, nullcontext
+from threading import Lock, RLock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import LOCK_STRIPES, LOCK_TIMEOUT, LOCK_WAIT_WARN_MS
+from live_state import find_maker_status, find_station_status
+
+# How many times hold_station()/hold_maker() re-read a row that keeps changing
+# between the unlocked peek and taking the locks
+OCCUPANT_RETRIES = 5
+
+
+class LockTimeout(Exception):
+    """Raised when a state lock can't be acquired within LOCK_TIMEOUT."""
+
+
+def maker_key(maker_id):
+    return f"maker:{maker_id}"
+
+
+def station_key(station_id):
+    return f"station:{station_id}"
+
+
+class LockStats:
+    """Wait-time counters per key type ('maker', 'station')."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._stats = {}
+
+    def record(self, kind, wait_ms, timed_out=False):
+        with self._lock:
+            stats = self._stats.setdefault(kind, {
+                "acquired": 0,
+                "contended": 0,
+                "timeouts": 0,
+                "total_wait_ms": 0.0,
+                "max_wait_ms": 0.0
+            })
+            if timed_out:
+                stats["timeouts"] += 1
+                return
+            stats["acquired"] += 1
+            # Anything over a millisecond means another request held the stripe
+            if wait_ms >= 1.0:
+                stats["contended"] += 1
+            stats["total_wait_ms"] += wait_ms
+            stats["max_wait_ms"] = max(stats["max_wait_ms"], wait_ms)
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for kind, stats in self._stats.items():
+                avg = stats["total_wait_ms"] / stats["acquired"] if stats["acquired"] else 0.0
+                result[kind] = {
+                    **stats,
+                    "total_wait_ms": round(stats["total_wait_ms"], 3),
+                    "max_wait_ms": round(stats["max_wait_ms"], 3),
+                    "avg_wait_ms": round(avg, 3)
+                }
+            return result
+
+
+class StripedLocks:
+    """A fixed pool of re-entrant locks addressed by key hash."""
+
+    def __init__(self, stripes, timeout):
+        self._locks = [RLock() for _ in range(max(1, stripes))]
+        self.timeout = timeout
+        self.stats = LockStats()
+
+    def _stripe(self, key):
+        return zlib.crc32(key.encode('utf-8')) % len(self._locks)
+
+    @contextmanager
+    def hold(self, *keys, trace=None):
+        """
+        Hold the locks for every key for the duration of the block.
+
+        Wait time is recorded per key type and, if a trace is given, added to
+        its 'lock_wait' span.
+        """
+        # One entry per stripe (keys sharing a stripe only lock it once), in
+        # stripe order so concurrent multi-key holders never deadlock
+        stripes = {}
+        for key in keys:
+            if key:
+                stripes.setdefault(self._stripe(key), key)
+
+        acquired = []
+        start = time.perf_counter()
+        try:
+            for index in sorted(stripes):
+                key = stripes[index]
+                kind = key.split(':', 1)[0]
+                wait_start = time.perf_counter()
+                remaining = max(0.0, self.timeout - (wait_start - start))
+                if not self._locks[index].acquire(timeout=remaining):
+                    self.stats.record(kind, 0, timed_out=True)
+                    raise LockTimeout(f"Timed out waiting for {key}, please retry")
+                acquired.append(index)
+                self.stats.record(kind, (time.perf_counter() - wait_start) * 1000)
+
+            wait_ms = (time.perf_counter() - start) * 1000
+            if trace is not None:
+                trace.spans['lock_wait'] = round(trace.spans.get('lock_wait', 0) + wait_ms, 3)
+            if wait_ms >= LOCK_WAIT_WARN_MS:
+                print(f"Slow lock wait: {wait_ms:.1f}ms for {', '.join(k for k in keys if k)}")
+
+            yield
+        finally:
+            for index in reversed(acquired):
+                self._locks[index].release()
+
+
+state_locks = StripedLocks(LOCK_STRIPES, LOCK_TIMEOUT)
+
+
+@contextmanager
+def hold_station(station_id, trace=None):
+    """
+    Lock a station together with the maker currently at it, and yield its
+    station_status row (None if there is none) as read under the lock.
+
+    The occupant has to be read before its lock can be taken, so the row is
+    read again once both locks are held; if someone entered or left in
+    between, the locks are dropped and it tries again.
+    """
+    for _ in range(OCCUPANT_RETRIES):
+        with trace.span('db_lookup') if trace else nullcontext():
+            status = find_station_status(station_id)
+        occupant = status.get('active_maker_id') if status else None
+
+        with state_locks.hold(station_key(station_id), maker_key(occupant) if occupant else None, trace=trace):
+            with trace.span('db_lookup') if trace else nullcontext():
+                status = find_station_status(station_id)
+            if (status.get('active_maker_id') if status else None) == occupant:
+                yield status
+                return
+
+    raise LockTimeout(f"Station {station_id} changed hands while locking, please retry")
+
+
+def lock_stats():
+    return {
+        "stripes": len(state_locks._locks),
+        "timeout_s": state_locks.timeout,
+        "waits": state_locks.stats.snapshot()
+    }
+
+
+@contextmanager
+def hold_maker(maker_id, station_id, trace=None):
+    """
+    Lock a maker, the station they are moving to, and the station they are
+    currently at (if any), and yield their maker_status row as read under
+    the lock. Same re-check-and-retry as hold_station().
+    """
+    for _ in range(OCCUPANT_RETRIES):
+        with trace.span('db_lookup') if trace else nullcontext():
+            status = find_maker_status(maker_id)
+        current_station_id = status.get('station_id') if status else None
+
+        keys = [maker_key(maker_id), station_key(station_id)]
+        if current_station_id:
+            keys.append(station_key(current_station_id))
+
+        with state_locks.hold(*keys, trace=trace):
+            with trace.span('db_lookup') if trace else nullcontext():
+                status = find_maker_status(maker_id)
+            if (status.get('station_id') if status else None) == current_station_id:
+                yield status
+                return
+
+    raise LockTimeout(f"Maker {maker_id} moved while locking, please retry")
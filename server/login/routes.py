@@ -1,19 +1,28 @@
 from flask import Blueprint, request, jsonify
 import sys
 import os
-import time
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import supabase
+from database import DatabaseUnavailable
+from tracing import start_trace
+from live_state import now_iso, roster_maker_by_label, find_maker_status
+from idempotency import idempotent
+from admission import admit
+from journal import journaled
+from versioned import save_maker_status, remove_maker_status, retry_on_conflict, VersionConflict
+from cooldowns import cooldowns
+from locks import state_locks, maker_key, LockTimeout
+from roster import roster_feed
 
 login_bp = Blueprint('login', __name__, url_prefix='/login')
 
 # SocketIO instance (set by server.py)
 _socketio = None
 
-# Cooldown tracking - stores the last action time for each maker
-_login_cooldowns = {}  # Tracks login time (prevents immediate leave)
-_leave_cooldowns = {}  # Tracks leave time (prevents immediate login)
+# Cooldown tracking (see cooldowns.py) - keys expire on their own:
+#   login:<maker_id>  set on login (prevents immediate leave)
+#   leave:<maker_id>  set on leave (prevents immediate login)
 COOLDOWN_SECONDS = 10
 
 def set_socketio(socketio):
@@ -23,6 +32,10 @@ def set_socketio(socketio):
 
 
 @login_bp.route('/toggle', methods=['POST'])
+@idempotent
+@admit()
+@journaled('toggle')
+@retry_on_conflict
 def toggle():
     """
     Toggle route - automatically logs in or leaves based on current status.
@@ -38,6 +51,12 @@ def toggle():
     - If maker IS in maker_status → Check them OUT (leave, with 30s cooldown)
     
     Broadcasts 'maker_checked_in' or 'maker_checked_out' event via WebSocket.
+    
+    Optional tracing fields (sent by the Viam module): "trace_id",
+    "captured_at" (epoch seconds) and "inference_ms".
+    
+    An "Idempotency-Key" header (or "idempotency_key" field) makes retries safe:
+    a repeat with the same key gets the original response back.
     """
     
     # ============================================================
@@ -48,6 +67,7 @@ def toggle():
     if not data:
         return jsonify({"error": "Missing request body"}), 400
     
+    trace = start_trace(request, data, 'toggle')
     external_label = data.get('external_label')
     
     if not external_label:
@@ -60,116 +80,130 @@ def toggle():
         # ============================================================
         # STEP 2: Look up the maker by their Viam external_label
         # ============================================================
-        maker_response = supabase.table('makers').select('*').eq('external_label', external_label).execute()
+        with trace.span('db_lookup'):
+            maker = roster_maker_by_label(external_label)
         
-        if not maker_response.data or len(maker_response.data) == 0:
+        if not maker:
             return jsonify({"error": f"Maker with label '{external_label}' not found"}), 404
         
-        maker = maker_response.data[0]
         maker_id = maker['id']
         
-        # ============================================================
-        # STEP 3: Check if maker_status exists (are they checked in?)
-        # ============================================================
-        status_response = supabase.table('maker_status').select('*').eq('maker_id', maker_id).execute()
-        maker_is_checked_in = status_response.data and len(status_response.data) > 0
-        
-        if not maker_is_checked_in:
+        # Hold this maker's lock so concurrent toggles see each other's result
+        with state_locks.hold(maker_key(maker_id), trace=trace):
             # ============================================================
-            # STEP 4A: Maker is NOT checked in → LOGIN (check them in)
+            # STEP 3: Check if maker_status exists (are they checked in?)
             # ============================================================
+            with trace.span('db_lookup'):
+                maker_status = find_maker_status(maker_id)
+            maker_is_checked_in = maker_status is not None
+        
+            if not maker_is_checked_in:
+                # ============================================================
+                # STEP 4A: Maker is NOT checked in → LOGIN (check them in)
+                # ============================================================
             
-            # Check if login is on cooldown (after recent leave)
-            if maker_id in _leave_cooldowns:
-                elapsed = time.time() - _leave_cooldowns[maker_id]
-                if elapsed < COOLDOWN_SECONDS:
-                    remaining = int(COOLDOWN_SECONDS - elapsed)
+                # Check if login is on cooldown (after recent leave)
+                remaining = cooldowns.remaining(f"leave:{maker_id}")
+                if remaining > 0:
+                    remaining = int(remaining)
                     return jsonify({
                         "error": f"Login is on cooldown. Please wait {remaining} more seconds.",
                         "cooldown_remaining": remaining,
                         "action": "cooldown"
                     }), 429  # 429 = Too Many Requests
             
-            # Create maker_status record with 'idle' status
-            supabase.table('maker_status').upsert({
-                'maker_id': maker_id,
-                'status': 'idle',
-                'station_id': None,
-                'updated_at': 'now()'
-            }, on_conflict='maker_id').execute()
+                # Create maker_status record with 'idle' status
+                maker_status_row = {
+                    'maker_id': maker_id,
+                    'status': 'idle',
+                    'station_id': None,
+                    'updated_at': now_iso()
+                }
+                with trace.span('db_write'):
+                    save_maker_status(maker_status_row, maker_status)
             
-            # Prepare maker data for response and WebSocket broadcast
-            maker_data = {
-                "id": maker_id,
-                "display_name": maker['display_name'],
-                "external_label": maker['external_label'],
-                "status": "idle"
-            }
+                # Prepare maker data for response and WebSocket broadcast
+                maker_data = {
+                    "id": maker_id,
+                    "display_name": maker['display_name'],
+                    "external_label": maker['external_label'],
+                    "status": "idle"
+                }
             
-            # Record login time for cooldown tracking (prevents immediate leave)
-            _login_cooldowns[maker_id] = time.time()
+                # Start the login cooldown (prevents immediate leave)
+                cooldowns.set(f"login:{maker_id}", COOLDOWN_SECONDS)
             
-            # Clear leave cooldown since they successfully logged in
-            if maker_id in _leave_cooldowns:
-                del _leave_cooldowns[maker_id]
+                # Clear leave cooldown since they successfully logged in
+                cooldowns.clear(f"leave:{maker_id}")
             
-            # Broadcast to all connected WebSocket clients
-            if _socketio:
-                _socketio.emit('maker_checked_in', maker_data)
-                print(f"WebSocket: Emitted 'maker_checked_in' for {maker['display_name']}")
+                # Broadcast to all connected WebSocket clients
+                if _socketio:
+                    with trace.span('emit'):
+                        _socketio.emit('maker_checked_in', roster_feed.event(
+                            maker_id=maker_id, status='idle', at=maker_status_row['updated_at'], trace=trace.to_dict()
+                        ))
+                    print(f"WebSocket: Emitted 'maker_checked_in' for {maker['display_name']}")
             
-            return jsonify({
-                "success": True,
-                "action": "login",
-                "message": f"Maker '{maker['display_name']}' checked in",
-                "maker": maker_data
-            }), 200
+                return jsonify({
+                    "success": True,
+                    "action": "login",
+                    "message": f"Maker '{maker['display_name']}' checked in",
+                    "maker": maker_data,
+                    "trace": trace.finish()
+                }), 200
         
-        else:
-            # ============================================================
-            # STEP 4B: Maker IS checked in → LEAVE (check them out)
-            # ============================================================
+            else:
+                # ============================================================
+                # STEP 4B: Maker IS checked in → LEAVE (check them out)
+                # ============================================================
             
-            # Check if leave is on cooldown (after recent login)
-            if maker_id in _login_cooldowns:
-                elapsed = time.time() - _login_cooldowns[maker_id]
-                if elapsed < COOLDOWN_SECONDS:
-                    remaining = int(COOLDOWN_SECONDS - elapsed)
+                # Check if leave is on cooldown (after recent login)
+                remaining = cooldowns.remaining(f"login:{maker_id}")
+                if remaining > 0:
+                    remaining = int(remaining)
                     return jsonify({
                         "error": f"Leave is on cooldown. Please wait {remaining} more seconds.",
                         "cooldown_remaining": remaining,
                         "action": "cooldown"
                     }), 429  # 429 = Too Many Requests
             
-            # Delete the maker_status record (check them out)
-            supabase.table('maker_status').delete().eq('maker_id', maker_id).execute()
+                # Delete the maker_status record (check them out)
+                with trace.span('db_write'):
+                    remove_maker_status(maker_id, maker_status)
             
-            # Clear the login cooldown after successful leave
-            if maker_id in _login_cooldowns:
-                del _login_cooldowns[maker_id]
+                # Clear the login cooldown after successful leave
+                cooldowns.clear(f"login:{maker_id}")
             
-            # Record leave time for cooldown tracking (prevents immediate login)
-            _leave_cooldowns[maker_id] = time.time()
+                # Start the leave cooldown (prevents immediate login)
+                cooldowns.set(f"leave:{maker_id}", COOLDOWN_SECONDS)
             
-            # Prepare maker data for response and WebSocket broadcast
-            maker_data = {
-                "id": maker_id,
-                "display_name": maker['display_name'],
-                "external_label": maker['external_label']
-            }
+                # Prepare maker data for response and WebSocket broadcast
+                maker_data = {
+                    "id": maker_id,
+                    "display_name": maker['display_name'],
+                    "external_label": maker['external_label']
+                }
             
-            # Broadcast to all connected WebSocket clients
-            if _socketio:
-                _socketio.emit('maker_checked_out', maker_data)
-                print(f"WebSocket: Emitted 'maker_checked_out' for {maker['display_name']}")
+                # Broadcast to all connected WebSocket clients
+                if _socketio:
+                    with trace.span('emit'):
+                        _socketio.emit('maker_checked_out', roster_feed.event(
+                            maker_id=maker_id, at=now_iso(), trace=trace.to_dict()
+                        ))
+                    print(f"WebSocket: Emitted 'maker_checked_out' for {maker['display_name']}")
             
-            return jsonify({
-                "success": True,
-                "action": "leave",
-                "message": f"Maker '{maker['display_name']}' checked out",
-                "maker": maker_data
-            }), 200
+                return jsonify({
+                    "success": True,
+                    "action": "leave",
+                    "message": f"Maker '{maker['display_name']}' checked out",
+                    "maker": maker_data,
+                    "trace": trace.finish()
+                }), 200
             
+    except (LockTimeout, DatabaseUnavailable) as e:
+        return jsonify({"error": str(e)}), 503
+    except VersionConflict:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -3,6 +3,11 @@ import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import supabase
+from database import DatabaseUnavailable
+from live_state import live_state
+from write_behind import flush
+from journal import journaled
+from archive import archive_violations
 
 logout_bp = Blueprint('logout', __name__, url_prefix='/logout')
 
@@ -16,6 +21,7 @@ def set_socketio(socketio):
 
 
 @logout_bp.route('', methods=['POST'])
+@journaled('reset')
 def logout():
     """
     Logout/Reset route - clears all operational data while preserving makers and stations.
@@ -23,7 +29,8 @@ def logout():
     This route:
     - Deletes all records from maker_status (removes all checked-in makers)
     - Deletes all records from station_status (resets all station states)
-    - Deletes all records from violations (clears violation history)
+    - Moves all violations to the history archive (see archive.py), then
+      deletes any left in the violations table
     - Preserves makers table (keeps maker profiles)
     - Preserves stations table (keeps station definitions)
     - Broadcasts 'system_reset' event via WebSocket
@@ -32,9 +39,21 @@ def logout():
     if not supabase:
         return jsonify({"error": "Database connection not available"}), 500
     
+    # A reset has to reach the database; don't wait on (or queue behind) an outage
+    if supabase.degraded:
+        return jsonify({"error": "Database unavailable, try the reset again later"}), 503
+    
     try:
         print("Starting full system reset...")
         
+        # Let queued (write-behind) writes land first so they can't recreate rows after the reset
+        flush()
+        
+        # Keep the violation history: archive the rows before anything is cleared (a failed archive leaves the system as it was)
+        archived = archive_violations(everything=True)
+        if archived:
+            print(f"Archived {archived} violation records")
+        
         # Delete all maker_status records
         maker_status_response = supabase.table('maker_status').select('maker_id').execute()
         if maker_status_response.data:
@@ -56,6 +75,8 @@ def logout():
                 supabase.table('violations').delete().eq('id', v['id']).execute()
             print(f"Deleted {len(violations_response.data)} violation records")
         
+        live_state.clear_status()
+        
         # Broadcast system reset event
         if _socketio:
             _socketio.emit('system_reset', {
@@ -71,11 +92,14 @@ def logout():
                 "maker_status_cleared": True,
                 "station_status_cleared": True,
                 "violations_cleared": True,
+                "violations_archived": archived,
                 "makers_preserved": True,
                 "stations_preserved": True
             }
         }), 200
         
+    except DatabaseUnavailable as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         print(f"Error during logout/reset: {str(e)}")
         import traceback
@@ -0,0 +1,197 @@
+from flask import Blueprint, request, jsonify
+import sys
+import os
+import csv
+import io
+import json
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import supabase, ENROLL_BATCH_SIZE, ENROLL_MAX_ROWS
+from database import DatabaseUnavailable
+from live_state import live_state
+from journal import journal
+
+makers_bp = Blueprint('makers', __name__, url_prefix='/makers')
+
+ENROLL_COLUMNS = ('external_label', 'display_name')
+MAX_LABEL_LENGTH = 64
+MAX_NAME_LENGTH = 200
+
+# Errors listed in one response; the count covers all of them
+MAX_REPORTED_ERRORS = 100
+
+
+def _parse_upload():
+    """
+    The uploaded rows as (line, dict) pairs. CSV needs a header row; NDJSON
+    is one object per line; JSON is a list of objects or {"makers": [...]}.
+    The format comes from ?format= or the Content-Type.
+    """
+    fmt = request.args.get('format') or {
+        'text/csv': 'csv',
+        'application/x-ndjson': 'ndjson',
+        'application/jsonl': 'ndjson',
+    }.get(request.mimetype, 'json')
+    text = request.get_data(as_text=True)
+
+    if fmt == 'csv':
+        reader = csv.DictReader(io.StringIO(text))
+        missing = [c for c in ENROLL_COLUMNS if c not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"CSV header is missing: {', '.join(missing)}")
+        # Line numbers as a spreadsheet shows them (the header is line 1)
+        return [(index + 2, row) for index, row in enumerate(reader)]
+
+    if fmt == 'ndjson':
+        rows = []
+        for index, line in enumerate(text.splitlines()):
+            if line.strip():
+                try:
+                    rows.append((index + 1, json.loads(line)))
+                except ValueError:
+                    rows.append((index + 1, None))
+        return rows
+
+    if fmt == 'json':
+        body = json.loads(text or 'null')
+        if isinstance(body, dict):
+            body = body.get('makers')
+        if not isinstance(body, list):
+            raise ValueError('Expected a list of makers or {"makers": [...]}')
+        return [(index + 1, row) for index, row in enumerate(body)]
+
+    raise ValueError(f"Unknown format '{fmt}' (csv, ndjson or json)")
+
+
+def _validate(rows):
+    """
+    Split parsed rows into clean makers and errors (one per bad line), plus
+    the line each clean maker's label came from.
+    """
+    makers = []
+    errors = []
+    seen = {}
+    for line, row in rows:
+        if not isinstance(row, dict):
+            errors.append({"line": line, "error": "Not a JSON object"})
+            continue
+        label = str(row.get('external_label') or '').strip()
+        name = str(row.get('display_name') or '').strip()
+        if not label:
+            errors.append({"line": line, "error": "Missing external_label"})
+        elif len(label) > MAX_LABEL_LENGTH:
+            errors.append({"line": line, "error": f"external_label longer than {MAX_LABEL_LENGTH} characters"})
+        elif not name:
+            errors.append({"line": line, "error": "Missing display_name", "external_label": label})
+        elif len(name) > MAX_NAME_LENGTH:
+            errors.append({"line": line, "error": f"display_name longer than {MAX_NAME_LENGTH} characters",
+                           "external_label": label})
+        elif label in seen:
+            errors.append({"line": line, "error": f"Duplicate external_label (first on line {seen[label]})",
+                           "external_label": label})
+        else:
+            seen[label] = line
+            makers.append({'external_label': label, 'display_name': name})
+    return makers, errors, seen
+
+
+@makers_bp.route('/enroll', methods=['POST'])
+def enroll():
+    """
+    Bulk maker enrollment - a whole semester's roster in one request.
+
+    Body: CSV with an "external_label,display_name" header (Content-Type
+    text/csv), NDJSON (application/x-ndjson), or JSON (a list of objects or
+    {"makers": [...]}). ?format=csv|ndjson|json overrides the Content-Type.
+
+    Each row is validated (both fields present, not too long, no repeated
+    label in the upload). Any invalid row rejects the whole upload (400, with
+    the line numbers) unless ?skip_invalid=true. ?dry_run=true only validates.
+
+    Valid makers are upserted on external_label in batches of
+    ENROLL_BATCH_SIZE: new labels are created, known ones get the new
+    display_name, and rows already identical in the roster are skipped. The
+    roster then changes once - one version bump and one 'roster_updated'
+    for dashboards (see roster.py) - however many makers were enrolled.
+
+    If a batch fails, the batches before it stay written: the error response
+    (503/500) lists their enrolled_labels and the first_unwritten line, and
+    the same upload can simply be sent again.
+    """
+    if not supabase:
+        return jsonify({"error": "Database connection not available"}), 500
+
+    try:
+        rows = _parse_upload()
+    except (ValueError, csv.Error) as e:
+        return jsonify({"error": f"Could not read the upload: {str(e)}"}), 400
+
+    if not rows:
+        return jsonify({"error": "No makers in the upload"}), 400
+    if len(rows) > ENROLL_MAX_ROWS:
+        return jsonify({"error": f"At most {ENROLL_MAX_ROWS} makers per upload (got {len(rows)})"}), 413
+
+    makers, errors, lines = _validate(rows)
+    skip_invalid = request.args.get('skip_invalid', 'false').lower() == 'true'
+    dry_run = request.args.get('dry_run', 'false').lower() == 'true'
+
+    summary = {
+        "received": len(rows),
+        "valid": len(makers),
+        "invalid": len(errors),
+        "errors": errors[:MAX_REPORTED_ERRORS],
+    }
+    if errors and not skip_invalid:
+        return jsonify({**summary, "error": "Upload has invalid rows - nothing was enrolled"}), 400
+
+    # Rows the roster already has exactly as uploaded need no write
+    changed = []
+    unchanged = 0
+    for maker in makers:
+        current = live_state.maker_by_label(maker['external_label'])
+        if current and current.get('display_name') == maker['display_name']:
+            unchanged += 1
+        else:
+            changed.append(maker)
+
+    if dry_run:
+        return jsonify({**summary, "dry_run": True, "to_write": len(changed), "unchanged": unchanged}), 200
+
+    enrolled = []
+    written = 0     # makers in `changed` written so far (whole batches)
+    error = None
+    try:
+        for i in range(0, len(changed), ENROLL_BATCH_SIZE):
+            batch = changed[i:i + ENROLL_BATCH_SIZE]
+            response = supabase.table('makers').upsert(batch, on_conflict='external_label').execute()
+            enrolled.extend(response.data or [])
+            written = i + len(batch)
+    except DatabaseUnavailable as e:
+        error = (str(e), 503)
+    except Exception as e:
+        error = (str(e), 500)
+
+    # Whatever was written goes into the roster as one change
+    with journal.event('makers_enrolled'):
+        live_state.add_makers(enrolled)
+
+    summary.update({
+        "enrolled": len(enrolled),
+        "unchanged": unchanged,
+        "roster_version": live_state.roster_version,
+    })
+    if error:
+        # Earlier batches are committed: say exactly which makers were written
+        # and where writing stopped. Uploading the same file again is safe -
+        # the written makers are now unchanged and are skipped.
+        first = changed[written]
+        summary.update({
+            "enrolled_labels": [maker['external_label'] for maker in changed[:written]],
+            "not_written": len(changed) - written,
+            "first_unwritten": {"line": lines[first['external_label']],
+                                "external_label": first['external_label']},
+        })
+        print(f"Enrollment stopped after {written} of {len(changed)} makers: {error[0]}")
+        return jsonify({**summary, "error": f"Enrollment stopped after {written} makers: {error[0]}"}), error[1]
+
+    print(f"Enrolled {len(enrolled)} makers ({unchanged} unchanged, {len(errors)} invalid)")
+    return jsonify({"success": True, **summary}), 200
@@ -0,0 +1,137 @@
+"""
+Station presence expiry.
+
+The edge module heartbeats while a maker is at its station (enter and
+violation requests count too). If a station goes quiet for PRESENCE_TIMEOUT
+seconds - the Pi crashed, lost network, or its leave never arrived - the
+sweeper releases it exactly as a leave would.
+
+Deadlines live in a hashed timing wheel: one bucket per PRESENCE_TICK, with
+enough buckets to cover the timeout. A heartbeat moves its station to the
+bucket for its new deadline, so every bucket only ever holds stations that
+are due at that tick and a sweep costs O(expired) - quiet periods and large
+numbers of healthy stations cost nothing.
+
+The wheel is per process; with several workers (run_workers.py) heartbeats
+for a station must reach the same worker as its enter requests.
+"""
+import math
+import sys
+import os
+import time
+from threading import Lock, Thread
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import PRESENCE_TIMEOUT, PRESENCE_TICK
+
+
+class TimingWheel:
+    """Keys with a deadline TIMEOUT after their last touch(), expired in O(expired)."""
+
+    def __init__(self, timeout, tick):
+        self.tick = tick
+        self.timeout = timeout
+        self._timeout_ticks = max(1, math.ceil(timeout / tick))
+        # One spare bucket so a deadline never lands in the bucket being swept
+        self._buckets = [set() for _ in range(self._timeout_ticks + 2)]
+        self._deadlines = {}    # key -> deadline tick
+        self._lock = Lock()
+        self._cursor = self._now_tick()   # next tick to sweep
+
+    def _now_tick(self):
+        return int(time.monotonic() / self.tick)
+
+    def _bucket(self, deadline):
+        return self._buckets[deadline % len(self._buckets)]
+
+    def touch(self, key):
+        """(Re)start the key's timeout."""
+        deadline = self._now_tick() + self._timeout_ticks
+        with self._lock:
+            old = self._deadlines.get(key)
+            if old is not None:
+                self._bucket(old).discard(key)
+            self._deadlines[key] = deadline
+            self._bucket(deadline).add(key)
+
+    def cancel(self, key):
+        with self._lock:
+            old = self._deadlines.pop(key, None)
+            if old is not None:
+                self._bucket(old).discard(key)
+
+    def advance(self):
+        """Remove and return every key whose deadline tick has fully passed."""
+        expired = []
+        now = self._now_tick()
+        with self._lock:
+            while self._cursor < now:
+                bucket = self._bucket(self._cursor)
+                for key in list(bucket):
+                    # After a long stall a bucket can also hold later deadlines
+                    if self._deadlines[key] <= self._cursor:
+                        bucket.discard(key)
+                        del self._deadlines[key]
+                        expired.append(key)
+                self._cursor += 1
+        return expired
+
+    def __len__(self):
+        return len(self._deadlines)
+
+
+class PresenceSweeper:
+    """Background thread that advances the wheel and hands expired stations to on_expire."""
+
+    def __init__(self, timeout, tick):
+        self.enabled = timeout > 0
+        self.wheel = TimingWheel(timeout, tick) if self.enabled else None
+        self.expired = 0
+        self._thread = None
+        self._state = None
+
+    def touch(self, station_id):
+        if self.enabled:
+            self.wheel.touch(station_id)
+
+    def cancel(self, station_id):
+        if self.enabled:
+            self.wheel.cancel(station_id)
+
+    def attach(self, state):
+        """Put the stations in use on the wheel whenever the live state is (re)loaded."""
+        self._state = state
+        state.add_listener(self._on_change)
+
+    def _on_change(self, change):
+        if change[0] == 'reload' and self.enabled:
+            # Loaded after startup (see warmup.py) - same grace as at start
+            for station_id in self._state.stations_in_use():
+                self.wheel.touch(station_id)
+
+    def start(self, on_expire, station_ids=()):
+        """
+        Start sweeping. station_ids are stations already in use (restored at
+        startup); they get one full timeout to send a heartbeat. Stations
+        found in use by a later database load are added by attach().
+        """
+        if not self.enabled or self._thread:
+            return
+        for station_id in station_ids:
+            self.wheel.touch(station_id)
+        self._thread = Thread(target=self._run, args=(on_expire,), name='presence-sweeper', daemon=True)
+        self._thread.start()
+        print(f"Presence expiry enabled: stations released after {self.wheel.timeout:g}s without a heartbeat")
+
+    def _run(self, on_expire):
+        while True:
+            time.sleep(self.wheel.tick)
+            for station_id in self.wheel.advance():
+                self.expired += 1
+                try:
+                    on_expire(station_id)
+                except Exception as e:
+                    print(f"Error expiring station {station_id}: {str(e)}")
+
+
+presence = PresenceSweeper(PRESENCE_TIMEOUT, PRESENCE_TICK)
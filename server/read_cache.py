@@ -0,0 +1,187 @@
+"""
+Conditional GET and compression for the read endpoints.
+
+Each cached endpoint depends on one or more scopes ('state', 'violations',
+'archive', 'roster'), and every scope has a version number that goes up
+whenever something it covers changes:
+
+- a database write (see Database.on_write) to a table in TABLE_SCOPES
+- any change to the in-memory live state (and roster)
+- the database going away or coming back (/state switches source)
+- a batch of violations moved to the archive
+
+The ETag of a response is the process id plus those versions, so a repeat
+request whose If-None-Match still matches gets a bare 304 without running
+the view, and other requests at the same versions reuse the serialized
+body - gzipped once, when it's at least COMPRESS_MIN_BYTES - instead of
+querying and serializing again. Streamed responses (violation history) get
+the ETag and 304s but are neither cached nor compressed.
+
+Versions only see changes made by this process. With several workers
+(run_workers.py sets READ_CACHE=False) or other writers to the database,
+turn READ_CACHE off: ETags are then a hash of the body, which still saves
+the transfer but not the work.
+"""
+import gzip
+import hashlib
+import sys
+import os
+import uuid
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+
+from flask import request, make_response
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import READ_CACHE, READ_CACHE_MAX_ENTRIES, COMPRESS_MIN_BYTES
+
+# Database table -> scopes whose responses include it
+TABLE_SCOPES = {
+    'maker_status': ('state',),
+    'station_status': ('state',),
+    'violations': ('state', 'violations'),
+    'makers': ('state', 'violations'),
+    'stations': ('state', 'violations'),
+}
+
+
+class CachedBody:
+    __slots__ = ('etag', 'body', 'gzipped', 'mimetype')
+
+    def __init__(self, etag, body, mimetype):
+        self.etag = etag
+        self.body = body
+        self.mimetype = mimetype
+        self.gzipped = gzip.compress(body, compresslevel=6) if len(body) >= COMPRESS_MIN_BYTES else None
+
+
+class ReadCache:
+    """Scope versions and the latest serialized body per URL."""
+
+    def __init__(self, enabled, max_entries):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self._epoch = uuid.uuid4().hex[:8]   # ETags from before a restart never match
+        self._lock = Lock()
+        self._versions = {}
+        self._bodies = OrderedDict()          # full path -> CachedBody
+        self.hits = 0
+        self.not_modified = 0
+        self.misses = 0
+
+    def bump(self, *scopes):
+        with self._lock:
+            for scope in scopes:
+                self._versions[scope] = self._versions.get(scope, 0) + 1
+
+    def table_written(self, table):
+        self.bump(*TABLE_SCOPES.get(table, ()))
+
+    def state_changed(self, change):
+        if change[0] == 'roster':
+            self.bump('state', 'violations', 'roster')
+        elif change[0] == 'reload':
+            self.bump('state', 'roster')
+        else:
+            self.bump('state')
+
+    def etag(self, scopes):
+        with self._lock:
+            return '-'.join([self._epoch] + [str(self._versions.get(scope, 0)) for scope in scopes])
+
+    def get(self, path, etag):
+        with self._lock:
+            entry = self._bodies.get(path)
+            if entry is None or entry.etag != etag:
+                return None
+            self._bodies.move_to_end(path)
+            return entry
+
+    def put(self, path, entry):
+        with self._lock:
+            self._bodies[path] = entry
+            self._bodies.move_to_end(path)
+            while len(self._bodies) > self.max_entries:
+                self._bodies.popitem(last=False)
+
+    def count(self, counter):
+        """Bump one of the hits/not_modified/misses counters (from any request thread)."""
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "versions": dict(self._versions),
+                "cached_bodies": len(self._bodies),
+                "hits": self.hits,
+                "not_modified": self.not_modified,
+                "misses": self.misses,
+            }
+
+
+read_cache = ReadCache(READ_CACHE, READ_CACHE_MAX_ENTRIES)
+
+
+def _not_modified(etag):
+    response = make_response('', 304)
+    response.set_etag(etag, weak=True)
+    return response
+
+
+def _send(entry):
+    if entry.gzipped is not None and 'gzip' in request.accept_encodings:
+        response = make_response(entry.gzipped)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = make_response(entry.body)
+    response.mimetype = entry.mimetype
+    response.vary.add('Accept-Encoding')
+    response.set_etag(entry.etag, weak=True)
+    # Let clients keep the body, but check back every time
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def conditional(*scopes):
+    """Serve a GET view with an ETag, 304s, a cached body per version and gzip."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            path = request.full_path
+            etag = None
+            if read_cache.enabled:
+                # Taken before the view runs: a change during it only makes the body newer than its tag
+                etag = read_cache.etag(scopes)
+                if request.if_none_match.contains_weak(etag):
+                    read_cache.count('not_modified')
+                    return _not_modified(etag)
+                entry = read_cache.get(path, etag)
+                if entry:
+                    read_cache.count('hits')
+                    return _send(entry)
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            if response.is_streamed:
+                # Streamed pages (violation history) stay streamed: tagged, not cached
+                if etag:
+                    response.set_etag(etag, weak=True)
+                    response.headers['Cache-Control'] = 'no-cache'
+                return response
+
+            read_cache.count('misses')
+            body = response.get_data()
+            if etag is None:
+                etag = hashlib.blake2b(body, digest_size=12).hexdigest()
+                if request.if_none_match.contains_weak(etag):
+                    return _not_modified(etag)
+            entry = CachedBody(etag, body, response.mimetype)
+            if read_cache.enabled:
+                read_cache.put(path, entry)
+            return _send(entry)
+        return wrapper
+    return decorator
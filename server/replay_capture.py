@@ -0,0 +1,213 @@
+"""
+Replay captured traffic (see capture.py) and check the outcome.
+
+    python replay_capture.py day.jsonl                         # 1x, local database stand-in
+    python replay_capture.py day.jsonl --speed 10
+    python replay_capture.py day.jsonl --speed 0 --save-state day.state.json
+    python replay_capture.py day.jsonl --speed 0 --expect day.state.json
+    python replay_capture.py day.jsonl --url http://localhost:8080   # a running server instead
+
+By default the server runs in this process against the local database
+stand-in (local_db.py), seeded with the live state from the capture's start
+record, so a recorded makerspace day can be replayed anywhere. Requests are
+sent one at a time in capture order, with the recorded gaps divided by
+--speed (0 = back to back). Admission limits and the presence timeout are
+off for the local server; the login cooldown and the violation clearing
+timer still run on the wall clock, so speeds other than 1x can legitimately
+change some answers.
+
+Checks, each failing the run (exit code 1):
+- every response status matches the one recorded
+- with --expect, the final state (who is present where, which stations are
+  in use, violation counts) matches a state saved earlier with --save-state
+
+Latency percentiles per route are printed, next to the recorded ones.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from threading import Thread
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SERVER_DIR)
+
+# How many status mismatches to list
+MAX_MISMATCHES_SHOWN = 20
+
+
+def seed_from_start(start):
+    """Seed tables for the local database from a capture start record."""
+    state = start['state']
+    return {
+        'makers': state['makers'],
+        'stations': state['stations'],
+        'maker_status': state['maker_status'],
+        'station_status': state['station_status'],
+        'violations': [],
+    }
+
+
+def configure_local_server(seed_path, scratch_dir):
+    """Point the server at the local database. Must run before anything imports config."""
+    os.environ.update({
+        'LOCAL_DB': seed_path,
+        'SNAPSHOT_STORAGE': 'local',
+        'SNAPSHOT_DIR': os.path.join(scratch_dir, 'snapshots'),
+        'JOURNAL_ENABLED': 'False',
+        'ARCHIVE_DIR': os.path.join(scratch_dir, 'archive'),
+        'ARCHIVE_INTERVAL': '0',
+        'IDEMPOTENCY_BACKEND': 'memory',
+        'COOLDOWN_BACKEND': 'memory',
+        'PRESENCE_TIMEOUT': '0',
+        'ADMISSION_STATION_RATE': '0',
+        'ADMISSION_IP_RATE': '0',
+        'FLASK_DEBUG': 'False',
+    })
+    for name in ('CAPTURE_FILE', 'SOCKETIO_MESSAGE_QUEUE'):
+        os.environ.pop(name, None)
+
+
+def start_local_server():
+    """Import the server and serve it on a free port."""
+    from werkzeug.serving import make_server
+    import server
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    httpd = make_server('127.0.0.1', 0, server.app, threaded=True)
+    Thread(target=httpd.serve_forever, name='replay-server', daemon=True).start()
+    return f"http://127.0.0.1:{httpd.server_port}"
+
+
+def final_state(db):
+    """Comparable summary of the local database, keyed by labels and names (not ids)."""
+    tables = db.dump()
+    labels = {m['id']: m['external_label'] for m in tables.get('makers', [])}
+    names = {s['id']: s['name'] for s in tables.get('stations', [])}
+
+    violations = {}
+    for v in tables.get('violations', []):
+        key = f"{labels.get(v['maker_id'], v['maker_id'])}@{names.get(v['station_id'], v['station_id'])}:{v['violation_type']}"
+        violations[key] = violations.get(key, 0) + 1
+
+    return {
+        'present': {
+            labels.get(ms['maker_id'], ms['maker_id']): {
+                'status': ms['status'],
+                'station': names.get(ms.get('station_id'), ms.get('station_id')),
+            }
+            for ms in tables.get('maker_status', [])
+        },
+        'stations_in_use': {
+            names.get(ss['station_id'], ss['station_id']): labels.get(ss.get('active_maker_id'), ss.get('active_maker_id'))
+            for ss in tables.get('station_status', []) if ss.get('in_use')
+        },
+        'violations': violations,
+    }
+
+
+def diff_states(expected, actual, prefix=''):
+    """Human-readable differences between two final_state() dicts."""
+    lines = []
+    for key in sorted(set(expected) | set(actual), key=str):
+        e, a = expected.get(key), actual.get(key)
+        if isinstance(e, dict) and isinstance(a, dict):
+            lines.extend(diff_states(e, a, f"{prefix}{key}."))
+        elif e != a:
+            lines.append(f"  {prefix}{key}: expected {e!r}, got {a!r}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured MakerSafe traffic and verify the result")
+    parser.add_argument('capture', help="capture file written with CAPTURE_FILE")
+    parser.add_argument('--speed', type=float, default=1.0, help="time scale; 0 = as fast as possible")
+    parser.add_argument('--url', help="replay against this running server instead of a local one")
+    parser.add_argument('--seed', help="seed JSON for the local database (default: the capture's start record)")
+    parser.add_argument('--expect', help="final state file to compare against (local mode)")
+    parser.add_argument('--save-state', help="write the final state here (local mode)")
+    parser.add_argument('--timeout', type=float, default=10.0)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='makersafe-replay-')
+    seed_path = args.seed or os.path.join(scratch, 'seed.json')
+    if not args.url:
+        configure_local_server(seed_path, scratch)
+
+    from capture import read_capture
+    start_record, requests = read_capture(args.capture)
+    if not requests:
+        print(f"No requests in {args.capture}")
+        return 1
+
+    url = args.url
+    if not url:
+        if not args.seed:
+            if not start_record:
+                print("Capture has no start record; pass --seed")
+                return 1
+            with open(seed_path, 'w') as f:
+                json.dump(seed_from_start(start_record), f)
+        url = start_local_server()
+
+    from replay_journal import send, report, percentile
+
+    print(f"Replaying {len(requests)} requests against {url} at "
+          f"{'full speed' if args.speed <= 0 else f'{args.speed:g}x'}...")
+    results = []
+    mismatches = []
+    first_ts = requests[0]['ts']
+    began = time.time()
+    for index, record in enumerate(requests):
+        if args.speed > 0:
+            delay = (record['ts'] - first_ts) / args.speed - (time.time() - began)
+            if delay > 0:
+                time.sleep(delay)
+        status, latency = send(url, record['path'], record.get('body'), args.timeout, record.get('headers'))
+        results.append((record['path'], status, latency))
+        if status != record.get('status'):
+            mismatches.append((index, record['path'], record.get('status'), status))
+    elapsed = time.time() - began
+
+    report(results, elapsed)
+    recorded = sorted(r['latency_ms'] for r in requests if 'latency_ms' in r)
+    replayed = sorted(latency for _, _, latency in results)
+    print(f"\nServer latency as recorded: p50 {percentile(recorded, 50):.1f}ms, p95 {percentile(recorded, 95):.1f}ms; "
+          f"replayed (round trip): p50 {percentile(replayed, 50):.1f}ms, p95 {percentile(replayed, 95):.1f}ms")
+
+    failed = False
+    if mismatches:
+        failed = True
+        print(f"\n{len(mismatches)} responses differ from the capture:")
+        for index, path, expected, got in mismatches[:MAX_MISMATCHES_SHOWN]:
+            print(f"  #{index} {path}: recorded {expected}, replayed {got}")
+    else:
+        print("\nAll response statuses match the capture")
+
+    if not args.url:
+        from config import supabase
+        from write_behind import flush
+        flush()
+        state = final_state(supabase.client())
+        if args.save_state:
+            with open(args.save_state, 'w') as f:
+                json.dump(state, f, indent=2, sort_keys=True)
+            print(f"Final state written to {args.save_state}")
+        if args.expect:
+            with open(args.expect) as f:
+                differences = diff_states(json.load(f), state)
+            if differences:
+                failed = True
+                print("Final state differs from the expected state:")
+                print('\n'.join(differences))
+            else:
+                print("Final state matches the expected state")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+Replay a recorded event journal (see journal.py) against a running server.
+
+    python replay_journal.py --url http://localhost:8080
+    python replay_journal.py --speed 10 --events enter,leave,violation
+    python replay_journal.py --speed 0 --dir journal/worker-0    # as fast as possible
+
+Recorded requests are sent in journal order to the route they came in on,
+paced by their original timestamps divided by --speed (0 = no pauses).
+Entries journaled off the request path (violation status clearing, presence
+timeouts, reloads) aren't sent - the server produces those itself. Snapshot
+images weren't journaled, so replayed violations arrive without one.
+
+Prints response codes and latency percentiles per event type when done.
+Point it at a server with a scratch database: the events are applied for real.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import JOURNAL_DIR
+from journal import read_entries
+
+# Tracing fields that would be misleading on a replay (edge latency, duplicate ids)
+DROPPED_FIELDS = ('captured_at', 'trace_id')
+
+
+def send(url, path, body, timeout, headers=None):
+    """POST one recorded request. Returns (status, latency_ms)."""
+    if isinstance(body, dict):
+        body = {k: v for k, v in body.items() if k not in DROPPED_FIELDS}
+    req = urllib.request.Request(
+        url.rstrip('/') + path,
+        data=json.dumps(body or {}).encode('utf-8'),
+        headers={"Content-Type": "application/json", **(headers or {})},
+        method="POST",
+    )
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        status = 0
+    return status, (time.perf_counter() - start) * 1000
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def report(results, elapsed):
+    """Print counts by status and latency percentiles per event type."""
+    print(f"\nReplayed {len(results)} events in {elapsed:.2f}s "
+          f"({len(results) / elapsed if elapsed else 0:.1f} events/s)")
+    by_event = {}
+    for event, status, latency in results:
+        by_event.setdefault(event, []).append((status, latency))
+
+    print(f"{'event':<18} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}  statuses")
+    for event, rows in sorted(by_event.items()):
+        latencies = sorted(latency for _, latency in rows)
+        statuses = {}
+        for status, _ in rows:
+            statuses[status] = statuses.get(status, 0) + 1
+        print(f"{event:<18} {len(rows):>6} {percentile(latencies, 50):>8.1f} {percentile(latencies, 95):>8.1f} "
+              f"{percentile(latencies, 99):>8.1f} {latencies[-1]:>8.1f}  "
+              + ", ".join(f"{s}x{n}" for s, n in sorted(statuses.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a MakerSafe event journal against a server")
+    parser.add_argument('--dir', default=JOURNAL_DIR, help="journal directory")
+    parser.add_argument('--url', default='http://localhost:8080', help="server to replay against")
+    parser.add_argument('--speed', type=float, default=1.0, help="time scale; 0 = as fast as possible")
+    parser.add_argument('--since', type=int, default=0, help="only entries after this seq")
+    parser.add_argument('--events', help="comma-separated event types to send (default: all)")
+    parser.add_argument('--timeout', type=float, default=10.0)
+    parser.add_argument('--dry-run', action='store_true', help="print the requests instead of sending them")
+    args = parser.parse_args()
+
+    events = set(args.events.split(',')) if args.events else None
+    results = []
+    first_ts = None
+    start = time.time()
+
+    for entry in read_entries(args.dir, since=args.since):
+        if not entry.get('path'):
+            continue
+        if events and entry['event'] not in events:
+            continue
+
+        if args.dry_run:
+            print(f"{entry['seq']:>8} {entry['event']:<10} {entry['path']} {json.dumps(entry.get('body'))}")
+            continue
+
+        # Keep the recorded spacing between events (scaled)
+        if first_ts is None:
+            first_ts = entry['ts']
+        if args.speed > 0:
+            delay = (entry['ts'] - first_ts) / args.speed - (time.time() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+        status, latency = send(args.url, entry['path'], entry.get('body'), args.timeout)
+        results.append((entry['event'], status, latency))
+
+    if not args.dry_run:
+        report(results, time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Roster protocol for dashboards: names once, IDs in every event.
+
+WebSocket events (station_entered, station_left, violation_detected,
+maker_checked_in, ...) carry only ids, status codes and timestamps, e.g.
+
+    station_entered  {"maker_id": "...", "station_id": "...", "status": "active",
+                      "at": "2026-10-19T18:34:27+00:00", "roster_version": 7, "trace": {...}}
+
+Names and labels come from the dashboard's cached copy of the roster:
+
+- on connect the server sends it a 'roster' event: {"version", "makers", "stations"}
+  (the same body as GET /roster, which carries an ETag)
+- whenever maker or station rows change (one at a time, or a whole bulk
+  enrollment at once), every dashboard gets 'roster_updated' with the new
+  version and just the changed rows
+  ({"reload": true} instead of rows after a full reload from the database)
+
+Every event carries the roster_version it was sent at, for debugging only:
+versions are per process (load and restore bump them too), so with several
+workers they don't line up. A client fetches GET /roster again when it meets
+an id it doesn't know, or when roster_updated skips a version.
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from live_state import roster_entry
+
+
+class RosterFeed:
+    """Pushes roster changes to dashboards and stamps events with the roster version."""
+
+    def __init__(self):
+        self._state = None
+        self._socketio = None
+
+    def attach(self, state, socketio):
+        self._state = state
+        self._socketio = socketio
+        state.add_listener(self._on_change)
+
+    def _on_change(self, change):
+        if self._socketio is None or change[0] not in ('roster', 'reload'):
+            return
+        update = {"version": self._state.roster_version, "makers": [], "stations": []}
+        if change[0] == 'reload':
+            update["reload"] = True
+        else:
+            rows = change[2] if isinstance(change[2], list) else [change[2]]
+            update[change[1]] = [roster_entry(change[1], row) for row in rows]
+        self._socketio.emit('roster_updated', update)
+
+    def event(self, **fields):
+        """An ID-only event payload, stamped with the roster version it refers to."""
+        fields['roster_version'] = self._state.roster_version if self._state else 0
+        return fields
+
+
+roster_feed = RosterFeed()
@@ -0,0 +1,86 @@
+"""
+Run several server workers on one host.
+
+    python run_workers.py --workers 4 --port 8080
+
+Starts workers on ports 8080..8083 (each a normal `python server.py`) with a
+shared Socket.IO message queue, so an event emitted by any worker reaches
+every dashboard. If SOCKETIO_MESSAGE_QUEUE isn't set, the in-repo fan-out
+broker (fanout.py) is started and used.
+
+Put a load balancer in front of the workers. Socket.IO connections must be
+sticky (e.g. nginx `ip_hash`) because the polling transport makes several
+requests per session; camera POSTs can be spread round-robin.
+
+Per-process state that must be shared between workers:
+- cooldowns: set COOLDOWN_BACKEND=sqlite or redis
+- WRITE_BEHIND keeps live state in memory per process, so it is single-worker only
+- presence expiry tracks heartbeats per process, so route each station's
+  requests to one worker (hash on station) or set PRESENCE_TIMEOUT=0
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fanout import start_broker
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run multiple MakerSafe server workers")
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WORKERS', 2)))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 8080)))
+    parser.add_argument('--broker-port', type=int, default=5680)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    # The debug reloader forks its own child; never combine it with multiple workers
+    env['FLASK_DEBUG'] = 'False'
+
+    if not env.get('SOCKETIO_MESSAGE_QUEUE'):
+        start_broker('127.0.0.1', args.broker_port)
+        env['SOCKETIO_MESSAGE_QUEUE'] = f"tcp://127.0.0.1:{args.broker_port}"
+
+    if args.workers > 1 and env.get('COOLDOWN_BACKEND', 'memory').lower() == 'memory':
+        print("Warning: COOLDOWN_BACKEND=memory is per-worker; use sqlite or redis with multiple workers")
+    if args.workers > 1 and env.get('WRITE_BEHIND', 'False').lower() == 'true':
+        print("Warning: WRITE_BEHIND keeps live state per worker; run it with a single worker")
+
+    # Read cache versions only see one worker's writes; use body-hash ETags instead
+    if args.workers > 1:
+        env['READ_CACHE'] = 'False'
+
+    # Each worker keeps its own event journal (see journal.py)
+    journal_dir = env.get('JOURNAL_DIR', os.path.join(os.path.dirname(SERVER_SCRIPT), 'journal'))
+
+    workers = []
+    for index in range(args.workers):
+        worker_env = dict(env, PORT=str(args.port + index), JOURNAL_DIR=os.path.join(journal_dir, f"worker-{index}"))
+        if index > 0:
+            # One worker moves violations to the archive; every worker archives its own sessions
+            worker_env['ARCHIVE_VIOLATIONS'] = 'False'
+        workers.append(subprocess.Popen([sys.executable, SERVER_SCRIPT], env=worker_env))
+        print(f"Started worker {index} (pid {workers[-1].pid}) on port {args.port + index}")
+
+    def stop(signum, frame):
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Exit when every worker has exited; a crashed worker is reported, not restarted
+    while any(worker.poll() is None for worker in workers):
+        time.sleep(0.5)
+    for index, worker in enumerate(workers):
+        print(f"Worker {index} exited with code {worker.returncode}")
+
+
+if __name__ == '__main__':
+    main()
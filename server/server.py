@@ -1,16 +1,76 @@
-from config import create_app, supabase
+from config import create_app, supabase, SOCKETIO_MESSAGE_QUEUE, SOCKETIO_CHANNEL
+from tracing import recent_traces
+from locks import lock_stats
+from presence import presence
+from admission import admission
+from live_state import live_state
+from journal import journal
+from analytics import analytics
+from timeseries import timeseries
+from archive import sessions as archived_sessions, start_archive_job
+from read_cache import read_cache, conditional
+from wire import init_wire, socketio_serializer
+from roster import roster_feed
+from indicators import indicators
+from capture import init_capture
+from write_behind import pending_writes, memory_is_authoritative, shutdown as drain_writes
+from warmup import warmup
+from database import CircuitBreaker, DatabaseUnavailable
 from login.routes import login_bp, set_socketio as set_login_socketio
-from station.routes import station_bp, set_socketio as set_station_socketio
-from violation.routes import violation_bp, set_socketio as set_violation_socketio
+from station.routes import station_bp, set_socketio as set_station_socketio, expire_station
+from violation.routes import violation_bp, set_socketio as set_violation_socketio, on_resolved
 from logout.routes import logout_bp, set_socketio as set_logout_socketio
+from snapshot.routes import snapshot_bp
+from history.routes import history_bp
+from makers.routes import makers_bp
 import os
-from flask import jsonify
-from flask_socketio import SocketIO
+import signal
+import sys
+from flask import jsonify, request
+from threading import Thread
+from flask_socketio import SocketIO, emit
 
 app = create_app()
 
-# Initialize SocketIO with CORS support
-socketio = SocketIO(app, cors_allowed_origins="*")
+def load_live_state():
+    try:
+        live_state.load(supabase)
+    except Exception as e:
+        print(f"Error loading live state: {str(e)}")
+
+# Mirror the roster and live status in memory (authoritative in write-behind mode).
+# Rebuild it from the local journal first; the database load then refreshes it
+# in the background (see warmup.py) instead of holding up startup.
+restored = journal.restore(live_state)
+journal.attach(live_state)
+analytics.attach(live_state)
+timeseries.attach(live_state)
+indicators.attach(live_state)
+analytics.on_interval(archived_sessions.record)
+
+# Version the read endpoints' responses by what changed (see read_cache.py)
+live_state.add_listener(read_cache.state_changed)
+supabase.on_write(read_cache.table_written)
+if supabase:
+    warmup.step('live_state', lambda: live_state.load(supabase))
+
+# Accept MessagePack edge events alongside JSON (see wire.py)
+init_wire(app, live_state)
+
+# Record inbound event traffic for replay_capture.py (only with CAPTURE_FILE set)
+init_capture(app, live_state)
+
+# Initialize SocketIO with CORS support. With several worker processes, emits
+# go through a message queue so they reach dashboards on every worker.
+if SOCKETIO_MESSAGE_QUEUE and SOCKETIO_MESSAGE_QUEUE.startswith('tcp://'):
+    from fanout import create_client_manager
+    socketio = SocketIO(app, cors_allowed_origins="*", serializer=socketio_serializer(),
+                        client_manager=create_client_manager(SOCKETIO_MESSAGE_QUEUE, SOCKETIO_CHANNEL))
+elif SOCKETIO_MESSAGE_QUEUE:
+    socketio = SocketIO(app, cors_allowed_origins="*", serializer=socketio_serializer(),
+                        message_queue=SOCKETIO_MESSAGE_QUEUE, channel=SOCKETIO_CHANNEL)
+else:
+    socketio = SocketIO(app, cors_allowed_origins="*", serializer=socketio_serializer())
 
 # Pass socketio instance to route modules
 set_login_socketio(socketio)
@@ -18,10 +78,42 @@ set_station_socketio(socketio)
 set_violation_socketio(socketio)
 set_logout_socketio(socketio)
 
+# Events carry ids only; dashboards keep the roster and get its changes (see roster.py)
+roster_feed.attach(live_state, socketio)
+
+# Release stations whose edge module has gone quiet (see presence.py)
+presence.attach(live_state)
+presence.start(expire_station, live_state.stations_in_use())
+
+# Sample occupancy for the dashboard sparklines (see timeseries.py)
+timeseries.start(socketio)
+
+# Move resolved/old violations and finished sessions to the columnar archive (see archive.py)
+start_archive_job()
+
+# Tell dashboards when the database goes away / comes back (see database.py)
+def on_breaker_change(old_state, new_state):
+    if new_state == CircuitBreaker.CLOSED and not live_state.loaded:
+        # Started while the database was down - pick up the roster now
+        Thread(target=load_live_state, name='live-state-load', daemon=True).start()
+    # /state switches between the database and memory
+    read_cache.bump('state')
+    socketio.emit('system_status', {
+        'degraded': new_state == CircuitBreaker.OPEN,
+        'database': new_state,
+        'pending_writes': pending_writes()
+    })
+    print(f"WebSocket: Emitted 'system_status' (database {new_state})")
+
+supabase.breaker.on_change(on_breaker_change)
+
 app.register_blueprint(login_bp)
 app.register_blueprint(station_bp)
 app.register_blueprint(violation_bp)
 app.register_blueprint(logout_bp)
+app.register_blueprint(snapshot_bp)
+app.register_blueprint(history_bp)
+app.register_blueprint(makers_bp)
 
 @app.route('/')
 def index():
@@ -29,48 +121,86 @@ def index():
     return "Flask server is running!"
 
 
+# Active violations as of the last /state read from the database; served
+# (with the live state from memory) while the database is unavailable
+_last_violations = []
+
+
+def _forget_resolved(violation_ids):
+    # Resolved violations leave /state, including the degraded copy
+    global _last_violations
+    resolved = set(violation_ids)
+    _last_violations = [v for v in _last_violations if v['id'] not in resolved]
+    read_cache.bump('state')
+
+on_resolved(_forget_resolved)
+
+
+def _status_from_memory():
+    """Present makers and station statuses from the live state."""
+    maker_status, station_status = live_state.status_rows()
+
+    makers = []
+    for ms in maker_status:
+        maker_info = live_state.maker(ms['maker_id']) or {}
+        makers.append({
+            "id": ms['maker_id'],
+            "display_name": maker_info.get('display_name'),
+            "external_label": maker_info.get('external_label'),
+            "status": ms['status'],
+            "station_id": ms.get('station_id'),
+            "updated_at": ms['updated_at']
+        })
+
+    stations = []
+    for ss in station_status:
+        station_info = live_state.station(ss['station_id']) or {}
+        stations.append({
+            "id": ss['station_id'],
+            "name": station_info.get('name'),
+            "active_maker_id": ss.get('active_maker_id'),
+            "updated_at": ss['updated_at']
+        })
+    return makers, stations
+
+
+def _state_from_memory():
+    makers, stations = _status_from_memory()
+    return jsonify({
+        "makers": makers,
+        "stations": stations,
+        "violations": _last_violations,
+        "degraded": True
+    }), 200
+
+
 @app.route('/state')
+@conditional('state')
 def get_state():
     """
     Get the current state of the makerspace.
     Returns all present makers, station statuses, and active violations.
+    Carries an ETag; a request with a matching If-None-Match gets a 304.
+
+    Makers and stations come from the in-memory live state whenever it is
+    authoritative (write-behind mode, and while writes queued in an outage
+    are still draining) - the database doesn't have those writes yet.
+    Violations come from the database unless it is unavailable; ones still
+    queued show up once written (dashboards already got them over the
+    WebSocket).
     """
+    global _last_violations
     if not supabase:
         return jsonify({"error": "Database connection not available"}), 500
     
+    if supabase.degraded:
+        return _state_from_memory()
+    
     try:
-        # Get all present makers (those with a maker_status entry)
-        maker_status_response = supabase.table('maker_status').select(
-            '*, makers(*)'
-        ).execute()
-        
-        makers = []
-        for ms in maker_status_response.data or []:
-            maker_info = ms.get('makers', {})
-            makers.append({
-                "id": ms['maker_id'],
-                "display_name": maker_info.get('display_name'),
-                "external_label": maker_info.get('external_label'),
-                "status": ms['status'],
-                "station_id": ms.get('station_id'),
-                "updated_at": ms['updated_at']
-            })
-        
-        # Get all station statuses
-        station_status_response = supabase.table('station_status').select(
-            '*, stations(*)'
-        ).execute()
-        
-        stations = []
-        for ss in station_status_response.data or []:
-            station_info = ss.get('stations', {})
-            stations.append({
-                "id": ss['station_id'],
-                "name": station_info.get('name'),
-                
-                "active_maker_id": ss.get('active_maker_id'),
-                "updated_at": ss['updated_at']
-            })
+        if memory_is_authoritative():
+            makers, stations = _status_from_memory()
+        else:
+            makers, stations = _status_from_database()
         
         # Get all active (unresolved) violations
         violations_response = supabase.table('violations').select(
@@ -89,27 +219,190 @@ def get_state():
                 "station_name": station_info.get('name'),
                 "violation_type": v['violation_type'],
                 "image_url": v.get('image_url'),
-                "created_at": v['created_at']
+                "thumbnail_url": v.get('thumbnail_url'),
+                "created_at": v['created_at'],
+                "trace_id": v.get('trace_id')
             })
         
+        _last_violations = violations
         return jsonify({
             "makers": makers,
             "stations": stations,
-            "violations": violations
+            "violations": violations,
+            "degraded": False
         }), 200
         
+    except DatabaseUnavailable:
+        return _state_from_memory()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+
+def _status_from_database():
+    """Present makers and station statuses from the database."""
+    # Get all present makers (those with a maker_status entry)
+    maker_status_response = supabase.table('maker_status').select(
+        '*, makers(*)'
+    ).execute()
+    
+    makers = []
+    for ms in maker_status_response.data or []:
+        maker_info = ms.get('makers', {})
+        makers.append({
+            "id": ms['maker_id'],
+            "display_name": maker_info.get('display_name'),
+            "external_label": maker_info.get('external_label'),
+            "status": ms['status'],
+            "station_id": ms.get('station_id'),
+            "updated_at": ms['updated_at']
+        })
+    
+    # Get all station statuses
+    station_status_response = supabase.table('station_status').select(
+        '*, stations(*)'
+    ).execute()
+    
+    stations = []
+    for ss in station_status_response.data or []:
+        station_info = ss.get('stations', {})
+        stations.append({
+            "id": ss['station_id'],
+            "name": station_info.get('name'),
+            
+            "active_maker_id": ss.get('active_maker_id'),
+            "updated_at": ss['updated_at']
+        })
+    return makers, stations
+
+@app.route('/traces')
+def get_traces():
+    """
+    Recent per-event latency breakdowns (edge, database, WebSocket emit).
+    Optional query params: ?event=violation_create&limit=50
+    """
+    limit = request.args.get('limit', 100, type=int)
+    event = request.args.get('event')
+    return jsonify({"traces": recent_traces(limit=limit, event=event)}), 200
+
+@app.route('/locks')
+def get_locks():
+    """Lock wait statistics for maker/station state transitions (see locks.py)."""
+    return jsonify(lock_stats()), 200
+
+@app.route('/admission')
+def get_admission():
+    """Rate-limit settings and per-station admitted/coalesced/rejected counts (see admission.py)."""
+    return jsonify(admission.stats()), 200
+
+@app.route('/journal')
+def get_journal():
+    """Event journal position, segment and snapshot counts (see journal.py)."""
+    return jsonify(journal.stats()), 200
+
+@app.route('/analytics')
+def get_analytics():
+    """
+    Station occupancy, maker session time and violation counts: totals since
+    startup plus hourly and daily buckets (see analytics.py). Served from
+    running aggregates - no database queries.
+    """
+    return jsonify(analytics.report()), 200
+
+@app.route('/timeseries')
+def get_timeseries():
+    """
+    Recent samples for sparklines, oldest first (see timeseries.py).
+    Optional query params: ?seconds=600&step=10&station_id=uuid
+    """
+    seconds = request.args.get('seconds', type=float)
+    step = max(1, request.args.get('step', 1, type=int))
+    station_id = request.args.get('station_id')
+    return jsonify(timeseries.window(seconds=seconds, step=step, station_id=station_id)), 200
+
+@app.route('/roster')
+@conditional('roster')
+def get_roster():
+    """
+    Every maker and station (names and labels) and the roster version, from
+    memory. WebSocket events refer to them by id (see roster.py).
+    """
+    return jsonify(live_state.roster()), 200
+
+@app.route('/status')
+def get_status():
+    """
+    Database health. "degraded" is true while the circuit breaker is open:
+    routes run from the in-memory live state and writes wait in the queue.
+    """
+    return jsonify({
+        "degraded": supabase.degraded,
+        "database": supabase.breaker.stats(),
+        "pending_writes": pending_writes(),
+        "live_state_loaded": live_state.loaded,
+        "read_cache": read_cache.stats(),
+        "indicators": indicators.stats()
+    }), 200
+
+@app.route('/ready')
+def get_ready():
+    """
+    Readiness probe: 200 once the boot warm-up has connected to the database,
+    loaded the live state and filled the read caches, and while the circuit
+    breaker isn't open; 503 (with each step's attempts and last error)
+    otherwise. /status is the liveness view.
+    """
+    stats = warmup.stats()
+    stats["ready"] = stats["ready"] and supabase.breaker.state != CircuitBreaker.OPEN
+    stats.update({
+        "live_state_loaded": live_state.loaded,
+        "roster_version": live_state.roster_version,
+        "restored_from_journal": bool(restored),
+        "database": supabase.breaker.state,
+    })
+    return jsonify(stats), 200 if stats["ready"] else 503
+
 @socketio.on('connect')
 def handle_connect():
     print('Client connected')
+    # The roster the client's events will refer to
+    emit('roster', live_state.roster())
 
 @socketio.on('disconnect')
 def handle_disconnect():
     print('Client disconnected')
- 
+
+# Connect, load the live state and fill the read caches in the background (see warmup.py)
+def warm_state_cache():
+    # One /state request fills the read cache the dashboards poll (see read_cache.py)
+    with app.test_client() as client:
+        # Only a body from the database counts - a degraded one (from memory)
+        # would leave the cache holding stale rows
+        if supabase.breaker.state != CircuitBreaker.CLOSED:
+            raise RuntimeError(f"database {supabase.breaker.state}")
+        response = client.get('/state')
+        if response.status_code >= 500:
+            raise RuntimeError(f"/state answered {response.status_code}")
+        if (response.get_json(silent=True) or {}).get('degraded'):
+            read_cache.bump('state')
+            raise RuntimeError("/state answered from memory (database unavailable)")
+
+if supabase:
+    warmup.step('state_cache', warm_state_cache)
+warmup.start()
+
+def handle_shutdown(signum, frame):
+    # run_workers.py stops workers with SIGTERM, which skips atexit: drain the
+    # queued database writes and close the journal before exiting
+    print(f"Received {signal.Signals(signum).name}, draining {pending_writes()} pending writes...")
+    drain_writes()
+    journal.close()
+    sys.exit(0)
+
 if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, handle_shutdown)
+    signal.signal(signal.SIGINT, handle_shutdown)
     port = int(os.environ.get("PORT", 8080))
     print(f"Starting Flask server with WebSocket on port {port}...")
-    socketio.run(app, debug=os.getenv('FLASK_DEBUG', 'True').lower() == 'true', host='0.0.0.0', port=port)
\ No newline at end of file
+    # allow_unsafe_werkzeug lets FLASK_DEBUG=False (used by run_workers.py) start the dev server
+    socketio.run(app, debug=os.getenv('FLASK_DEBUG', 'True').lower() == 'true', host='0.0.0.0', port=port,
+                 allow_unsafe_werkzeug=True)
\ No newline at end of file
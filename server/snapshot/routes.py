@@ -0,0 +1,16 @@
+from flask import Blueprint, send_from_directory
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import SNAPSHOT_DIR
+
+snapshot_bp = Blueprint('snapshot', __name__, url_prefix='/snapshots')
+
+
+@snapshot_bp.route('/<path:filename>', methods=['GET'])
+def get_snapshot(filename):
+    """
+    Serve a violation snapshot stored locally (SNAPSHOT_STORAGE=local).
+    Snapshot files are never rewritten, so they can be cached indefinitely.
+    """
+    return send_from_directory(SNAPSHOT_DIR, filename, max_age=31536000)
@@ -0,0 +1,259 @@
+"""
+Violation snapshot processing.
+
+The edge sends the raw camera frame with a violation. The route records and
+broadcasts the violation straight away and hands the frame to
+submit_snapshot(), which - on a small worker pool - re-encodes it to a compact
+WebP/JPEG plus a thumbnail, uploads both, and then calls back with the URLs.
+
+Storage is Supabase Storage (the 'violations' bucket from the PRD) or, with
+SNAPSHOT_STORAGE=local, a directory on disk served by the snapshot blueprint.
+
+A maker who keeps violating at one station produces near-identical frames,
+so each stored snapshot is indexed by a 64-bit difference hash (dHash) per
+station + maker. A new frame within SNAPSHOT_DEDUP_DISTANCE bits of a recent
+one reuses the stored object instead of being uploaded again.
+"""
+import io
+import sys
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import (
+    supabase,
+    SNAPSHOT_STORAGE,
+    SNAPSHOT_BUCKET,
+    SNAPSHOT_DIR,
+    SNAPSHOT_FORMAT,
+    SNAPSHOT_QUALITY,
+    SNAPSHOT_MAX_SIZE,
+    SNAPSHOT_THUMB_SIZE,
+    SNAPSHOT_WORKERS,
+    SNAPSHOT_DEDUP_DISTANCE,
+    SNAPSHOT_DEDUP_TTL,
+    SNAPSHOT_DEDUP_MAX_KEYS,
+    SNAPSHOT_DEDUP_PER_KEY,
+)
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+    print("Pillow not installed - violation snapshots will be stored without re-encoding or thumbnails")
+
+# Reject anything bigger than a raw 1080p frame would reasonably be
+MAX_SNAPSHOT_BYTES = 10 * 1024 * 1024
+
+_CONTENT_TYPES = {
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+}
+
+
+def _encode(image, max_size):
+    """Downscale to fit max_size (longest edge) and encode in SNAPSHOT_FORMAT."""
+    image = image.copy()
+    image.thumbnail((max_size, max_size))
+    out = io.BytesIO()
+    if SNAPSHOT_FORMAT == 'webp':
+        image.save(out, format='WEBP', quality=SNAPSHOT_QUALITY, method=4)
+    else:
+        image.save(out, format='JPEG', quality=SNAPSHOT_QUALITY, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def dhash(image):
+    """64-bit difference hash: is each pixel brighter than its right neighbour on a 9x8 grayscale."""
+    pixels = list(image.convert('L').resize((9, 8), Image.BILINEAR).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def parse_hash(value):
+    """Hashes travel as 16-char hex strings; returns None for anything else."""
+    try:
+        return int(value, 16) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+class SnapshotIndex:
+    """
+    Recent snapshot hashes per (station_id, maker_id) -> stored URLs.
+
+    Memory is bounded: at most SNAPSHOT_DEDUP_MAX_KEYS station/maker pairs
+    (least recently used pair evicted first), SNAPSHOT_DEDUP_PER_KEY hashes
+    per pair (oldest dropped first), and entries expire after the TTL.
+    """
+
+    def __init__(self, max_keys, per_key, ttl, max_distance):
+        self._lock = Lock()
+        self._entries = OrderedDict()   # (station_id, maker_id) -> [(hash, image_url, thumbnail_url, stored_at)]
+        self.max_keys = max_keys
+        self.per_key = per_key
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.hits = 0
+        self.misses = 0
+
+    def find(self, station_id, maker_id, value):
+        """Stored (image_url, thumbnail_url) for a near-duplicate of value, or None."""
+        key = (station_id, maker_id)
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            entries = self._entries.get(key)
+            if entries:
+                entries[:] = [e for e in entries if e[3] >= cutoff]
+                for stored_hash, image_url, thumbnail_url, _ in reversed(entries):
+                    if hamming(stored_hash, value) <= self.max_distance:
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                        return image_url, thumbnail_url
+                if not entries:
+                    del self._entries[key]
+            self.misses += 1
+            return None
+
+    def add(self, station_id, maker_id, value, image_url, thumbnail_url):
+        key = (station_id, maker_id)
+        with self._lock:
+            entries = self._entries.setdefault(key, [])
+            entries.append((value, image_url, thumbnail_url, time.time()))
+            del entries[:-self.per_key]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+
+
+snapshot_index = SnapshotIndex(
+    SNAPSHOT_DEDUP_MAX_KEYS,
+    SNAPSHOT_DEDUP_PER_KEY,
+    SNAPSHOT_DEDUP_TTL,
+    SNAPSHOT_DEDUP_DISTANCE,
+)
+
+
+def decode_snapshot(raw):
+    """Decode a raw frame to an RGB image (None when Pillow isn't available)."""
+    if Image is None:
+        return None
+    with Image.open(io.BytesIO(raw)) as image:
+        return image.convert('RGB')
+
+
+def encode_snapshot(raw, image):
+    """
+    Turn a frame into (image_bytes, thumbnail_bytes, extension).
+    Without Pillow the raw bytes are stored as-is and there is no thumbnail.
+    """
+    if image is None:
+        ext = 'png' if raw[:8] == b'\x89PNG\r\n\x1a\n' else 'jpeg'
+        return raw, None, ext
+
+    ext = 'webp' if SNAPSHOT_FORMAT == 'webp' else 'jpeg'
+    return _encode(image, SNAPSHOT_MAX_SIZE), _encode(image, SNAPSHOT_THUMB_SIZE), ext
+
+
+class LocalSnapshotStorage:
+    """Stand-in for Supabase Storage: files under SNAPSHOT_DIR, served at /snapshots/<path>."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def upload(self, path, data, content_type, base_url):
+        full_path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        tmp_path = full_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, full_path)
+        return f"{base_url.rstrip('/')}/snapshots/{path}"
+
+
+class SupabaseSnapshotStorage:
+    """Uploads to a public Supabase Storage bucket."""
+
+    def __init__(self, client, bucket):
+        self.client = client
+        self.bucket = bucket
+
+    def upload(self, path, data, content_type, base_url):
+        bucket = self.client.storage.from_(self.bucket)
+        bucket.upload(path, data, file_options={"content-type": content_type, "upsert": "true"})
+        return bucket.get_public_url(path)
+
+
+if SNAPSHOT_STORAGE == 'local' or not supabase:
+    storage = LocalSnapshotStorage(SNAPSHOT_DIR)
+else:
+    storage = SupabaseSnapshotStorage(supabase, SNAPSHOT_BUCKET)
+
+_executor = ThreadPoolExecutor(max_workers=SNAPSHOT_WORKERS, thread_name_prefix='snapshot')
+
+
+def _process(violation_id, station_id, maker_id, raw, base_url, on_ready):
+    try:
+        image = decode_snapshot(raw)
+
+        # Hash before encoding - a near-duplicate skips encoding and upload entirely
+        value = dhash(image) if image is not None else None
+        if value is not None:
+            existing = snapshot_index.find(station_id, maker_id, value)
+            if existing:
+                print(f"Snapshot for violation {violation_id} is a near-duplicate, reusing stored image")
+                on_ready(*existing)
+                return
+
+        image_bytes, thumb_bytes, ext = encode_snapshot(raw, image)
+        content_type = _content_type(ext)
+
+        image_url = storage.upload(f"{station_id}/{violation_id}.{ext}", image_bytes, content_type, base_url)
+        thumbnail_url = None
+        if thumb_bytes:
+            thumbnail_url = storage.upload(f"{station_id}/{violation_id}_thumb.{ext}", thumb_bytes, content_type, base_url)
+
+        if value is not None:
+            snapshot_index.add(station_id, maker_id, value, image_url, thumbnail_url)
+
+        print(f"Snapshot stored for violation {violation_id}: {len(raw)} -> {len(image_bytes)} bytes")
+        on_ready(image_url, thumbnail_url)
+    except Exception as e:
+        print(f"Error processing snapshot for violation {violation_id}: {str(e)}")
+
+
+def _content_type(ext):
+    return _CONTENT_TYPES.get(ext, 'application/octet-stream')
+
+
+def submit_snapshot(violation_id, station_id, maker_id, raw, base_url, on_ready):
+    """
+    Encode and upload a violation snapshot in the background.
+    on_ready(image_url, thumbnail_url) is called from the worker once stored
+    (or straight away with the existing URLs for a near-duplicate).
+    """
+    return _executor.submit(_process, violation_id, station_id, maker_id, raw, base_url, on_ready)
+
+
+def find_duplicate(station_id, maker_id, image_hash):
+    """
+    Look up a hash the edge computed itself (sent instead of the frame).
+    Returns (image_url, thumbnail_url) or None if nothing close is stored.
+    """
+    value = parse_hash(image_hash)
+    if value is None:
+        return None
+    return snapshot_index.find(station_id, maker_id, value)
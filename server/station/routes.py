@@ -1,8 +1,25 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response
 import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import supabase
+from config import supabase, INDICATOR_MAX_WAIT
+from database import DatabaseUnavailable
+from tracing import start_trace
+from live_state import (
+    live_state, now_iso, roster_maker, roster_maker_by_label, roster_station, find_maker_status,
+    find_station, find_station_status
+)
+from idempotency import idempotent
+from versioned import (
+    save_maker_status, save_station_status, run_with_retries, retry_on_conflict, VersionConflict
+)
+from locks import hold_maker, hold_station, LockTimeout
+from presence import presence
+from write_behind import reserved_writes
+from admission import admit
+from journal import journal, journaled
+from roster import roster_feed
+from indicators import indicators, TooManyWaiters
 
 station_bp = Blueprint('station', __name__, url_prefix='/station')
 
@@ -15,7 +32,67 @@ def set_socketio(socketio):
     _socketio = socketio
 
 
+# ============================================================
+# Coalescing for over-limit requests (see admission.py). Answered from this
+# process's in-memory live state; None means the request must really run.
+# ============================================================
+
+def _coalesce_enter(data):
+    """An enter for the maker already at this station changes nothing (it still counts as a heartbeat)."""
+    station_id = data.get('station_id')
+    maker = live_state.maker_by_label(data.get('external_label'))
+    station = live_state.station(station_id)
+    station_status = live_state.get_station_status(station_id)
+    if not maker or not station or not station_status:
+        return None
+    if not station_status.get('in_use') or station_status.get('active_maker_id') != maker['id']:
+        return None
+    
+    presence.touch(station_id)
+    maker_status = live_state.get_maker_status(maker['id']) or {}
+    return jsonify({
+        "success": True,
+        "coalesced": True,
+        "message": f"Maker '{maker['display_name']}' is already at station '{station['name']}'",
+        "maker": {
+            "id": maker['id'],
+            "display_name": maker['display_name'],
+            "external_label": maker['external_label'],
+            "status": maker_status.get('status', 'active')
+        },
+        "station": {
+            "id": station_id,
+            "name": station['name'],
+            "in_use": True
+        }
+    }), 200
+
+
+def _coalesce_leave(data):
+    """A leave for a station that is already idle changes nothing."""
+    station_id = data.get('station_id')
+    station = live_state.station(station_id)
+    station_status = live_state.get_station_status(station_id)
+    if not station or not station_status or station_status.get('in_use'):
+        return None
+    
+    return jsonify({
+        "success": True,
+        "coalesced": True,
+        "message": f"Station '{station['name']}' is already idle",
+        "station": {
+            "id": station_id,
+            "name": station['name'],
+            "in_use": False
+        }
+    }), 200
+
+
 @station_bp.route('/enter', methods=['POST'])
+@idempotent
+@admit(coalesce=_coalesce_enter)
+@journaled('enter')
+@retry_on_conflict
 def station_enter():
     """
     Station enter route - called when Viam detects a maker at a station camera.
@@ -26,6 +103,11 @@ def station_enter():
         "station_id": "uuid"       # The station UUID
     }
     
+    Optional tracing fields: "trace_id", "captured_at", "inference_ms".
+    
+    An "Idempotency-Key" header (or "idempotency_key" field) makes retries safe:
+    a repeat with the same key gets the original response back.
+    
     On success:
     - Updates maker_status to 'active' with station_id
     - Updates station_status to 'in_use' with active_maker_id
@@ -36,6 +118,7 @@ def station_enter():
     if not data:
         return jsonify({"error": "Missing request body"}), 400
     
+    trace = start_trace(request, data, 'station_enter')
     external_label = data.get('external_label')
     station_id = data.get('station_id')
     
@@ -50,94 +133,140 @@ def station_enter():
     
     try:
         # Look up the maker by their Viam external_label
-        maker_response = supabase.table('makers').select('*').eq('external_label', external_label).execute()
+        with trace.span('db_lookup'):
+            maker = roster_maker_by_label(external_label)
         
-        if not maker_response.data or len(maker_response.data) == 0:
+        if not maker:
             return jsonify({"error": f"Maker with label '{external_label}' not found"}), 404
         
-        maker = maker_response.data[0]
         maker_id = maker['id']
         
         # Search for maker status by searching for maker id using viam external label. If maker status is not found, user should not be allowed to enter the station.
-        maker_status_response = supabase.table('maker_status').select('*').eq('maker_id', maker_id).execute()
-        if not maker_status_response.data or len(maker_status_response.data) == 0:
-            return jsonify({"error": f"Maker with label '{external_label}' is not checked in"}), 404
+        # The maker, this station and the station they're at now stay locked until the end
+        with hold_maker(maker_id, station_id, trace=trace) as maker_status:
+            if not maker_status:
+                return jsonify({"error": f"Maker with label '{external_label}' is not checked in"}), 404
         
-        maker_status = maker_status_response.data[0]
-        # Allow entry if maker is 'idle' (just checked in) or 'active' (already at another station - optional)
-        if maker_status.get('status') not in ['idle', 'active']:
-            return jsonify({"error": f"Maker with label '{external_label}' cannot enter station (status: {maker_status.get('status')})"}), 400
+            # Allow entry if maker is 'idle' (just checked in) or 'active' (already at another station - optional)
+            if maker_status.get('status') not in ['idle', 'active']:
+                return jsonify({"error": f"Maker with label '{external_label}' cannot enter station (status: {maker_status.get('status')})"}), 400
         
-        # Look up the station
-        station_response = supabase.table('stations').select('*').eq('id', station_id).execute()
+            # Look up the station
+            with trace.span('db_lookup'):
+                station = roster_station(station_id)
         
-        if not station_response.data or len(station_response.data) == 0:
-            return jsonify({"error": f"Station with id '{station_id}' not found"}), 404
+            if not station:
+                return jsonify({"error": f"Station with id '{station_id}' not found"}), 404
         
-        station = station_response.data[0]
-        
-        # Check if station is already occupied
-        station_status_response = supabase.table('station_status').select('*').eq('station_id', station_id).execute()
-
-        if station_status_response.data and len(station_status_response.data) > 0:
-            station_status = station_status_response.data[0]
-            if station_status.get('in_use') == True:
-                current_maker_id = station_status.get('active_maker_id')
-                # Allow if it's the same maker re-entering
-                if current_maker_id != maker_id:
-                    return jsonify({
-                        "error": f"Station '{station['name']}' is already occupied",
-                        "station_id": station_id,
-                        "active_maker_id": current_maker_id
-                    }), 409  # 409 Conflict
-        
-        # Update maker_status to 'active' with station_id
-        supabase.table('maker_status').upsert({
-            'maker_id': maker_id,
-            'status': 'active',
-            'station_id': station_id,
-            'updated_at': 'now()'
-        }, on_conflict='maker_id').execute()
-        
-        # Update station_status - set in_use to True with active_maker_id
-        supabase.table('station_status').upsert({
-            'station_id': station_id,
-            'in_use': True,
-            'active_maker_id': maker_id,
-            'updated_at': 'now()'
-        }, on_conflict='station_id').execute()
-        
-        # Prepare data for response and WebSocket broadcast
-        event_data = {
-            "maker": {
-                "id": maker_id,
-                "display_name": maker['display_name'],
-                "external_label": maker['external_label'],
-                "status": "active"
-            },
-            "station": {
-                "id": station_id,
-                "name": station['name'],
-                "in_use": True
+            # Check if station is already occupied
+            with trace.span('db_lookup'):
+                station_status = find_station_status(station_id)
+
+            if station_status:
+                if station_status.get('in_use') == True:
+                    current_maker_id = station_status.get('active_maker_id')
+                    # Allow if it's the same maker re-entering
+                    if current_maker_id != maker_id:
+                        return jsonify({
+                            "error": f"Station '{station['name']}' is already occupied",
+                            "station_id": station_id,
+                            "active_maker_id": current_maker_id
+                        }), 409  # 409 Conflict
+        
+            # Update maker_status to 'active' with station_id
+            maker_status_row = {
+                'maker_id': maker_id,
+                'status': 'active',
+                'station_id': station_id,
+                'updated_at': now_iso()
             }
-        }
         
-        # Broadcast to all connected WebSocket clients
-        if _socketio:
-            _socketio.emit('station_entered', event_data)
-            print(f"WebSocket: Emitted 'station_entered' - {maker['display_name']} at {station['name']}")
+            # Update station_status - set in_use to True with active_maker_id
+            station_status_row = {
+                'station_id': station_id,
+                'in_use': True,
+                'active_maker_id': maker_id,
+                'updated_at': now_iso()
+            }
         
-        return jsonify({
-            "success": True,
-            "message": f"Maker '{maker['display_name']}' entered station '{station['name']}'",
-            **event_data
-        }), 200
+            # Moving from another station - free it, so they're never shown at two
+            previous_status_row = None
+            previous_station_id = maker_status.get('station_id')
+            write_keys = [f"station:{station_id}", f"maker:{maker_id}"]
+            if previous_station_id and previous_station_id != station_id:
+                write_keys.append(f"station:{previous_station_id}")
+        
+            # Room in the write queue for every write of the move before the first one
+            with reserved_writes(*write_keys):
+                if previous_station_id and previous_station_id != station_id:
+                    previous_status = find_station_status(previous_station_id)
+                    if previous_status and previous_status.get('active_maker_id') == maker_id:
+                        previous_status_row = {
+                            'station_id': previous_station_id,
+                            'in_use': False,
+                            'active_maker_id': None,
+                            'updated_at': now_iso()
+                        }
+                        with trace.span('db_write'):
+                            save_station_status(previous_status_row, previous_status)
+                        presence.cancel(previous_station_id)
+        
+                # Claim the station first - it's the row other instances compete for
+                with trace.span('db_write'):
+                    save_station_status(station_status_row, station_status)
+                    save_maker_status(maker_status_row, maker_status)
+            # Enter requests double as heartbeats
+            presence.touch(station_id)
+        
+            # Prepare data for response and WebSocket broadcast
+            event_data = {
+                "maker": {
+                    "id": maker_id,
+                    "display_name": maker['display_name'],
+                    "external_label": maker['external_label'],
+                    "status": "active"
+                },
+                "station": {
+                    "id": station_id,
+                    "name": station['name'],
+                    "in_use": True
+                }
+            }
         
+            # Broadcast to all connected WebSocket clients (ids only - see roster.py)
+            if _socketio:
+                with trace.span('emit'):
+                    if previous_status_row:
+                        _socketio.emit('station_left', roster_feed.event(
+                            maker_id=maker_id, station_id=previous_station_id, status='idle', in_use=False,
+                            at=previous_status_row['updated_at']
+                        ))
+                    _socketio.emit('station_entered', roster_feed.event(
+                        maker_id=maker_id, station_id=station_id, status='active', in_use=True,
+                        at=station_status_row['updated_at'], trace=trace.to_dict()
+                    ))
+                print(f"WebSocket: Emitted 'station_entered' - {maker['display_name']} at {station['name']}")
+        
+            return jsonify({
+                "success": True,
+                "message": f"Maker '{maker['display_name']}' entered station '{station['name']}'",
+                **event_data,
+                "trace": trace.finish()
+            }), 200
+        
+    except (LockTimeout, DatabaseUnavailable) as e:
+        return jsonify({"error": str(e)}), 503
+    except VersionConflict:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @station_bp.route('/leave', methods=['POST'])
+@idempotent
+@admit(coalesce=_coalesce_leave)
+@journaled('leave')
+@retry_on_conflict
 def station_leave():
     """
     Station leave route - called when camera no longer detects a face at the station.
@@ -149,6 +278,11 @@ def station_leave():
         "station_id": "uuid"  # The station UUID (required)
     }
     
+    Optional tracing fields: "trace_id", "captured_at", "inference_ms".
+    
+    An "Idempotency-Key" header (or "idempotency_key" field) makes retries safe:
+    a repeat with the same key gets the original response back.
+    
     On success:
     - Looks up who was at the station from station_status
     - Updates maker_status to 'idle' and clears station_id
@@ -160,6 +294,7 @@ def station_leave():
     if not data:
         return jsonify({"error": "Missing request body"}), 400
     
+    trace = start_trace(request, data, 'station_leave')
     station_id = data.get('station_id')
     
     if not station_id:
@@ -170,103 +305,253 @@ def station_leave():
     
     try:
         # Look up the station
-        station_response = supabase.table('stations').select('*').eq('id', station_id).execute()
+        with trace.span('db_lookup'):
+            station = roster_station(station_id)
         
-        if not station_response.data or len(station_response.data) == 0:
+        if not station:
             return jsonify({"error": f"Station with id '{station_id}' not found"}), 404
         
-        station = station_response.data[0]
+        # Check who was at this station, holding the locks for it and its maker
+        with hold_station(station_id, trace=trace) as station_status:
+            if not station_status:
+                return jsonify({"error": "No status record for this station"}), 400
         
-        # Check who was at this station from station_status
-        station_status_response = supabase.table('station_status').select('*').eq('station_id', station_id).execute()
+            maker_id = station_status.get('active_maker_id')
         
-        if not station_status_response.data or len(station_status_response.data) == 0:
-            return jsonify({"error": "No status record for this station"}), 400
-        
-        station_status = station_status_response.data[0]
-        maker_id = station_status.get('active_maker_id')
-        
-        # If no one was at the station, just update station status
-        if not maker_id:
-            # Update station_status - set in_use to False
-            supabase.table('station_status').upsert({
+            # Station_status row for the now-idle station - in_use False, no active maker
+            station_status_row = {
                 'station_id': station_id,
                 'in_use': False,
                 'active_maker_id': None,
-                'updated_at': 'now()'
-            }, on_conflict='station_id').execute()
+                'updated_at': now_iso()
+            }
+        
+            # If no one was at the station, just update station status
+            if not maker_id:
+                with trace.span('db_write'):
+                    save_station_status(station_status_row, station_status)
+                presence.cancel(station_id)
             
-            return jsonify({
-                "success": True,
-                "message": f"Station '{station['name']}' is now idle (no maker was present)",
+                return jsonify({
+                    "success": True,
+                    "message": f"Station '{station['name']}' is now idle (no maker was present)",
+                    "station": {
+                        "id": station_id,
+                        "name": station['name'],
+                        "in_use": False
+                    },
+                    "trace": trace.finish()
+                }), 200
+        
+            # Get the maker details
+            with trace.span('db_lookup'):
+                maker = roster_maker(maker_id)
+        
+            if not maker:
+                # Maker not found, but still update station status
+                save_station_status(station_status_row, station_status)
+                presence.cancel(station_id)
+            
+                return jsonify({"error": "Maker not found, but station status updated"}), 404
+        
+            # Update maker_status to 'idle' and clear station_id
+            maker_status_row = {
+                'maker_id': maker_id,
+                'status': 'idle',
+                'station_id': None,
+                'updated_at': now_iso()
+            }
+        
+            with trace.span('db_lookup'):
+                maker_status = find_maker_status(maker_id)
+        
+            with trace.span('db_write'), reserved_writes(f"station:{station_id}", f"maker:{maker_id}"):
+                save_station_status(station_status_row, station_status)
+                save_maker_status(maker_status_row, maker_status)
+            presence.cancel(station_id)
+        
+            # Prepare data for response and WebSocket broadcast
+            event_data = {
+                "maker": {
+                    "id": maker_id,
+                    "display_name": maker['display_name'],
+                    "external_label": maker['external_label'],
+                    "status": "idle"
+                },
                 "station": {
                     "id": station_id,
                     "name": station['name'],
                     "in_use": False
                 }
+            }
+        
+            # Broadcast to all connected WebSocket clients (ids only - see roster.py)
+            if _socketio:
+                with trace.span('emit'):
+                    _socketio.emit('station_left', roster_feed.event(
+                        maker_id=maker_id, station_id=station_id, status='idle', in_use=False,
+                        at=station_status_row['updated_at'], trace=trace.to_dict()
+                    ))
+                print(f"WebSocket: Emitted 'station_left' - {maker['display_name']} left {station['name']}")
+        
+            return jsonify({
+                "success": True,
+                "message": f"Maker '{maker['display_name']}' left station '{station['name']}'",
+                **event_data,
+                "trace": trace.finish()
             }), 200
         
-        # Get the maker details
-        maker_response = supabase.table('makers').select('*').eq('id', maker_id).execute()
+    except (LockTimeout, DatabaseUnavailable) as e:
+        return jsonify({"error": str(e)}), 503
+    except VersionConflict:
+        raise
+    except Exception as e:
+        print(f"Error in station_leave: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@station_bp.route('/heartbeat', methods=['POST'])
+def station_heartbeat():
+    """
+    Heartbeat route - called by the edge module every few seconds while a
+    maker is at the station. Cheap: no database access.
+    
+    Expects JSON body:
+    {
+        "station_id": "uuid",       # The station UUID (required)
+        "external_label": "6767"    # Optional - the maker the camera sees
+    }
+    
+    If the station hears nothing (heartbeat, enter or violation) for
+    PRESENCE_TIMEOUT seconds, it is released as if it had sent a leave.
+    
+    The response's "present" is false when the server doesn't have that
+    maker at this station (e.g. after a restart or an expiry), telling the
+    edge to send a fresh enter.
+    """
+    data = request.get_json(silent=True)
+    
+    if not data:
+        return jsonify({"error": "Missing request body"}), 400
+    
+    station_id = data.get('station_id')
+    
+    if not station_id:
+        return jsonify({"error": "Missing station_id"}), 400
+    
+    # Roster from memory; only an unknown id costs a database lookup
+    if not live_state.station(station_id) and not (supabase and find_station(station_id)):
+        return jsonify({"error": f"Station with id '{station_id}' not found"}), 404
+    
+    presence.touch(station_id)
+    
+    present = None
+    external_label = data.get('external_label')
+    if external_label:
+        station_status = live_state.get_station_status(station_id)
+        maker = live_state.maker_by_label(external_label)
+        present = bool(
+            station_status and station_status.get('in_use') and maker
+            and station_status.get('active_maker_id') == maker['id']
+        )
+    
+    return jsonify({
+        "success": True,
+        "station_id": station_id,
+        "present": present,
+        "expires_in": presence.wheel.timeout if presence.enabled else None
+    }), 200
+
+
+@station_bp.route('/<station_id>/indicator', methods=['GET'])
+def station_indicator(station_id):
+    """
+    Station state code for indicator displays, as a long-poll (see indicators.py).
+    Served from memory - no database access.
+    
+    Optional query params: ?since=<version>&wait=<seconds>
+    Without "since" (or when it's out of date) it answers at once; otherwise
+    it waits up to "wait" seconds (at most INDICATOR_MAX_WAIT) for a change.
+    
+    Returns: {"s": "idle" | "in_use" | "violation", "v": <version>}
+    """
+    since = request.args.get('since', type=int)
+    wait = min(max(request.args.get('wait', INDICATOR_MAX_WAIT, type=float), 0), INDICATOR_MAX_WAIT)
+    
+    try:
+        current = indicators.wait(station_id, since, wait)
+    except TooManyWaiters as e:
+        return jsonify({"error": str(e)}), 503, {'Retry-After': '5'}
+    
+    if current is None:
+        return jsonify({"error": f"Station with id '{station_id}' not found"}), 404
+    
+    return jsonify({"s": current[0], "v": current[1]}), 200, {'Cache-Control': 'no-store'}
+
+
+@station_bp.route('/<station_id>/indicator/stream', methods=['GET'])
+def station_indicator_stream(station_id):
+    """
+    Station state code for indicator displays, as Server-Sent Events (see
+    indicators.py): "id: <version>" / "data: idle|in_use|violation" now and on
+    every change. A reconnect with Last-Event-ID skips the code it already has.
+    """
+    if indicators.get(station_id) is None:
+        return jsonify({"error": f"Station with id '{station_id}' not found"}), 404
+    
+    last_version = request.headers.get('Last-Event-ID', type=int)
+    return Response(
+        indicators.stream(station_id, last_version),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'}
+    )
+
+
+def _release_expired_station(station_id):
+    with hold_station(station_id) as station_status:
+        if not station_status or not station_status.get('in_use'):
+            return
         
-        if not maker_response.data or len(maker_response.data) == 0:
-            # Maker not found, but still update station status
-            supabase.table('station_status').upsert({
+        maker_id = station_status.get('active_maker_id')
+        released_at = now_iso()
+        released_maker_id = None
+        write_keys = [f"station:{station_id}"] + ([f"maker:{maker_id}"] if maker_id else [])
+        with reserved_writes(*write_keys):
+            save_station_status({
                 'station_id': station_id,
                 'in_use': False,
                 'active_maker_id': None,
-                'updated_at': 'now()'
-            }, on_conflict='station_id').execute()
+                'updated_at': released_at
+            }, station_status)
             
-            return jsonify({"error": "Maker not found, but station status updated"}), 404
-        
-        maker = maker_response.data[0]
-        
-        # Update maker_status to 'idle' and clear station_id
-        supabase.table('maker_status').upsert({
-            'maker_id': maker_id,
-            'status': 'idle',
-            'station_id': None,
-            'updated_at': 'now()'
-        }, on_conflict='maker_id').execute()
-        
-        # Update station_status - set in_use to False and clear active_maker_id
-        supabase.table('station_status').upsert({
-            'station_id': station_id,
-            'in_use': False,
-            'active_maker_id': None,
-            'updated_at': 'now()'
-        }, on_conflict='station_id').execute()
-        
-        # Prepare data for response and WebSocket broadcast
-        event_data = {
-            "maker": {
-                "id": maker_id,
-                "display_name": maker['display_name'],
-                "external_label": maker['external_label'],
-                "status": "idle"
-            },
-            "station": {
-                "id": station_id,
-                "name": station['name'],
-                "in_use": False
-            }
-        }
+            # Only reset the maker if they're still recorded at this station
+            if maker_id:
+                maker_status = find_maker_status(maker_id)
+                if maker_status and maker_status.get('station_id') == station_id:
+                    save_maker_status({
+                        'maker_id': maker_id,
+                        'status': 'idle',
+                        'station_id': None,
+                        'updated_at': now_iso()
+                    }, maker_status)
+                    released_maker_id = maker_id
         
-        # Broadcast to all connected WebSocket clients
         if _socketio:
-            _socketio.emit('station_left', event_data)
-            print(f"WebSocket: Emitted 'station_left' - {maker['display_name']} left {station['name']}")
-        
-        return jsonify({
-            "success": True,
-            "message": f"Maker '{maker['display_name']}' left station '{station['name']}'",
-            **event_data
-        }), 200
-        
-    except Exception as e:
-        print(f"Error in station_leave: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+            _socketio.emit('station_left', roster_feed.event(
+                maker_id=released_maker_id, station_id=station_id, status='idle' if released_maker_id else None,
+                in_use=False, at=released_at, reason='heartbeat_timeout'
+            ))
+        # Names for the log only - from memory
+        station = live_state.station(station_id)
+        maker = live_state.maker(released_maker_id) if released_maker_id else None
+        print(f"Presence: released station {station['name'] if station else station_id} "
+              f"(no heartbeat{' from ' + maker['display_name'] if maker else ''})")
+
+
+def expire_station(station_id):
+    """Presence sweeper callback: the station went quiet, release it like a leave."""
+    with journal.event('station_expired'):
+        run_with_retries(_release_expired_station, station_id)
 
 
 
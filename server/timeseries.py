@@ -0,0 +1,212 @@
+"""
+Recent occupancy history for the dashboard sparklines.
+
+A sampler thread records, every TIMESERIES_RESOLUTION seconds:
+
+- site: stations in use, makers present, violations in that interval
+- per station: in use (0/1), violations in that interval
+
+into fixed-size ring buffers covering the last TIMESERIES_WINDOW seconds.
+The buffers are preallocated arrays (one set per station, made the first
+time the station is seen), so a sample only overwrites slots - nothing is
+allocated per sample and nothing is read from the database. The current
+values come from the live state change stream (see LiveState.add_listener);
+violations are counted by the violation route.
+
+Served from /timeseries, and pushed to dashboards as a 'timeseries_tick'
+event every TIMESERIES_EMIT_INTERVAL seconds with the samples since the last
+tick. Like the presence wheel, the buffers are per process.
+"""
+import sys
+import os
+import time
+from array import array
+from threading import Lock, Thread
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import TIMESERIES_RESOLUTION, TIMESERIES_WINDOW, TIMESERIES_EMIT_INTERVAL
+
+# Violations per interval are stored as unsigned shorts
+MAX_COUNT = 0xFFFF
+
+
+class StationSeries:
+    """Ring buffers for one station, plus violations seen since the last sample."""
+
+    __slots__ = ('occupied', 'violations', 'pending')
+
+    def __init__(self, size):
+        self.occupied = array('B', bytes(size))
+        self.violations = array('H', bytes(2 * size))
+        self.pending = 0
+
+
+class TimeSeries:
+    """Site-wide and per-station samples at a fixed resolution, in preallocated rings."""
+
+    def __init__(self, resolution, window, emit_interval):
+        self.resolution = resolution
+        self.size = max(1, int(window / resolution))
+        self.emit_interval = emit_interval
+        self._lock = Lock()
+        self.site = {
+            'occupied': array('H', bytes(2 * self.size)),
+            'makers': array('H', bytes(2 * self.size)),
+            'violations': array('H', bytes(2 * self.size)),
+        }
+        self.stations = {}          # station_id -> StationSeries
+        self._occupied = set()      # station ids in use right now
+        self._present = set()       # maker ids checked in right now
+        self._pending = 0           # site violations since the last sample
+        self._first_tick = None
+        self._last_tick = None      # tick (time // resolution) of the newest sample
+        self._state = None
+        self._thread = None
+
+    # ------------------------------------------------------------
+    # Current values (from the live state)
+    # ------------------------------------------------------------
+    def attach(self, state):
+        self._state = state
+        state.add_listener(self._on_change)
+        self._sync()
+
+    def _on_change(self, change):
+        kind = change[0]
+        if kind == 'reload':
+            self._sync()
+            return
+        with self._lock:
+            if kind == 'set' and change[1] == 'station_status':
+                row = change[2]
+                self._station(row['station_id'])
+                if row.get('in_use'):
+                    self._occupied.add(row['station_id'])
+                else:
+                    self._occupied.discard(row['station_id'])
+            elif kind == 'del' and change[1] == 'station_status':
+                self._occupied.discard(change[2])
+            elif kind == 'set' and change[1] == 'maker_status':
+                self._present.add(change[2]['maker_id'])
+            elif kind == 'del' and change[1] == 'maker_status':
+                self._present.discard(change[2])
+            elif kind == 'clear':
+                self._occupied.clear()
+                self._present.clear()
+            elif kind == 'roster' and change[1] == 'stations':
+                self._station(change[2]['id'])
+
+    def _sync(self):
+        if self._state is None:
+            return
+        maker_status, station_status = self._state.status_rows()
+        station_ids = self._state.station_ids()
+        with self._lock:
+            for station_id in station_ids:
+                self._station(station_id)
+            self._occupied = {ss['station_id'] for ss in station_status if ss.get('in_use')}
+            self._present = {ms['maker_id'] for ms in maker_status}
+            for station_id in self._occupied:
+                self._station(station_id)
+
+    def _station(self, station_id):
+        series = self.stations.get(station_id)
+        if series is None:
+            series = self.stations[station_id] = StationSeries(self.size)
+        return series
+
+    def record_violation(self, station_id):
+        with self._lock:
+            self._pending += 1
+            self._station(station_id).pending += 1
+
+    # ------------------------------------------------------------
+    # Sampling
+    # ------------------------------------------------------------
+    def sample(self, tick):
+        """Write the current values into the slots for `tick` (and any ticks skipped since the last one)."""
+        with self._lock:
+            if self._last_tick is None:
+                self._first_tick = self._last_tick = tick - 1
+            # After a stall, fill the gap with the current values (at most one full ring)
+            for t in range(max(self._last_tick + 1, tick - self.size + 1), tick + 1):
+                slot = t % self.size
+                self.site['occupied'][slot] = len(self._occupied)
+                self.site['makers'][slot] = len(self._present)
+                self.site['violations'][slot] = min(self._pending, MAX_COUNT)
+                self._pending = 0
+                for station_id, series in self.stations.items():
+                    series.occupied[slot] = station_id in self._occupied
+                    series.violations[slot] = min(series.pending, MAX_COUNT)
+                    series.pending = 0
+            self._last_tick = max(self._last_tick, tick)
+
+    def start(self, socketio=None):
+        if self._thread:
+            return
+        self._thread = Thread(target=self._run, args=(socketio,), name='timeseries-sampler', daemon=True)
+        self._thread.start()
+        print(f"Time series: sampling every {self.resolution:g}s, keeping {self.size * self.resolution:g}s")
+
+    def _run(self, socketio):
+        last_emit = None
+        while True:
+            # Sleep to the next tick boundary so samples line up with wall-clock seconds
+            now = time.time()
+            time.sleep(self.resolution - (now % self.resolution))
+            tick = int(time.time() // self.resolution)
+            try:
+                self.sample(tick)
+                if socketio and self.emit_interval > 0:
+                    if last_emit is None:
+                        last_emit = tick - 1
+                    if (tick - last_emit) * self.resolution >= self.emit_interval:
+                        socketio.emit('timeseries_tick', self.window(samples=tick - last_emit))
+                        last_emit = tick
+            except Exception as e:
+                print(f"Time series: sampling failed: {str(e)}")
+
+    # ------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------
+    def window(self, seconds=None, samples=None, step=1, station_id=None):
+        """
+        The newest samples, oldest first. `step` > 1 merges that many samples
+        into one (the peak for occupancy and makers, the sum for violations).
+        """
+        with self._lock:
+            if self._last_tick is None:
+                return {"resolution": self.resolution, "step": step, "end": None, "site": {}, "stations": {}}
+            if samples is None:
+                samples = int((seconds or self.size * self.resolution) / self.resolution)
+            count = max(0, min(samples, self.size, self._last_tick - self._first_tick))
+            first = self._last_tick - count + 1
+            slots = [t % self.size for t in range(first, self._last_tick + 1)]
+
+            def read(values, merge):
+                out = [values[slot] for slot in slots]
+                if step > 1:
+                    out = [merge(out[i:i + step]) for i in range(0, len(out), step)]
+                return out
+
+            if station_id:
+                stations = {station_id: self.stations[station_id]} if station_id in self.stations else {}
+            else:
+                stations = self.stations
+            return {
+                "resolution": self.resolution,
+                "step": step,
+                "end": (self._last_tick + 1) * self.resolution,
+                "site": {
+                    "occupied": read(self.site['occupied'], max),
+                    "makers": read(self.site['makers'], max),
+                    "violations": read(self.site['violations'], sum),
+                },
+                "stations": {
+                    sid: {"occupied": read(series.occupied, max), "violations": read(series.violations, sum)}
+                    for sid, series in stations.items()
+                },
+            }
+
+
+timeseries = TimeSeries(TIMESERIES_RESOLUTION, TIMESERIES_WINDOW, TIMESERIES_EMIT_INTERVAL)
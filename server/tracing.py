@@ -0,0 +1,110 @@
+"""
+Trace helpers for following a camera event from the Viam edge module,
+through the Flask routes and database writes, to the dashboard.
+
+The edge stamps each event with a trace_id and the time the frame was
+captured. Routes open a Trace for the request, time each stage with
+trace.span(...), and attach trace.to_dict() to the WebSocket payload so the
+dashboard can work out the remaining delivery/render latency.
+"""
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock
+
+# Keep the last few hundred traces around for the /traces debug route
+MAX_RECENT_TRACES = 500
+
+_recent_traces = deque(maxlen=MAX_RECENT_TRACES)
+_recent_lock = Lock()
+
+
+class Trace:
+    """Span timings for a single event as it moves through the server."""
+
+    def __init__(self, trace_id, event, captured_at=None, inference_ms=None):
+        self.trace_id = trace_id
+        self.event = event
+        self.captured_at = captured_at
+        self.inference_ms = inference_ms
+        self.received_at = time.time()
+        self._start = time.perf_counter()
+        self.spans = {}
+
+    @contextmanager
+    def span(self, name):
+        """Time a stage of the request (e.g. 'db_lookup', 'db_write', 'emit')."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.spans[name] = round(self.spans.get(name, 0) + elapsed_ms, 3)
+
+    def to_dict(self):
+        """Serializable breakdown, sent along with the WebSocket event."""
+        edge_ms = None
+        if self.captured_at is not None:
+            # Frame capture -> request received (inference + edge HTTP)
+            edge_ms = round((self.received_at - self.captured_at) * 1000, 3)
+
+        return {
+            "trace_id": self.trace_id,
+            "event": self.event,
+            "captured_at": self.captured_at,
+            "received_at": self.received_at,
+            "inference_ms": self.inference_ms,
+            "edge_ms": edge_ms,
+            "server_ms": round((time.perf_counter() - self._start) * 1000, 3),
+            "spans": dict(self.spans),
+            "emitted_at": time.time()
+        }
+
+    def finish(self):
+        """Record the finished trace and log its per-stage breakdown."""
+        summary = self.to_dict()
+        with _recent_lock:
+            _recent_traces.append(summary)
+
+        stages = ", ".join(f"{name}={ms}ms" for name, ms in summary['spans'].items())
+        edge = f"{summary['edge_ms']}ms" if summary['edge_ms'] is not None else "n/a"
+        print(f"Trace {self.trace_id} [{self.event}]: edge={edge} "
+              f"server={summary['server_ms']}ms ({stages})")
+        return summary
+
+
+def _as_float(value):
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def start_trace(request, data, event):
+    """
+    Open a Trace for an incoming request.
+
+    The trace id comes from the X-Trace-Id header or the 'trace_id' body
+    field; if the edge didn't send one (older modules) a new id is generated.
+    """
+    data = data or {}
+    trace_id = request.headers.get('X-Trace-Id') or data.get('trace_id') or uuid.uuid4().hex
+
+    return Trace(
+        trace_id,
+        event,
+        captured_at=_as_float(data.get('captured_at')),
+        inference_ms=_as_float(data.get('inference_ms'))
+    )
+
+
+def recent_traces(limit=100, event=None):
+    """Most recent finished traces, newest first."""
+    with _recent_lock:
+        traces = list(_recent_traces)
+
+    if event:
+        traces = [t for t in traces if t['event'] == event]
+
+    return traces[::-1][:limit]
@@ -0,0 +1,113 @@
+"""
+Versioned writes for the live status rows (maker_status, station_status).
+
+Each row has a `version` that goes up by one on every write. A route reads
+the row, decides, and saves with the version it read; the save only lands if
+nobody else wrote the row in between (compare-and-swap), otherwise it raises
+VersionConflict. Views wrapped in @retry_on_conflict then run again from the
+top - re-reading the rows - up to CAS_MAX_RETRIES times before answering 409.
+
+Where the check happens:
+- normally, in the database: `update ... where <key> = ? and version = ?`
+  (or an insert for a row that didn't exist, which fails if it now does)
+- with WRITE_BEHIND, or while the database is unavailable, against the
+  in-memory copy (which is authoritative then); the queued database write
+  carries the same expected version, and a conflict there reloads the row
+  from the database (see write_behind.py)
+
+The striped locks (locks.py) already serialize transitions inside one
+process, so conflicts come from other server instances.
+"""
+import random
+import sys
+import os
+import time
+from functools import wraps
+
+from flask import jsonify
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import CAS_MAX_RETRIES
+from live_state import live_state
+from write_behind import (
+    VersionConflict, cas_write, cas_delete, persist, reserve, release, memory_is_authoritative
+)
+
+# Short randomized pause between attempts so racing writers spread out
+RETRY_BASE_DELAY = 0.01
+
+
+def version_of(row):
+    """Version of a row as read (None if there is no row)."""
+    if not row:
+        return None
+    return row.get('version') or 0
+
+
+def _save(table, key_column, row, current):
+    expected = version_of(current)
+    new_row = {**row, 'version': (expected or 0) + 1}
+    key = row[key_column]
+    op = cas_write(table, new_row, {key_column: key}, expected, key=f"{key_column.split('_')[0]}:{key}")
+
+    if memory_is_authoritative():
+        # Room in the write queue first: if there is none the route answers
+        # 503 and memory hasn't changed
+        reserve(op.key)
+        if not live_state.compare_and_set(table, new_row, expected):
+            release(op.key)
+            raise VersionConflict(f"{table} {key} changed since it was read")
+        persist(op, reserved=True)
+    else:
+        persist(op)
+        live_state.set_status(table, new_row)
+    return new_row
+
+
+def save_maker_status(row, current):
+    """Write a maker_status row read as `current` (None if it didn't exist). Returns the row with its new version."""
+    return _save('maker_status', 'maker_id', row, current)
+
+
+def save_station_status(row, current):
+    """Write a station_status row read as `current` (None if it didn't exist). Returns the row with its new version."""
+    return _save('station_status', 'station_id', row, current)
+
+
+def remove_maker_status(maker_id, current):
+    """Delete a maker_status row, provided it is still the version read as `current`."""
+    expected = version_of(current)
+    op = cas_delete('maker_status', {'maker_id': maker_id}, expected, key=f"maker:{maker_id}")
+
+    if memory_is_authoritative():
+        reserve(op.key)
+        if not live_state.compare_and_remove('maker_status', maker_id, expected):
+            release(op.key)
+            raise VersionConflict(f"maker_status {maker_id} changed since it was read")
+        persist(op, reserved=True)
+    else:
+        persist(op)
+        live_state.remove_maker_status(maker_id)
+
+
+def run_with_retries(fn, *args, **kwargs):
+    """Call fn, calling it again on VersionConflict (re-raised after CAS_MAX_RETRIES retries)."""
+    for attempt in range(CAS_MAX_RETRIES + 1):
+        try:
+            return fn(*args, **kwargs)
+        except VersionConflict as e:
+            if attempt == CAS_MAX_RETRIES:
+                raise
+            print(f"Version conflict ({str(e)}), retrying ({attempt + 1}/{CAS_MAX_RETRIES})")
+            time.sleep(random.uniform(0, RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+def retry_on_conflict(view):
+    """Re-run a view on VersionConflict; answers 409 if it keeps losing."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            return run_with_retries(view, *args, **kwargs)
+        except VersionConflict as e:
+            return jsonify({"error": f"Concurrent update, please retry ({str(e)})"}), 409
+    return wrapper
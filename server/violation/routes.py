@@ -1,9 +1,35 @@
 from flask import Blueprint, request, jsonify
 from threading import Timer
+from datetime import datetime, timezone
 import sys
 import os
+import uuid
+import base64
+import binascii
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import supabase
+from database import DatabaseUnavailable
+from tracing import start_trace
+from live_state import (
+    now_iso, roster_maker, roster_station, find_maker_status
+)
+from write_behind import persist, insert, update, flush, reserved_writes
+from idempotency import idempotent
+from admission import admit
+from journal import journal, journaled
+from versioned import save_maker_status, run_with_retries, retry_on_conflict, VersionConflict
+from snapshots import submit_snapshot, find_duplicate, MAX_SNAPSHOT_BYTES
+from locks import state_locks, hold_station, maker_key, LockTimeout
+from presence import presence
+from analytics import analytics
+from timeseries import timeseries
+from roster import roster_feed
+
+# Violation ids per resolve request (they go in the URL)
+MAX_RESOLVE_IDS = 100
+
+# Above this many, 'violations_resolved' tells dashboards to reload instead of listing ids
+MAX_BROADCAST_IDS = 1000
 
 violation_bp = Blueprint('violation', __name__, url_prefix='/violation')
 
@@ -15,8 +41,18 @@ def set_socketio(socketio):
     global _socketio
     _socketio = socketio
 
+# Called with the ids of each resolved batch (server.py drops them from degraded /state)
+_resolved_listeners = []
+
+def on_resolved(listener):
+    _resolved_listeners.append(listener)
+
 
 @violation_bp.route('/create', methods=['POST'])
+@idempotent
+@admit()
+@journaled('violation')
+@retry_on_conflict
 def create_violation():
     """
     Create a violation - called when a station detects a safety violation.
@@ -25,9 +61,26 @@ def create_violation():
     {
         "station_id": "uuid",                    # The station UUID (required)
         "violation_type": "GOGGLES_NOT_WORN",   # Type of violation (required)
-        "image_url": "optional_url"             # Optional snapshot URL
+        "image_url": "optional_url",            # Optional snapshot URL
+        "image_base64": "...",                  # Optional raw frame (JPEG/PNG), base64
+        "image_hash": "f0e1d2c3b4a59687"        # Optional dHash of the frame (hex)
     }
     
+    The frame can also be sent as multipart/form-data, with the fields above
+    as form fields and the frame in an "image" file part. It is encoded and
+    uploaded in the background; once stored, the violation's image_url is set
+    and a 'violation_image_ready' event is broadcast.
+    
+    An edge that already sent a near-identical frame for this maker can send
+    just "image_hash"; the stored image is reused. If nothing matches, the
+    response has "snapshot_needed": true so the edge sends the frame next time.
+    
+    Optional tracing fields: "trace_id", "captured_at", "inference_ms".
+    The trace_id is stored on the violation row.
+    
+    An "Idempotency-Key" header (or "idempotency_key" field) makes retries safe:
+    a repeat with the same key gets the original response back.
+    
     Flow:
     1. Validate station_id and violation_type
     2. Look up which maker is currently at the station
@@ -35,11 +88,28 @@ def create_violation():
     4. Update maker_status to 'violation'
     5. Broadcast 'violation_detected' event via WebSocket
     """
-    data = request.get_json()
+    snapshot = None
+    if request.files.get('image'):
+        data = request.form.to_dict()
+        image = request.files['image']
+        image.stream.seek(0)  # the view runs again on a version conflict
+        snapshot = image.read()
+    else:
+        data = request.get_json(silent=True)
     
     if not data:
         return jsonify({"error": "Missing request body"}), 400
     
+    if data.get('image_base64'):
+        try:
+            snapshot = base64.b64decode(data['image_base64'], validate=True)
+        except (binascii.Error, ValueError):
+            return jsonify({"error": "image_base64 is not valid base64"}), 400
+    
+    if snapshot is not None and len(snapshot) > MAX_SNAPSHOT_BYTES:
+        return jsonify({"error": "Snapshot image too large"}), 413
+    
+    trace = start_trace(request, data, 'violation_create')
     station_id = data.get('station_id')
     violation_type = data.get('violation_type')
     image_url = data.get('image_url')  # Optional
@@ -56,145 +126,308 @@ def create_violation():
     
     try:
         # 1. Look up the station
-        station_response = supabase.table('stations').select('*').eq('id', station_id).execute()
+        with trace.span('db_lookup'):
+            station = roster_station(station_id)
         
-        if not station_response.data or len(station_response.data) == 0:
+        if not station:
             return jsonify({"error": f"Station with id '{station_id}' not found"}), 404
         
-        station = station_response.data[0]
-        
         # 2. Check who's currently at this station from station_status
-        station_status_response = supabase.table('station_status').select('*').eq('station_id', station_id).execute()
-        
-        if not station_status_response.data or len(station_status_response.data) == 0:
-            return jsonify({"error": "No status record for this station"}), 400
-        
-        station_status = station_status_response.data[0]
-        
-        # Check if station is in use
-        if not station_status.get('in_use'):
-            return jsonify({"error": "Station is not currently in use"}), 400
-        
-        maker_id = station_status.get('active_maker_id')
-        
-        if not maker_id:
-            return jsonify({"error": "No active maker at this station"}), 400
-        
-        # 3. Get the maker details
-        maker_response = supabase.table('makers').select('*').eq('id', maker_id).execute()
-        
-        if not maker_response.data or len(maker_response.data) == 0:
-            return jsonify({"error": "Maker not found"}), 404
-        
-        maker = maker_response.data[0]
-        
-        # # 4. Check if there's already an active (unresolved) violation for this maker at this station
-        # # to avoid duplicate violations
-        # existing_violation = supabase.table('violations').select('*').eq(
-        #     'maker_id', maker_id
-        # ).eq(
-        #     'station_id', station_id
-        # ).is_(
-        #     'resolved_at', 'null'
-        # ).execute()
-        
-        # if existing_violation.data and len(existing_violation.data) > 0:
-        #     return jsonify({
-        #         "success": False,
-        #         "message": "Violation already active for this maker at this station",
-        #         "existing_violation_id": existing_violation.data[0]['id']
-        #     }), 409  # Conflict
-        
-        # 5. Create the violation record
-        violation_data = {
-            'maker_id': maker_id,
-            'station_id': station_id,
-            'violation_type': violation_type
-        }
-        if image_url:
-            violation_data['image_url'] = image_url
-            
-        violation_response = supabase.table('violations').insert(violation_data).execute()
-        violation = violation_response.data[0]
-        
-        # 6. Update maker_status to 'violation'
-        supabase.table('maker_status').upsert({
-            'maker_id': maker_id,
-            'status': 'violation',
-            'station_id': station_id,
-            'updated_at': 'now()'
-        }, on_conflict='maker_id').execute()
-
-        # 7. Schedule status reset after 15 seconds
-        def reset_maker_status():
-            try:
-                # Check if maker is still at the station, if no clear maker status and clear station status
-                maker_status_response = supabase.table('maker_status').select('*').eq('maker_id', maker_id).execute()
-                if not maker_status_response.data or len(maker_status_response.data) == 0:
-                    return jsonify({"error": "Maker not found"}), 404
+        # (the station and that maker stay locked until the violation is recorded)
+        with hold_station(station_id, trace=trace) as station_status:
+            if not station_status:
+                return jsonify({"error": "No status record for this station"}), 400
+        
+            # Check if station is in use
+            if not station_status.get('in_use'):
+                return jsonify({"error": "Station is not currently in use"}), 400
+        
+            maker_id = station_status.get('active_maker_id')
+        
+            if not maker_id:
+                return jsonify({"error": "No active maker at this station"}), 400
+        
+            # 3. Get the maker details
+            with trace.span('db_lookup'):
+                maker = roster_maker(maker_id)
+        
+            if not maker:
+                return jsonify({"error": "Maker not found"}), 404
+        
+            # # 4. Check if there's already an active (unresolved) violation for this maker at this station
+            # # to avoid duplicate violations
+            # existing_violation = supabase.table('violations').select('*').eq(
+            #     'maker_id', maker_id
+            # ).eq(
+            #     'station_id', station_id
+            # ).is_(
+            #     'resolved_at', 'null'
+            # ).execute()
+        
+            # if existing_violation.data and len(existing_violation.data) > 0:
+            #     return jsonify({
+            #         "success": False,
+            #         "message": "Violation already active for this maker at this station",
+            #         "existing_violation_id": existing_violation.data[0]['id']
+            #     }), 409  # Conflict
+        
+            # 5. Create the violation record
+            # id and created_at are assigned here so the event can be broadcast
+            # before the row is written (write-behind mode)
+            violation = {
+                'id': str(uuid.uuid4()),
+                'maker_id': maker_id,
+                'station_id': station_id,
+                'violation_type': violation_type,
+                'trace_id': trace.trace_id,
+                'created_at': now_iso()
+            }
+        
+            # Frame omitted by the edge as a near-duplicate - reuse the stored image
+            snapshot_needed = False
+            if not snapshot and not image_url and data.get('image_hash'):
+                existing = find_duplicate(station_id, maker_id, data['image_hash'])
+                if existing:
+                    image_url, violation['thumbnail_url'] = existing
+                else:
+                    snapshot_needed = True
+        
+            if image_url:
+                violation['image_url'] = image_url
+        
+            # 6. Update maker_status to 'violation'
+            maker_status_row = {
+                'maker_id': maker_id,
+                'status': 'violation',
+                'station_id': station_id,
+                'updated_at': now_iso()
+            }
+            with trace.span('db_lookup'):
+                maker_status = find_maker_status(maker_id)
+        
+            # Status first: if it loses a version race the view re-runs, and
+            # the violation must not have been inserted yet
+            with trace.span('db_write'), reserved_writes(f"maker:{maker_id}", f"station:{station_id}"):
+                save_maker_status(maker_status_row, maker_status)
+                persist(insert('violations', violation, key=f"station:{station_id}"))
+            presence.touch(station_id)
+            analytics.record_violation(violation_type)
+            timeseries.record_violation(station_id)
+
+            # 7. Schedule status reset after 15 seconds
+            def reset_once():
+                with state_locks.hold(maker_key(maker_id)):
+                    # Check if maker is still at the station; if not, leave their status alone
+                    maker_status = find_maker_status(maker_id)
+                    if not maker_status:
+                        return False
                 
-                maker_status = maker_status_response.data[0]
-                if maker_status.get('station_id') != station_id:
-                    return jsonify({"error": "Maker is not at the station"}), 400
+                    if maker_status.get('station_id') != station_id:
+                        return False
                 
-                supabase.table('maker_status').upsert({
-                    'maker_id': maker_id,
-                    'status': 'active',
-                    'station_id': station_id,
-                    'updated_at': 'now()'
-                }, on_conflict='maker_id').execute()
+                    active_row = {
+                        'maker_id': maker_id,
+                        'status': 'active',
+                        'station_id': station_id,
+                        'updated_at': now_iso()
+                    }
+                    save_maker_status(active_row, maker_status)
+                    return active_row['updated_at']
+            
+            def reset_maker_status():
+                try:
+                    with journal.event('violation_cleared'):
+                        cleared_at = run_with_retries(reset_once)
+                    if not cleared_at:
+                        return
                 
-                print(f"Maker status reset to 'active' after violation for {maker['display_name']}")
+                    print(f"Maker status reset to 'active' after violation for {maker['display_name']}")
                 
-                # Emit event to notify frontend
-                if _socketio:
-                    _socketio.emit('maker_status_updated', {
-                        'id': maker_id,
-                        'status': 'active',
-                        'display_name': maker['display_name']
-                    })
-            except Exception as e:
-                print(f"Error resetting maker status: {str(e)}")
+                    # Emit event to notify frontend
+                    if _socketio:
+                        _socketio.emit('maker_status_updated', roster_feed.event(
+                            maker_id=maker_id, status='active', at=cleared_at, trace_id=trace.trace_id
+                        ))
+                except Exception as e:
+                    print(f"Error resetting maker status: {str(e)}")
                 
-        # Schedule the reset for 15 seconds from now
-        timer = Timer(15.0, reset_maker_status)
-        timer.daemon = True
-        timer.start()
-        
-        # 8. Prepare data for response and WebSocket broadcast
-        event_data = {
-            "violation": {
-                "id": violation['id'],
-                "violation_type": violation_type,
-                "image_url": image_url,
-                "created_at": violation['created_at']
-            },
-            "maker": {
-                "id": maker_id,
-                "display_name": maker['display_name'],
-                "external_label": maker['external_label'],
-                "status": "violation"
-            },
-            "station": {
-                "id": station_id,
-                "name": station['name'],
-                "in_use": True
+            # Schedule the reset for 15 seconds from now
+            timer = Timer(15.0, reset_maker_status)
+            timer.daemon = True
+            timer.start()
+        
+            # 8. Prepare data for response and WebSocket broadcast
+            event_data = {
+                "violation": {
+                    "id": violation['id'],
+                    "violation_type": violation_type,
+                    "image_url": image_url,
+                    "thumbnail_url": violation.get('thumbnail_url'),
+                    "image_pending": bool(snapshot),
+                    "created_at": violation['created_at'],
+                    "trace_id": trace.trace_id
+                },
+                "maker": {
+                    "id": maker_id,
+                    "display_name": maker['display_name'],
+                    "external_label": maker['external_label'],
+                    "status": "violation"
+                },
+                "station": {
+                    "id": station_id,
+                    "name": station['name'],
+                    "in_use": True
+                }
             }
-        }
         
-        # 9. Broadcast to all connected WebSocket clients
-        if _socketio:
-            _socketio.emit('violation_detected', event_data)
-            print(f"WebSocket: Emitted 'violation_detected' - {maker['display_name']} at {station['name']}: {violation_type}")
+            # 9. Broadcast to all connected WebSocket clients (ids only - see roster.py)
+            if _socketio:
+                with trace.span('emit'):
+                    _socketio.emit('violation_detected', roster_feed.event(
+                        violation=event_data['violation'], maker_id=maker_id, station_id=station_id,
+                        status='violation', in_use=True, trace=trace.to_dict()
+                    ))
+                print(f"WebSocket: Emitted 'violation_detected' - {maker['display_name']} at {station['name']}: {violation_type}")
+        
+            # 10. Encode and upload the snapshot off the request thread
+            if snapshot:
+                violation_id = violation['id']
+            
+                def on_snapshot_ready(stored_url, thumbnail_url):
+                    persist(update(
+                        'violations',
+                        {'image_url': stored_url, 'thumbnail_url': thumbnail_url},
+                        {'id': violation_id},
+                        key=f"station:{station_id}"
+                    ))
+                    if _socketio:
+                        _socketio.emit('violation_image_ready', {
+                            'violation_id': violation_id,
+                            'image_url': stored_url,
+                            'thumbnail_url': thumbnail_url
+                        })
+            
+                with trace.span('snapshot_submit'):
+                    submit_snapshot(violation_id, station_id, maker_id, snapshot, request.host_url, on_snapshot_ready)
+        
+            return jsonify({
+                "success": True,
+                "message": f"Violation '{violation_type}' recorded for {maker['display_name']} at {station['name']}",
+                **event_data,
+                "snapshot_needed": snapshot_needed,
+                "trace": trace.finish()
+            }), 201
+        
+    except (LockTimeout, DatabaseUnavailable) as e:
+        return jsonify({"error": str(e)}), 503
+    except VersionConflict:
+        raise
+    except Exception as e:
+        print(f"Error creating violation: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@violation_bp.route('/resolve', methods=['POST'])
+@idempotent
+@admit()
+@journaled('violation_resolve')
+def resolve_violations():
+    """
+    Resolve open violations - one, a list, or everything matching a filter.
+    
+    Expects JSON body with at least one of:
+    {
+        "violation_id": "uuid",          # one violation
+        "violation_ids": ["uuid", ...],  # up to MAX_RESOLVE_IDS of them
+        "maker_id": "uuid",              # every open violation of this maker
+        "station_id": "uuid",            # ... at this station
+        "before": "2026-10-01T00:00:00Z" # ... created before this time
+    }
+    The filters combine (e.g. a maker's violations at one station before a date).
+    
+    All matching open violations get the same resolved_at in a single
+    set-based update, and dashboards get one 'violations_resolved' event
+    with their ids (or {"reload": true} past MAX_BROADCAST_IDS). Resolved
+    violations leave /state and are moved to the archive on its next run.
+    Resolving doesn't change maker status; that goes back to 'active' on its
+    own after a violation.
+    """
+    data = request.get_json(silent=True)
+    
+    if not data:
+        return jsonify({"error": "Missing request body"}), 400
+    
+    ids = list(data.get('violation_ids') or [])
+    if data.get('violation_id'):
+        ids.append(data['violation_id'])
+    maker_id = data.get('maker_id')
+    station_id = data.get('station_id')
+    before = data.get('before')
+    
+    if not (ids or maker_id or station_id or before):
+        return jsonify({"error": "Give violation_id(s), maker_id, station_id or before"}), 400
+    
+    if len(ids) > MAX_RESOLVE_IDS:
+        return jsonify({"error": f"At most {MAX_RESOLVE_IDS} violation_ids per request"}), 400
+    
+    if before:
+        try:
+            before = datetime.fromisoformat(str(before).replace('Z', '+00:00'))
+        except ValueError:
+            return jsonify({"error": f"Invalid 'before' timestamp: {before}"}), 400
+        if before.tzinfo is None:
+            before = before.replace(tzinfo=timezone.utc)
+    
+    if not supabase:
+        return jsonify({"error": "Database connection not available"}), 500
+    
+    # Resolving has to reach the database; don't queue it behind an outage
+    if supabase.degraded:
+        return jsonify({"error": "Database unavailable, try again later"}), 503
+    
+    try:
+        # Violations still queued (write-behind) must exist before they can be resolved
+        flush()
+        
+        resolved_at = now_iso()
+        query = supabase.table('violations').update({'resolved_at': resolved_at}).is_('resolved_at', 'null')
+        if ids:
+            query = query.in_('id', ids)
+        if maker_id:
+            query = query.eq('maker_id', maker_id)
+        if station_id:
+            query = query.eq('station_id', station_id)
+        if before:
+            query = query.lt('created_at', before.isoformat())
+        resolved = query.execute().data or []
+        
+        resolved_ids = [v['id'] for v in resolved]
+        for listener in _resolved_listeners:
+            try:
+                listener(resolved_ids)
+            except Exception as e:
+                print(f"Resolve listener failed: {str(e)}")
+        
+        # One broadcast for the whole set
+        if _socketio and resolved_ids:
+            if len(resolved_ids) > MAX_BROADCAST_IDS:
+                payload = {"count": len(resolved_ids), "resolved_at": resolved_at, "reload": True}
+            else:
+                payload = {"violation_ids": resolved_ids, "count": len(resolved_ids), "resolved_at": resolved_at}
+            _socketio.emit('violations_resolved', roster_feed.event(**payload))
+            print(f"WebSocket: Emitted 'violations_resolved' - {len(resolved_ids)} violation(s)")
         
         return jsonify({
             "success": True,
-            "message": f"Violation '{violation_type}' recorded for {maker['display_name']} at {station['name']}",
-            **event_data
-        }), 201
+            "resolved": len(resolved_ids),
+            "resolved_at": resolved_at,
+            "violation_ids": resolved_ids[:MAX_BROADCAST_IDS]
+        }), 200
         
+    except DatabaseUnavailable as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
-        print(f"Error creating violation: {str(e)}")
+        print(f"Error resolving violations: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 
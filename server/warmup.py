@@ -0,0 +1,95 @@
+"""
+Boot-time warm-up and readiness.
+
+Importing the server does no network I/O: the Supabase client is created on
+first use (see config.py / database.py). Right after startup, a background
+thread runs the warm-up steps in order - connect to the database and load the
+roster and live status into memory, then fill the read caches - so the first
+camera events after a deploy find a connected client and a warm live state
+instead of paying for both.
+
+A step that fails is retried with exponential backoff (1s, 2s, 4s, ... capped
+at WARMUP_RETRY_MAX seconds) until it succeeds, so a database that is down at
+boot is picked up when it comes back rather than never.
+
+GET /ready answers 200 once every required step has succeeded and 503 until
+then, with each step's progress - point the load balancer's (or
+run_workers.py's) readiness check at it. A live state rebuilt from the local
+journal lets the server answer from memory meanwhile, but it isn't "ready"
+until the database load has succeeded, and it stops being ready while the
+circuit breaker is open.
+"""
+import sys
+import os
+import time
+from threading import Thread, Lock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import WARMUP_RETRY_MAX
+
+
+class Warmup:
+    """Ordered warm-up steps run once in the background, retried until they succeed."""
+
+    def __init__(self, retry_max):
+        self.retry_max = retry_max
+        self._lock = Lock()
+        self._steps = []            # (name, fn, required)
+        self._progress = {}         # name -> {"done", "attempts", "ms", "error"}
+        self._started_at = None
+        self._thread = None
+
+    def step(self, name, fn, required=True):
+        """Add a step. fn() raises to fail; required steps gate readiness."""
+        with self._lock:
+            self._steps.append((name, fn, required))
+            self._progress[name] = {"done": False, "required": required, "attempts": 0,
+                                    "ms": None, "error": None}
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._started_at = time.time()
+        self._thread = Thread(target=self._run, name='warmup', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        for name, fn, _ in self._steps:
+            self._attempt(name, fn)
+
+    def _attempt(self, name, fn):
+        delay = 1.0
+        while True:
+            start = time.time()
+            try:
+                fn()
+            except Exception as e:
+                with self._lock:
+                    progress = self._progress[name]
+                    progress["attempts"] += 1
+                    progress["error"] = str(e)
+                print(f"Warm-up '{name}' failed (retrying in {delay:.0f}s): {str(e)}")
+                time.sleep(delay)
+                delay = min(delay * 2, self.retry_max)
+                continue
+            with self._lock:
+                progress = self._progress[name]
+                progress["attempts"] += 1
+                progress.update(done=True, error=None, ms=round((time.time() - start) * 1000, 1))
+            print(f"Warm-up '{name}' done in {progress['ms']}ms")
+            return
+
+    def ready(self):
+        with self._lock:
+            return all(p["done"] for p in self._progress.values() if p["required"])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ready": all(p["done"] for p in self._progress.values() if p["required"]),
+                "uptime_s": round(time.time() - self._started_at, 1) if self._started_at else None,
+                "steps": {name: dict(p) for name, p in self._progress.items()},
+            }
+
+
+warmup = Warmup(WARMUP_RETRY_MAX)
@@ -0,0 +1,216 @@
+"""
+Compact binary wire format (MessagePack) for edge events and dashboard frames.
+
+Edge -> server: an event can be POSTed as Content-Type application/x-msgpack
+instead of JSON. The body is a map using the integer field keys of the
+shared schema (FIELDS, version WIRE_SCHEMA_VERSION), e.g.
+
+    {"v": 1, "r": "9f2c61d0", 0: 3, 1: "67", 3: "5c1e..."}
+
+- "v" is the schema version; a body for another version is rejected (400)
+- station ids can be sent as their index in the station table from
+  GET /wire/schema; "r" is that table's token. When the stations change the
+  token does too, and a stale one gets 409 - fetch the schema again
+- field 8 ("image") carries the snapshot as raw bytes instead of base64
+
+The routes don't change: request.get_json() returns the decoded body with
+the usual field names (WireRequest). Responses are MessagePack too when the
+request's Accept header prefers application/x-msgpack. JSON stays the
+default and works everywhere.
+
+Server -> dashboard: with WIRE_FORMAT=msgpack, Socket.IO frames use the
+MessagePack serializer. That's all-or-nothing per server - every client has
+to connect with a msgpack parser (socket.io-msgpack-parser in the browser),
+so leave it at 'json' for the dashboard and test_websocket.html as they are.
+
+bench_wire.py compares encode/decode time and bytes per event. Needs
+msgpack (optional); without it only JSON is accepted.
+"""
+import base64
+import json
+import sys
+import os
+import zlib
+from threading import Lock
+
+from flask import Request, request, jsonify
+from werkzeug.exceptions import BadRequest
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+    print("msgpack not installed - edge events and WebSocket frames are JSON only")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import WIRE_FORMAT
+
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+
+WIRE_SCHEMA_VERSION = 1
+
+# Edge event fields by integer key. Append only - the index is the key.
+FIELDS = (
+    'station_id',       # 0  uuid, or its index in the station table
+    'external_label',   # 1
+    'violation_type',   # 2
+    'trace_id',         # 3
+    'captured_at',      # 4
+    'inference_ms',     # 5
+    'image_hash',       # 6
+    'image_url',        # 7
+    'image',            # 8  raw frame bytes (image_base64 in JSON)
+    'idempotency_key',  # 9
+)
+
+VERSION_KEY = 'v'
+STATIONS_TOKEN_KEY = 'r'
+
+
+class WireSchemaChanged(Exception):
+    """A body used station indexes from an outdated station table."""
+
+
+class StationTable:
+    """Station ids <-> small integers: their position in the sorted id list."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.ids = []
+        self.token = '0'
+        self._state = None
+
+    def attach(self, state):
+        self._state = state
+        state.add_listener(self._on_change)
+        self.rebuild()
+
+    def _on_change(self, change):
+        if change[0] == 'reload' or (change[0] == 'roster' and change[1] == 'stations'):
+            self.rebuild()
+
+    def rebuild(self):
+        ids = sorted(self._state.station_ids()) if self._state else []
+        with self._lock:
+            if ids != self.ids:
+                self.ids = ids
+                # Same stations -> same token, on every worker and across restarts
+                self.token = f"{zlib.crc32(','.join(ids).encode('utf-8')):08x}"
+
+    def lookup(self, index, token):
+        with self._lock:
+            if token != self.token or not 0 <= index < len(self.ids):
+                raise WireSchemaChanged(f"station table is at {self.token}, request used {token}")
+            return self.ids[index]
+
+    def schema(self):
+        with self._lock:
+            return {
+                "version": WIRE_SCHEMA_VERSION,
+                "fields": list(FIELDS),
+                "stations_token": self.token,
+                "stations": list(self.ids),
+                "socketio": socketio_serializer(),
+            }
+
+
+station_table = StationTable()
+
+
+def decode_event(raw):
+    """MessagePack edge event -> the dict a JSON body would have given."""
+    payload = msgpack.unpackb(raw, raw=False, strict_map_key=False)
+    if not isinstance(payload, dict):
+        raise ValueError("body is not a map")
+    version = payload.pop(VERSION_KEY, WIRE_SCHEMA_VERSION)
+    if version != WIRE_SCHEMA_VERSION:
+        raise ValueError(f"unsupported wire schema version {version}")
+    token = payload.pop(STATIONS_TOKEN_KEY, None)
+
+    data = {}
+    for key, value in payload.items():
+        if isinstance(key, int):
+            if not 0 <= key < len(FIELDS):
+                raise ValueError(f"unknown field key {key}")
+            key = FIELDS[key]
+        data[key] = value
+
+    if isinstance(data.get('station_id'), int):
+        data['station_id'] = station_table.lookup(data['station_id'], token)
+    if isinstance(data.get('image'), bytes):
+        data['image_base64'] = base64.b64encode(data.pop('image')).decode('ascii')
+    return data
+
+
+class WireRequest(Request):
+    """Request whose get_json() also reads MessagePack bodies."""
+
+    @property
+    def is_msgpack(self):
+        return msgpack is not None and self.mimetype == MSGPACK_MIMETYPE
+
+    @property
+    def is_json(self):
+        return self.is_msgpack or super().is_json
+
+    def get_json(self, force=False, silent=False, cache=True):
+        if not self.is_msgpack:
+            return super().get_json(force=force, silent=silent, cache=cache)
+        if cache and hasattr(self, '_wire_body'):
+            return self._wire_body
+        try:
+            body = decode_event(self.get_data(cache=True))
+        except WireSchemaChanged:
+            # Silent callers (the idempotency key lookup) move on; the view gets the 409
+            if silent:
+                return None
+            raise
+        except Exception as e:
+            if silent:
+                return None
+            raise BadRequest(f"Invalid MessagePack body: {str(e)}")
+        if cache:
+            self._wire_body = body
+        return body
+
+
+def _wants_msgpack():
+    if msgpack is None:
+        return False
+    # Only when asked for explicitly - */* and plain JSON clients get JSON
+    accept = request.accept_mimetypes
+    return accept[MSGPACK_MIMETYPE] > accept['application/json']
+
+
+def socketio_serializer():
+    """Serializer name for SocketIO(serializer=...)."""
+    return 'msgpack' if WIRE_FORMAT == 'msgpack' and msgpack else 'default'
+
+
+def init_wire(app, state):
+    """Accept MessagePack edge events on `app` and serve the schema at /wire/schema."""
+    app.request_class = WireRequest
+    station_table.attach(state)
+
+    @app.errorhandler(WireSchemaChanged)
+    def wire_schema_changed(e):
+        return jsonify({"error": str(e), "wire_schema_changed": True}), 409
+
+    @app.route('/wire/schema')
+    def get_wire_schema():
+        """Field keys and station table for MessagePack edge events (see wire.py)."""
+        return jsonify(station_table.schema()), 200
+
+    @app.after_request
+    def encode_response(response):
+        if (
+            response.mimetype == 'application/json'
+            and response.status_code != 304
+            and not response.is_streamed
+            and 'Content-Encoding' not in response.headers
+            and _wants_msgpack()
+        ):
+            response.set_data(msgpack.packb(json.loads(response.get_data())))
+            response.mimetype = MSGPACK_MIMETYPE
+        response.vary.add('Accept')
+        return response
@@ -0,0 +1,459 @@
+"""
+Write-behind persistence for live state changes.
+
+Routes describe each database change as a WriteOp and hand it to persist().
+With WRITE_BEHIND off the op runs immediately (the original behaviour). With
+it on, the op is queued and written by a background worker:
+
+- Status rows are written compare-and-swap (see versioned.py). A version
+  conflict isn't retried - another server instance changed the row, so the
+  in-memory copy is reloaded from the database instead.
+- Ops are sharded by an ordering key ('maker:<id>' / 'station:<id>'), so all
+  writes for one maker or one station are applied in the order they happened.
+- Each worker drains up to WRITE_BEHIND_BATCH_SIZE ops at a time and merges
+  runs of upserts/inserts on the same table into one request.
+- Failed batches are retried with exponential backoff.
+- Queues are bounded and ops never jump the queue. A route reserves room
+  for its write (reserve()) before it changes the in-memory state; if the
+  shard stays full for ENQUEUE_TIMEOUT the reservation fails with
+  WriteQueueFull (a DatabaseUnavailable, so the route answers 503) and
+  nothing has changed.
+- On shutdown (SIGTERM/SIGINT, or a normal exit) the queues are drained
+  before the process exits.
+
+The same queue carries writes through a database outage (the circuit
+breaker in database.py is open) even with WRITE_BEHIND off: ops wait in the
+queue, don't use up their retries, and drain once the database is back.
+Routes take room for all of a transition's writes up front
+(reserved_writes()), so once an outage has filled the queue, new events are
+answered 503 without touching the in-memory state - memory never holds a
+change that has no queued write behind it.
+Until they have, the in-memory live state answers reads (see
+memory_is_authoritative()).
+"""
+import atexit
+import sys
+from contextlib import contextmanager
+import os
+import time
+import zlib
+from queue import Queue, Empty
+from threading import BoundedSemaphore, Lock, Thread, local
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from database import DatabaseUnavailable
+from config import (
+    supabase,
+    WRITE_BEHIND,
+    WRITE_BEHIND_WORKERS,
+    WRITE_BEHIND_QUEUE_SIZE,
+    WRITE_BEHIND_BATCH_SIZE,
+    WRITE_BEHIND_MAX_RETRIES,
+)
+
+# Backoff between retries: 0.1s, 0.2s, 0.4s, ... capped at 5s
+RETRY_BASE_DELAY = 0.1
+RETRY_MAX_DELAY = 5.0
+
+# How long a request waits for room in a full shard before answering 503
+ENQUEUE_TIMEOUT = 2.0
+
+
+class VersionConflict(Exception):
+    """A compare-and-swap write found the row at a different version than expected."""
+
+
+class WriteQueueFull(DatabaseUnavailable):
+    """No room in the write queue (or it is shutting down) - the write wasn't accepted."""
+
+
+# Postgres unique_violation - an insert raced another insert of the same row
+UNIQUE_VIOLATION = '23505'
+
+
+class WriteOp:
+    """A single database change: upsert/insert a row, or update/delete matching rows."""
+
+    __slots__ = ('table', 'action', 'row', 'on_conflict', 'match', 'key', 'expected_version')
+
+    def __init__(self, table, action, row=None, on_conflict=None, match=None, key=None, expected_version=None):
+        self.table = table
+        self.action = action            # 'upsert' | 'insert' | 'update' | 'delete' | 'cas_write' | 'cas_delete'
+        self.row = row
+        self.on_conflict = on_conflict
+        self.match = match or {}        # column -> value equality filters
+        self.key = key or table         # ordering key
+        self.expected_version = expected_version
+
+    def execute(self, client):
+        if self.action in ('cas_write', 'cas_delete'):
+            return self._execute_cas(client)
+
+        query = client.table(self.table)
+        if self.action == 'upsert':
+            query = query.upsert(self.row, on_conflict=self.on_conflict)
+        elif self.action == 'insert':
+            query = query.insert(self.row)
+        elif self.action == 'update':
+            query = query.update(self.row)
+        elif self.action == 'delete':
+            query = query.delete()
+        else:
+            raise ValueError(f"Unknown write action '{self.action}'")
+
+        for column, value in self.match.items():
+            query = query.eq(column, value)
+        return query.execute()
+
+    def _execute_cas(self, client):
+        """
+        Write only if the row is still at expected_version (None = the row
+        must not exist yet). Raises VersionConflict otherwise.
+        """
+        if self.expected_version is None:
+            if self.action == 'cas_delete':
+                return None
+            try:
+                return client.table(self.table).insert(self.row).execute()
+            except Exception as e:
+                if str(getattr(e, 'code', '')) == UNIQUE_VIOLATION:
+                    raise VersionConflict(f"{self.table} {self.match} was created concurrently")
+                raise
+
+        if self.action == 'cas_delete':
+            query = client.table(self.table).delete()
+        else:
+            query = client.table(self.table).update(self.row)
+        for column, value in self.match.items():
+            query = query.eq(column, value)
+        response = query.eq('version', self.expected_version).execute()
+
+        if not response.data:
+            raise VersionConflict(f"{self.table} {self.match} is no longer at version {self.expected_version}")
+        return response
+
+
+def upsert(table, row, on_conflict, key):
+    return WriteOp(table, 'upsert', row=row, on_conflict=on_conflict, key=key)
+
+
+def insert(table, row, key):
+    return WriteOp(table, 'insert', row=row, key=key)
+
+
+def update(table, row, match, key):
+    return WriteOp(table, 'update', row=row, match=match, key=key)
+
+
+def delete(table, match, key):
+    return WriteOp(table, 'delete', match=match, key=key)
+
+
+def cas_write(table, row, match, expected_version, key):
+    return WriteOp(table, 'cas_write', row=row, match=match, key=key, expected_version=expected_version)
+
+
+def cas_delete(table, match, expected_version, key):
+    return WriteOp(table, 'cas_delete', match=match, key=key, expected_version=expected_version)
+
+
+def _coalesce(ops):
+    """
+    Merge consecutive upserts/inserts on the same table into single bulk ops.
+
+    Repeated upserts of the same row within a run collapse to the last one
+    (Postgres rejects a bulk upsert that touches a row twice). Updates and
+    deletes are kept as-is so their position in the sequence is preserved.
+    """
+    merged = []
+    for op in ops:
+        prev = merged[-1] if merged else None
+        mergeable = (
+            prev is not None
+            and op.action in ('upsert', 'insert')
+            and prev.action == op.action
+            and prev.table == op.table
+            and prev.on_conflict == op.on_conflict
+        )
+        if not mergeable:
+            rows = [op.row] if op.action in ('upsert', 'insert') else op.row
+            merged.append(WriteOp(op.table, op.action, rows, op.on_conflict, op.match, op.key, op.expected_version))
+            continue
+
+        if op.action == 'upsert':
+            prev.row = [r for r in prev.row if r[op.on_conflict] != op.row[op.on_conflict]]
+        prev.row.append(op.row)
+    return merged
+
+
+class WriteBehindQueue:
+    """Sharded, bounded write queue with one worker thread per shard."""
+
+    def __init__(self, client, workers, queue_size, batch_size, max_retries):
+        self._client = client
+        self._batch_size = batch_size
+        self._max_retries = max_retries
+        # The queues themselves are unbounded; capacity is the slots, taken
+        # by reserve() before a write and given back once it has been applied
+        self._queues = [Queue() for _ in range(workers)]
+        self._slots = [BoundedSemaphore(max(1, queue_size // workers)) for _ in range(workers)]
+        self._threads = []
+        self._stopping = False
+        # Counters, bumped from every worker thread
+        self._stats_lock = Lock()
+        self.written = 0
+        self.failed = 0
+        self.conflicts = 0
+
+        for index, q in enumerate(self._queues):
+            thread = Thread(target=self._run, args=(q, self._slots[index]), name=f"write-behind-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _count(self, counter):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _shard(self, key):
+        return zlib.crc32(key.encode('utf-8')) % len(self._queues)
+
+    def reserve(self, key, timeout=ENQUEUE_TIMEOUT):
+        """Take room for one write with this ordering key, waiting up to `timeout`."""
+        if self._stopping:
+            raise WriteQueueFull("server is shutting down")
+        if not self._slots[self._shard(key)].acquire(timeout=timeout):
+            raise WriteQueueFull(f"write queue full ({self.pending()} pending writes)")
+
+    def release(self, key):
+        """Give back a reservation that won't be used."""
+        self._slots[self._shard(key)].release()
+
+    def submit(self, op, reserved=False):
+        """Queue op behind every earlier op for its key (reserving room first unless `reserved`)."""
+        if not reserved:
+            self.reserve(op.key)
+        self._queues[self._shard(op.key)].put(op)
+
+    def pending(self):
+        # Includes the batch a worker is currently writing (or holding through an outage)
+        return sum(q.unfinished_tasks for q in self._queues)
+
+    def flush(self):
+        """Block until every queued write has been applied (or given up on)."""
+        for q in self._queues:
+            q.join()
+
+    def shutdown(self, timeout=10.0):
+        """Drain the queues and stop the workers."""
+        if self._stopping:
+            return
+        pending = self.pending()
+        if pending:
+            print(f"Write-behind: draining {pending} pending writes...")
+        self._stopping = True
+        for q in self._queues:
+            q.put(None)
+        deadline = time.time() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.time()))
+
+    def _run(self, q, slots):
+        while True:
+            op = q.get()
+            if op is None:
+                q.task_done()
+                return
+
+            batch = [op]
+            while len(batch) < self._batch_size:
+                try:
+                    nxt = q.get_nowait()
+                except Empty:
+                    break
+                if nxt is None:
+                    # Put the stop marker back so the loop exits after this batch
+                    q.task_done()
+                    q.put(None)
+                    break
+                batch.append(nxt)
+
+            try:
+                for merged in _coalesce(batch):
+                    self._write_with_retry(merged)
+            finally:
+                for _ in batch:
+                    q.task_done()
+                    slots.release()
+
+    def _write_with_retry(self, op):
+        attempt = 0
+        while True:
+            try:
+                op.execute(self._client)
+                self._count('written')
+                return
+            except VersionConflict as e:
+                # Another instance got there first - the database wins
+                self._count('conflicts')
+                print(f"Write-behind: {str(e)}, reloading from the database")
+                _reload_row(self._client, op)
+                return
+            except DatabaseUnavailable as e:
+                # Outage: hold the write until the breaker lets a call through again
+                if self._stopping:
+                    self._count('failed')
+                    print(f"Write-behind: database unavailable at shutdown, dropping {op.action} {op.table} ({op.key})")
+                    return
+                time.sleep(max(self._client.breaker.retry_in(), RETRY_BASE_DELAY))
+            except Exception as e:
+                if attempt == self._max_retries:
+                    self._count('failed')
+                    print(f"Write-behind: giving up on {op.action} {op.table} ({op.key}): {str(e)}")
+                    return
+                delay = min(RETRY_BASE_DELAY * (2 ** attempt), RETRY_MAX_DELAY)
+                print(f"Write-behind: {op.action} {op.table} failed ({str(e)}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+
+
+def _reload_row(client, op):
+    """Replace the in-memory copy of a status row with what the database has."""
+    from live_state import live_state
+    try:
+        query = client.table(op.table).select('*')
+        for column, value in op.match.items():
+            query = query.eq(column, value)
+        rows = query.execute().data
+        live_state.replace_status(op.table, op.match, rows[0] if rows else None)
+    except Exception as e:
+        print(f"Write-behind: could not reload {op.table} {op.match}: {str(e)}")
+
+
+_queue = None
+_queue_lock = Lock()
+
+
+def _create_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = WriteBehindQueue(
+                supabase,
+                WRITE_BEHIND_WORKERS,
+                WRITE_BEHIND_QUEUE_SIZE,
+                WRITE_BEHIND_BATCH_SIZE,
+                WRITE_BEHIND_MAX_RETRIES,
+            )
+            atexit.register(_queue.shutdown)
+    return _queue
+
+
+if WRITE_BEHIND and supabase:
+    _create_queue()
+    print(f"Write-behind persistence enabled ({WRITE_BEHIND_WORKERS} workers)")
+
+
+def memory_is_authoritative():
+    """
+    Should reads and compare-and-swap checks use the in-memory live state?
+    Yes in write-behind mode, while the database is down, and while writes
+    queued during an outage are still draining.
+    """
+    return WRITE_BEHIND or supabase.degraded or pending_writes() > 0
+
+
+# Slots taken up front by reserved_writes() on this thread, not yet used
+_held = local()
+
+
+def reserve(key):
+    """
+    Room in the write queue for one op with this ordering key, taken before
+    the in-memory state changes. Raises WriteQueueFull (503) if there is none.
+    Pass reserved=True to persist() to use it, or give it back with release().
+    Uses a slot already held by reserved_writes() if there is one.
+    """
+    held = getattr(_held, 'keys', None)
+    if held and key in held:
+        held.remove(key)
+        return
+    (_queue or _create_queue()).reserve(key)
+
+
+def release(key):
+    _queue.release(key)
+
+
+@contextmanager
+def reserved_writes(*keys):
+    """
+    Reserve room for every write a transition will make before it makes the
+    first one, so a full queue (say, through a long outage) turns the whole
+    request away with 503 instead of failing halfway with memory half
+    changed. Slots left unused are given back on exit. Does nothing while
+    writes go straight to the database.
+    """
+    if not memory_is_authoritative():
+        yield
+        return
+    queue = _queue or _create_queue()
+    taken = []
+    try:
+        for key in keys:
+            queue.reserve(key)
+            taken.append(key)
+    except WriteQueueFull:
+        for key in taken:
+            queue.release(key)
+        raise
+    _held.keys = taken
+    try:
+        yield
+    finally:
+        for key in _held.keys:
+            queue.release(key)
+        _held.keys = None
+
+
+def persist(*ops, reserved=False):
+    """
+    Apply database changes - queued in write-behind mode or during an outage,
+    otherwise immediately. Returns the responses when written inline (None
+    when queued). reserved=True: room for every op was already reserved.
+    """
+    if reserved or memory_is_authoritative():
+        queue = _queue or _create_queue()
+        for op in ops:
+            if not reserved:
+                reserve(op.key)   # a slot held by reserved_writes(), or a new one
+            queue.submit(op, reserved=True)
+        return None
+
+    responses = []
+    for index, op in enumerate(ops):
+        try:
+            responses.append(op.execute(supabase))
+        except DatabaseUnavailable as e:
+            # The database went away mid-request: queue this write and the rest
+            print(f"Database unavailable ({str(e)}), queueing {len(ops) - index} write(s)")
+            queue = _queue or _create_queue()
+            for queued in ops[index:]:
+                queue.submit(queued)
+            return None
+    return responses
+
+
+def flush():
+    """Wait for queued writes to land (used before bulk operations like reset)."""
+    if _queue:
+        _queue.flush()
+
+
+def shutdown():
+    """Drain queued writes and stop the workers (on SIGTERM/SIGINT, see server.py)."""
+    if _queue:
+        _queue.shutdown()
+
+
+def pending_writes():
+    return _queue.pending() if _queue else 0
@@ -1,6 +1,11 @@
-from typing import ClassVar, Mapping, Optional, Sequence, Tuple
+from typing import ClassVar, Dict, Mapping, Optional, Sequence, Tuple
+import base64
+import io
 import json
+import time
+import urllib.error
 import urllib.request
+import uuid
 
 from viam.services.vision import VisionClient
 from viam.proto.app.robot import ComponentConfig
@@ -12,11 +17,96 @@ from viam.services.generic import Generic
 from viam.utils import ValueTypes
 from viam import logging
 
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 LOGGER = logging.getLogger(__name__)
 
 STATION_ID = "ed98c79b-5809-470d-8ac6-e99617eaa2ca"
 BASE_URL = "http://10.112.85.14:8080"
 
+# Near-identical snapshots for the same maker are sent as a hash only; the
+# server reuses the image it already stored. Resend the full frame at least this often.
+SNAPSHOT_DEDUP_DISTANCE = 6
+SNAPSHOT_RESEND_SECONDS = 600
+
+# Event POSTs carry an idempotency key, so a request that got no answer is resent
+POST_RETRIES = 1
+
+# "msgpack" sends events as MessagePack with the server's integer field keys
+# and station indexes (GET /wire/schema) and the snapshot as raw bytes.
+# Needs msgpack on the Pi; falls back to JSON without it.
+WIRE_FORMAT = "json"
+MSGPACK_MIMETYPE = "application/x-msgpack"
+
+
+def _dhash(data: bytes) -> Optional[int]:
+    # Same 64-bit difference hash the server uses (9x8 grayscale, left > right)
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.draft("L", (64, 64))  # JPEG: decode at reduced scale, cheap on the Pi
+            pixels = list(image.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    except Exception:
+        return None
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (1 if pixels[row * 9 + col] > pixels[row * 9 + col + 1] else 0)
+    return value
+
+
+def _snapshot_needed(resp: Mapping[str, ValueTypes]) -> bool:
+    try:
+        return bool(json.loads(resp.get("body") or "{}").get("snapshot_needed"))
+    except ValueError:
+        return False
+
+
+def _still_present(resp: Mapping[str, ValueTypes]) -> bool:
+    # The heartbeat says whether the server still has this maker at the station
+    if not resp.get("ok"):
+        return False
+    try:
+        return json.loads(resp.get("body") or "{}").get("present") is not False
+    except ValueError:
+        return False
+
+
+def _summarize(payload: Mapping[str, ValueTypes]) -> Mapping[str, ValueTypes]:
+    # Don't echo the snapshot back through do_command results
+    if "image" in payload:
+        return {**payload, "image": f"<{len(payload['image'])} bytes>"}
+    return payload
+
+
+def _encode_json(payload: Mapping[str, ValueTypes]) -> bytes:
+    # JSON can't carry bytes: the snapshot goes as base64
+    if "image" in payload:
+        image = payload["image"]
+        payload = {k: v for k, v in payload.items() if k != "image"}
+        payload["image_base64"] = base64.b64encode(image).decode("ascii")
+    return json.dumps(payload).encode("utf-8")
+
+
+def _encode_msgpack(payload: Mapping[str, ValueTypes], schema: Mapping[str, ValueTypes]) -> bytes:
+    # Field names -> integer keys, our station id -> its index in the server's table
+    keys = {name: index for index, name in enumerate(schema["fields"])}
+    out = {"v": schema["version"], "r": schema["stations_token"]}
+    for name, value in payload.items():
+        if name == "station_id" and value in schema["stations"]:
+            value = schema["stations"].index(value)
+        out[keys.get(name, name)] = value
+    return msgpack.packb(out)
+
 
 class GenericService(Generic, EasyResource):
     MODEL: ClassVar[Model] = Model(
@@ -26,6 +116,12 @@ class GenericService(Generic, EasyResource):
 
     face_vision: VisionClient
     goggles_vision: VisionClient
+    # maker label -> (hash, sent_at) of the last snapshot uploaded for them
+    sent_snapshots: Dict[str, Tuple[int, float]]
+    # label of the maker the server has at this station (None = station idle)
+    present_label: Optional[str]
+    # server's /wire/schema, fetched on first use when WIRE_FORMAT is "msgpack"
+    wire_schema: Optional[Mapping[str, ValueTypes]]
 
     @classmethod
     def validate_config(cls, config: ComponentConfig) -> Tuple[Sequence[str], Sequence[str]]:
@@ -39,27 +135,78 @@ class GenericService(Generic, EasyResource):
         self = cls(config.name)
         self.face_vision = dependencies[VisionClient.get_resource_name("vision-2")]
         self.goggles_vision = dependencies[VisionClient.get_resource_name("vision-5")]
+        self.sent_snapshots = {}
+        self.present_label = None
+        self.wire_schema = None
         return self
 
+    def _get_wire_schema(self, timeout: Optional[float]) -> Optional[Mapping[str, ValueTypes]]:
+        if WIRE_FORMAT != "msgpack" or msgpack is None:
+            return None
+        if self.wire_schema is None:
+            try:
+                with urllib.request.urlopen(f"{BASE_URL}/wire/schema", timeout=timeout or 5) as resp:
+                    self.wire_schema = json.loads(resp.read())
+            except Exception as e:
+                LOGGER.warning(f"wire schema unavailable, sending JSON: {e!r}")
+                return None
+        return self.wire_schema
+
     def _post_json(
         self,
         url: str,
         payload: Mapping[str, ValueTypes],
         timeout: Optional[float],
+        trace: Optional[Mapping[str, ValueTypes]] = None,
     ) -> Mapping[str, ValueTypes]:
-        data = json.dumps(payload).encode("utf-8")
-        req = urllib.request.Request(
-            url,
-            data=data,
-            headers={"Content-Type": "application/json"},
-            method="POST",
-        )
-        try:
-            with urllib.request.urlopen(req, timeout=timeout or 5) as resp:
-                body = resp.read().decode("utf-8", errors="replace")
-                return {"ok": True, "status": resp.status, "body": body, "sent": payload, "url": url}
-        except Exception as e:
-            return {"ok": False, "error": repr(e), "sent": payload, "url": url}
+        headers = {"Content-Type": "application/json"}
+        if trace:
+            # Stamp the event so the server can attribute latency per stage
+            payload = {**payload, **trace}
+            headers["X-Trace-Id"] = str(trace["trace_id"])
+            # One key per frame (the server scopes it per route), so a resend
+            # of this event is answered from the server's cache, not re-applied
+            headers["Idempotency-Key"] = str(trace["trace_id"])
+        # Retry once if the request never got an answer - safe with the key
+        attempts = POST_RETRIES + 1 if trace else 1
+        schema_refetched = False
+        attempt = 0
+        while attempt < attempts:
+            attempt += 1
+            schema = self._get_wire_schema(timeout)
+            if schema:
+                data = _encode_msgpack(payload, schema)
+                headers.update({"Content-Type": MSGPACK_MIMETYPE, "Accept": MSGPACK_MIMETYPE})
+            else:
+                data = _encode_json(payload)
+                headers.update({"Content-Type": "application/json", "Accept": "application/json"})
+            req = urllib.request.Request(
+                url,
+                data=data,
+                headers=headers,
+                method="POST",
+            )
+            try:
+                with urllib.request.urlopen(req, timeout=timeout or 5) as resp:
+                    raw = resp.read()
+                    if resp.headers.get_content_type() == MSGPACK_MIMETYPE:
+                        # The helpers below read the body as JSON text
+                        body = json.dumps(msgpack.unpackb(raw))
+                    else:
+                        body = raw.decode("utf-8", errors="replace")
+                    return {"ok": True, "status": resp.status, "body": body, "sent": _summarize(payload), "url": url}
+            except urllib.error.HTTPError as e:
+                if e.code == 409 and schema and not schema_refetched:
+                    # Stations changed on the server: refetch the table and send again
+                    self.wire_schema = None
+                    schema_refetched = True
+                    attempt -= 1
+                    continue
+                return {"ok": False, "status": e.code, "error": repr(e), "sent": _summarize(payload), "url": url}
+            except Exception as e:
+                if attempt >= attempts:
+                    return {"ok": False, "error": repr(e), "sent": _summarize(payload), "url": url}
+        return {"ok": False, "error": "no attempts made", "sent": _summarize(payload), "url": url}
 
     async def do_command(
         self,
@@ -68,28 +215,64 @@ class GenericService(Generic, EasyResource):
         timeout: Optional[float] = None,
         **kwargs
     ) -> Mapping[str, ValueTypes]:
+        # One trace per frame; captured_at is taken before inference starts
+        trace_id = uuid.uuid4().hex
+        captured_at = time.time()
+
         # 1) Face detection (vision-2)
         det = await self.face_vision.get_detections_from_camera("camera-2")
+        face_ms = (time.time() - captured_at) * 1000
+        face_trace = {
+            "trace_id": trace_id,
+            "captured_at": captured_at,
+            "inference_ms": round(face_ms, 3),
+        }
 
-        # If no face -> leave
+        # If no face -> leave (once; nothing to do if the station is already idle)
         if not det:
+            if self.present_label is None:
+                return {"ok": True, "skipped": "no face, station already idle"}
+            self.present_label = None
             return self._post_json(
                 f"{BASE_URL}/station/leave",
                 {"station_id": STATION_ID},
                 timeout,
+                face_trace,
             )
 
-        # If face -> enter
+        # If face -> heartbeat if it's the maker already here, otherwise enter.
+        # While the same maker stays in frame the cheap heartbeat replaces
+        # re-posting enter; leave is only sent when they disappear. If the Pi
+        # dies the server releases the station on its own after its presence timeout.
         first_detection = det[0]
-        enter_resp = self._post_json(
-            f"{BASE_URL}/station/enter",
-            {"external_label": first_detection.class_name, "station_id": STATION_ID},
-            timeout,
-        )
+        label = first_detection.class_name
+        enter_resp = None
+        if label == self.present_label:
+            enter_resp = self._post_json(
+                f"{BASE_URL}/station/heartbeat",
+                {"station_id": STATION_ID, "external_label": label},
+                timeout,
+            )
+            if not _still_present(enter_resp):
+                enter_resp = None
+        if enter_resp is None:
+            enter_resp = self._post_json(
+                f"{BASE_URL}/station/enter",
+                {"external_label": label, "station_id": STATION_ID},
+                timeout,
+                face_trace,
+            )
+            self.present_label = label if enter_resp.get("status") == 200 else None
 
         # 2) Goggles classification (vision-5)
-        # Most classification APIs return a list of classifications with a label/class_name + confidence.
-        cls = await self.goggles_vision.get_classifications_from_camera("camera-2", 1)
+        # capture_all returns the classified frame too, so a violation can carry its snapshot
+        # without a second camera read.
+        goggles_start = time.time()
+        capture = await self.goggles_vision.capture_all_from_camera(
+            "camera-2", return_image=True, return_classifications=True
+        )
+        goggles_ms = (time.time() - goggles_start) * 1000
+        cls = capture.classifications
 
         # If the model returns nothing, just report it and stop (keeps behavior safe)
         if not cls:
@@ -104,17 +287,48 @@ class GenericService(Generic, EasyResource):
 
         violation_resp = None
         if not goggles_worn:
+            violation_payload = {
+                "station_id": STATION_ID,
+                "violation_type": "GOGGLES_NOT_WORN",
+            }
+            # Raw frame goes up as-is; the server re-encodes and uploads it in the background.
+            # If it's nearly the same as the last one sent for this maker, send only its hash.
+            frame_hash = None
+            if capture.image is not None:
+                frame_hash = _dhash(capture.image.data)
+                last = self.sent_snapshots.get(label)
+                if (
+                    frame_hash is not None
+                    and last is not None
+                    and bin(frame_hash ^ last[0]).count("1") <= SNAPSHOT_DEDUP_DISTANCE
+                    and time.time() - last[1] < SNAPSHOT_RESEND_SECONDS
+                ):
+                    violation_payload["image_hash"] = f"{frame_hash:016x}"
+                else:
+                    violation_payload["image"] = capture.image.data
+
+            # Same frame, so same trace; inference is both model calls only
+            # (not the enter/heartbeat round trip between them)
             violation_resp = self._post_json(
                 f"{BASE_URL}/violation/create",
+                violation_payload,
+                timeout,
                 {
-                    "station_id": STATION_ID,
-                    "violation_type": "GOGGLES_NOT_WORN",
+                    "trace_id": trace_id,
+                    "captured_at": captured_at,
+                    "inference_ms": round(face_ms + goggles_ms, 3),
                 },
-                timeout,
             )
 
+            if "image" in violation_payload and frame_hash is not None and violation_resp.get("ok"):
+                self.sent_snapshots[label] = (frame_hash, time.time())
+            elif _snapshot_needed(violation_resp):
+                # Server no longer has a matching image - send the full frame next time
+                self.sent_snapshots.pop(label, None)
+
         return {
             "ok": True,
+            "trace_id": trace_id,
             "face_detected": True,
             "entered": enter_resp,
             "goggles_classification": {"label": top_label, "confidence": top_conf},
@@ -1,6 +1,8 @@
 from typing import ClassVar, Mapping, Optional, Sequence, Tuple
 import json
+import time
 import urllib.request
+import uuid
 
 from viam.proto.app.robot import ComponentConfig
 from viam.proto.common import ResourceName
@@ -38,13 +40,14 @@ class GenericService(Generic, EasyResource):
     ) -> Mapping[str, ValueTypes]:
         url = "http://10.112.85.14:8080/login/"
 
-        payload = {"external_label": "67"}
+        trace_id = uuid.uuid4().hex
+        payload = {"external_label": "67", "trace_id": trace_id, "captured_at": time.time()}
         data = json.dumps(payload).encode("utf-8")
 
         req = urllib.request.Request(
             url,
             data=data,
-            headers={"Content-Type": "application/json"},
+            headers={"Content-Type": "application/json", "X-Trace-Id": trace_id, "Idempotency-Key": trace_id},
             method="POST",
         )
 
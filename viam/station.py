@@ -1,6 +1,8 @@
 from typing import ClassVar, Mapping, Optional, Sequence, Tuple
 import json
+import time
 import urllib.request
+import uuid
 
 from viam.services.vision import VisionClient
 
@@ -44,7 +46,10 @@ class GenericService(Generic, EasyResource):
         **kwargs
     ) -> Mapping[str, ValueTypes]:
         LOGGER.error("hello")
+        trace_id = uuid.uuid4().hex
+        captured_at = time.time()
         det = await self.vision.get_detections_from_camera("camera-2")
+        inference_ms = round((time.time() - captured_at) * 1000, 3)
         LOGGER.error(det)
         LOGGER.error(type(det))
         url = "http://10.112.85.14:8080/station/enter"
@@ -53,14 +58,17 @@ class GenericService(Generic, EasyResource):
         first_detection = det[0]
         payload = {
             "external_label": first_detection.class_name, 
-            "station_id": "723740fc-d4d8-4990-998c-5660d3e19898"
+            "station_id": "723740fc-d4d8-4990-998c-5660d3e19898",
+            "trace_id": trace_id,
+            "captured_at": captured_at,
+            "inference_ms": inference_ms,
         }
         data = json.dumps(payload).encode("utf-8")
 
         req = urllib.request.Request(
             url,
             data=data,
-            headers={"Content-Type": "application/json"},
+            headers={"Content-Type": "application/json", "X-Trace-Id": trace_id, "Idempotency-Key": trace_id},
             method="POST",
         )
 